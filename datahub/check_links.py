@@ -1,211 +1,325 @@
 #!/usr/bin/python
 
+"""
+check detailURLs with HEAD requests, a feed's worth at a time.
+
+Links are grouped by host and checked concurrently, reusing one
+connection per host lane and spacing requests to the same host DELAY
+seconds apart.  Results go in one sqlite status table, so the pipeline
+can look a feed's links up in one pass.
+
+usage: check_links.py [url ...]  (or a list of urls on stdin)
+"""
+
 import os
 import sys
-import socket
-import cgi
 import re
+import time
+import random
 import urlparse
-import hashlib
 import httplib
-import urllib
-import random
-
-from datetime import datetime
-from time import sleep
+import sqlite3
+import threading
+import Queue
 
 MAX_WAIT = 7
 USER_AGENT = 'Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)'
-DIR_BAD = '/home/footprint/allforgood-read-only/datahub/bad-links/'
 DIR_CHK = '/home/footprint/allforgood-read-only/datahub/links/'
+LINK_DB_FN = DIR_CHK + 'status.db'
 
 HOUR = (3600)
 DAY = (24 * HOUR)
 WEEK = (7 * DAY)
+# seconds between requests to the same host
 DELAY = 0.75
 
-def get_link_file_name(url):
-  """ """
-
-  return hashlib.md5(url).hexdigest() + '.url'
-
-
-def get_file_age(file):
-  """ """
-
-  stat = os.stat(file)
-  mtime = datetime.fromtimestamp(stat.st_mtime)
-  delta = datetime.now() - mtime
-  return delta.seconds
+# threads checking links
+WORKERS = 8
+# connections open to any one host
+MAX_HOST_CONNECTIONS = 2
 
+# hosts whose pages don't answer HEAD requests sensibly
+SKIP_HOSTS_RX = re.compile(r'volunteermatch\.org|idealist\.org')
 
-def is_checked(url, file_name = None):
-  """ """
-  rtn = False
-  if not file_name:
-    file_name = get_link_file_name(url)
+def is_bad_status(status):
+  """status strings starting with 'bad' are broken links."""
+  return status.startswith('bad')
 
-  if os.path.isfile(DIR_CHK + file_name):
-    rtn = True
 
-  return rtn
+def is_valid_link(url):
+  """urls that are never worth requesting."""
+  return url and len(url) >= 11 and url.lower().find('localhost') < 0
 
 
-def is_marked_bad(url, file_name = None):
-  """ """
-  rtn = False
-  if not file_name:
-    file_name = get_link_file_name(url)
+class LinkStatusStore(object):
+  """url -> (status, time checked)"""
+  def __init__(self, filename=LINK_DB_FN):
+    self.filename = filename
+    self.conn = None
 
-  if os.path.isfile(DIR_BAD + file_name):
-    rtn = True
-
-  return rtn
-
-
-def mark_bad(url, rtn, file_name = None):
-  """ """
-
-  if not file_name:
-    file_name = get_link_file_name(url)
-
-  fh = open(DIR_BAD + file_name, 'w')
-  if fh:
-    if rtn.find('\t' + url) >= 0:
-      fh.write(rtn + '\n')
+  def connect(self):
+    """open the database on first use."""
+    if self.conn:
+      return self.conn
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.isdir(dirname):
+      try:
+        os.makedirs(dirname)
+      except OSError:
+        pass
+    try:
+      self.conn = sqlite3.connect(self.filename, timeout=60.0)
+    except sqlite3.OperationalError:
+      print >> sys.stderr, "can't open", self.filename, "- not saving results"
+      self.conn = sqlite3.connect(':memory:')
+    self.conn.text_factory = str
+    self.conn.execute("CREATE TABLE IF NOT EXISTS links ("
+                      " url TEXT PRIMARY KEY, status TEXT, checked INTEGER)")
+    self.conn.commit()
+    return self.conn
+
+  def get_many(self, urls):
+    """returns {url: (status, checked)} for the urls that are stored."""
+    conn = self.connect()
+    urls = list(urls)
+    found = {}
+    # sqlite allows 999 parameters per statement
+    for i in range(0, len(urls), 500):
+      chunk = urls[i:i + 500]
+      cursor = conn.execute("SELECT url, status, checked FROM links"
+                            " WHERE url IN (" + ",".join(["?"] * len(chunk)) +
+                            ")", chunk)
+      for url, status, checked in cursor:
+        found[url] = (status, checked)
+    return found
+
+  def put_many(self, results):
+    """store a list of (url, status), in one transaction."""
+    conn = self.connect()
+    now = int(time.time())
+    conn.executemany("INSERT OR REPLACE INTO links VALUES (?, ?, ?)",
+                     [(url, status, now) for url, status in results])
+    conn.commit()
+
+  def needs_check(self, stored, recheck):
+    """is a stored (status, checked) too old to trust?"""
+    if not stored or recheck:
+      return True
+    status, checked = stored
+    age = time.time() - checked
+    if is_bad_status(status):
+      return age > WEEK
+    # dont need to check again for at least a week to 10 days
+    # random so we dont hit every single link on the same day
+    return age > WEEK + (DAY * random.choice([0, 1, 2, 3]))
+
+
+class HostRateLimiter(object):
+  """spaces requests to each host at least delay seconds apart."""
+  def __init__(self, delay):
+    self.delay = delay
+    self.lock = threading.Lock()
+    self.next_request = {}
+
+  def wait(self, host):
+    """sleep until it's this host's turn."""
+    self.lock.acquire()
+    try:
+      now = time.time()
+      when = max(now, self.next_request.get(host, now))
+      self.next_request[host] = when + self.delay
+    finally:
+      self.lock.release()
+    if when > now:
+      time.sleep(when - now)
+
+
+class HostLane(object):
+  """a list of urls on one host, checked in turn over one connection."""
+  def __init__(self, scheme, host, urls):
+    self.scheme = scheme
+    self.host = host
+    self.urls = urls
+    self.connection = None
+    # has the open connection already served a request?
+    self.reused = False
+
+  def connect(self):
+    """open (or reopen) the connection."""
+    self.close()
+    if self.scheme == 'https':
+      self.connection = httplib.HTTPSConnection(self.host, timeout=MAX_WAIT)
     else:
-      fh.write(rtn + '\t' + url + '\n')
-    fh.close()
-
-
-def mark_checked(url, rtn, file_name = None):
-  """ """
-
-  if not file_name:
-    file_name = get_link_file_name(url)
-
-  fh = open(DIR_CHK + file_name, 'w')
-  if fh:
-    if rtn.find('\t' + url) >= 0:
-      fh.write(rtn + '\n')
+      self.connection = httplib.HTTPConnection(self.host, timeout=MAX_WAIT)
+    self.reused = False
+
+  def close(self):
+    """close the connection, if any."""
+    if self.connection:
+      self.connection.close()
+      self.connection = None
+
+  def head(self, url):
+    """returns the response status for url, or raises."""
+    url_d = urlparse.urlparse(url)
+    path = url_d.path or '/'
+    if url_d.query:
+      path += '?' + url_d.query
+    self.connection.request('HEAD', path, None, {'User-Agent':USER_AGENT})
+    rsp = self.connection.getresponse()
+    rsp.read()
+    if rsp.will_close:
+      self.close()
     else:
-      fh.write(rtn + '\t' + url + '\n')
-    fh.close()
-
-  return rtn
-
-  
-
-def is_bad_link(url, recheck = False):
-  """ """
-
-  rtn = False
-  if not url or len(url) < 11 or url.lower().find('localhost') >= 0:
-    rtn = True
-  else:
-    file_name = get_link_file_name(url)
-    if not is_checked(url, file_name) or recheck:
-      rsp = check_link(url, recheck, file_name)
-      if rsp.startswith('bad'):
-        rtn = True
-
-  return rtn
-
+      self.reused = True
+    return rsp.status
+
+  def check(self, url):
+    """returns the status string for one url."""
+    for attempt in (0, 1):
+      try:
+        if not self.connection:
+          self.connect()
+      except Exception:
+        return 'bad: could not connect\t' + url
+      reused = self.reused
+      try:
+        status = self.head(url)
+        break
+      except Exception:
+        self.close()
+        if reused:
+          # the server may have dropped the idle connection: try again
+          continue
+        return 'bad: could not get response from\t' + url
+
+    rtn = str(status)
+    if not status in [200, 301, 302]:
+      # special case
+      if status == 404 and url.find('createthegood') >= 0:
+        rtn = 'maybe: ' + rtn
+      else:
+        rtn = 'bad: ' + rtn
+    return rtn
+
+
+def make_lanes(urls):
+  """group urls by host, split across up to MAX_HOST_CONNECTIONS lanes
+  per host, biggest hosts first."""
+  by_host = {}
+  for url in urls:
+    url_d = urlparse.urlparse(url)
+    by_host.setdefault((url_d.scheme.lower(), url_d.netloc.lower()),
+                       []).append(url)
+  lanes = []
+  for (scheme, host), host_urls in by_host.iteritems():
+    numlanes = min(MAX_HOST_CONNECTIONS, len(host_urls))
+    for i in range(numlanes):
+      lanes.append(HostLane(scheme, host, host_urls[i::numlanes]))
+  lanes.sort(key=lambda lane: len(lane.urls), reverse=True)
+  return lanes
+
+
+def fetch_statuses(urls, workers=WORKERS, delay=DELAY):
+  """check urls concurrently, returns a list of (url, status)."""
+  lanes = Queue.Queue()
+  for lane in make_lanes(urls):
+    lanes.put(lane)
+  limiter = HostRateLimiter(delay)
+  results = []
+
+  def worker():
+    """check lanes until there are none left."""
+    while True:
+      try:
+        lane = lanes.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        for url in lane.urls:
+          limiter.wait(lane.host)
+          results.append((url, lane.check(url)))
+      finally:
+        lane.close()
+
+  threads = [threading.Thread(target=worker)
+             for i in range(max(1, min(workers, lanes.qsize())))]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return results
+
+
+def check_statuses(urls, recheck=False, store=None, workers=WORKERS,
+                   delay=DELAY):
+  """returns {url: status} for every url, checking the ones that aren't
+  in the store or are due a recheck."""
+  if store is None:
+    store = LinkStatusStore()
+  statuses = {}
+  to_lookup = set()
+  for url in urls:
+    if not is_valid_link(url):
+      statuses[url] = 'bad: invalid link\t' + url
+    elif SKIP_HOSTS_RX.search(url):
+      # volunteermatch's jsp shows head requests a 404,
+      # idealist requires a login (401)
+      statuses[url] = 'unchecked ' + url
+    else:
+      to_lookup.add(url)
 
-def check_link(url, recheck = False, file_name = None):
-  """ """
+  stored = store.get_many(to_lookup)
+  to_check = []
+  for url in to_lookup:
+    if store.needs_check(stored.get(url), recheck):
+      to_check.append(url)
+    else:
+      statuses[url] = stored[url][0]
 
-  rtn = 'unchecked '
-  if url.find('volunteermatch.org') >= 0:
-    # jsp shows head requests a 404
-    return rtn + url
+  if to_check:
+    results = fetch_statuses(to_check, workers, delay)
+    store.put_many(results)
+    statuses.update(results)
+  return statuses
 
-  if url.find('idealist.org') >= 0:
-    # login required, shows head requests a 401
-    return rtn + url
 
-  if not file_name:
-    file_name = get_link_file_name(url)
+def get_bad_links(urls, recheck=False, store=None):
+  """returns the set of urls that are broken."""
+  return set([url for url, status in
+              check_statuses(urls, recheck, store).iteritems()
+              if is_bad_status(status)])
 
-  if is_checked(url, file_name):
-    rtn = 'checked'
-    last_check = get_file_age(DIR_CHK + file_name)
-    if is_marked_bad(url, file_name) and (last_check > WEEK or (recheck and last_check > DAY)):
-      os.remove(DIR_BAD + file_name)
-    else:
-      # dont need to check again for at least a week to 10 days
-      # random so we dont hit every single link on the same day
-      if not recheck and last_check < (WEEK + (DAY * random.choice([0, 1, 2, 3]))):
-        return rtn
-
-  rtn = 'unchecked unknown error'
-
-  url_d = urlparse.urlparse(url)
-  params = cgi.parse_qs(urlparse.urlsplit(url).query)
-  headers = {'User-Agent':USER_AGENT}
-  default_timeout = socket.getdefaulttimeout()
-  socket.setdefaulttimeout(MAX_WAIT)
-
-  rsp = None
-  connection = None
-  try:
-    connection = httplib.HTTPConnection(url_d.netloc)
-  except:
-    rtn = 'bad: could not connect\t' + url
-
-  if connection:
-    try:
-      connection.request('HEAD', url_d.path, urllib.urlencode(params), headers)
-    except:
-      socket.setdefaulttimeout(default_timeout)
-      rtn = 'bad: could not req response from\t' + url
 
-  if connection:
-    try:
-      rsp = connection.getresponse()
-    except:
-      socket.setdefaulttimeout(default_timeout)
-      rtn = 'bad: could not get response from\t' + url
-
-  socket.setdefaulttimeout(default_timeout)
-
-  if not rsp:
-    mark_bad(url, rtn, file_name)
-  else:
-    rtn = str(rsp.status)
-    if not rsp.status in [200, 301, 302]:
-      # special case
-      if rsp.status == 404 and url.find('createthegood') >= 0:
-        rtn = 'maybe: ' + rtn 
-      else:
-        rtn = 'bad: ' + rtn
-        mark_bad(url, rtn, file_name)
+def check_link(url, recheck=False):
+  """status of a single url."""
+  return check_statuses([url], recheck)[url]
 
-  mark_checked(url, rtn, file_name)
 
-  return rtn
+def is_bad_link(url, recheck=False):
+  """is a single url broken?"""
+  return is_bad_status(check_link(url, recheck))
 
 
 def main():
-
-  if not sys.argv[1:]:
-    for line in sys.stdin:
-      url = line.strip()
-      if url:
-        if not url.lower().startswith('http'):
-          url = 'http://' + url
-        rsp = check_link(url)
-        print rsp + '\t' + url
-        if rsp.find('checked') < 0:
-          sleep(DELAY)
-  else:
-    for arg in sys.argv[1:]:
-      if arg:
-        url = arg.strip()
-        if url:
-          if not url.lower().startswith('http'):
-            url = 'http://' + url
-          print check_link(url, True) + '\t' + url
+  """check urls from the command line (always rechecked) or stdin."""
+  recheck = True
+  urls = sys.argv[1:]
+  if not urls:
+    recheck = False
+    urls = sys.stdin
+  links = []
+  for url in urls:
+    url = url.strip()
+    if url:
+      if not url.lower().startswith('http'):
+        url = 'http://' + url
+      links.append(url)
+
+  statuses = check_statuses(links, recheck)
+  for url in links:
+    print statuses[url] + '\t' + url
 
 if __name__ == "__main__":
   main()
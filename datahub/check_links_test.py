@@ -0,0 +1,144 @@
+ # Copyright 2009 Google Inc.
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #     http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Test for check_links, against a stub HTTP server on localhost
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+import check_links
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """answers HEAD requests by path: /ok, /moved, /missing, /createthegood,
+  and counts connections and requests."""
+  protocol_version = 'HTTP/1.1'
+  STATUS = {'/ok': 200, '/moved': 301, '/missing': 404,
+            '/createthegood': 404}
+
+  def setup(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    self.server.connections += 1
+
+  def do_HEAD(self):
+    """status by path, ignoring the query string."""
+    self.server.requests.append((time.time(), self.path))
+    status = self.STATUS.get(self.path.split('?')[0], 500)
+    self.send_response(status)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """HTTP/1.1 keep-alive server on a free port."""
+  daemon_threads = True
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+    self.connections = 0
+    self.requests = []
+
+
+class TestCheckLinks(unittest.TestCase):
+  """ Unittests on check_links """
+  def setUp(self):
+    """ start the stub server, with a fresh status store """
+    self.server = StubServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.setDaemon(True)
+    self.thread.start()
+    # check_links treats 'localhost' as a bad link, so use the IP
+    self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+    self.tmpdir = tempfile.mkdtemp()
+    self.store = check_links.LinkStatusStore(
+      os.path.join(self.tmpdir, 'status.db'))
+
+  def tearDown(self):
+    """ stop the server """
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.tmpdir)
+
+  def check(self, paths, recheck=False, delay=0.0):
+    """ check_statuses() for paths on the stub server """
+    urls = [self.base + path for path in paths]
+    statuses = check_links.check_statuses(urls, recheck, self.store,
+                                          delay=delay)
+    return [statuses[url] for url in urls]
+
+  def testStatuses(self):
+    """ statuses match what the server answered """
+    self.assertEqual(self.check(['/ok', '/moved', '/missing',
+                                 '/createthegood', '/error']),
+                     ['200', '301', 'bad: 404', 'maybe: 404', 'bad: 500'])
+
+  def testInvalidAndSkipped(self):
+    """ invalid links are bad without a request, skipped hosts aren't """
+    urls = ['http://localhost/ok', 'http://x',
+            'http://www.volunteermatch.org/opp/1']
+    statuses = check_links.check_statuses(urls, store=self.store)
+    self.assertTrue(check_links.is_bad_status(statuses[urls[0]]))
+    self.assertTrue(check_links.is_bad_status(statuses[urls[1]]))
+    self.assertTrue(statuses[urls[2]].startswith('unchecked'))
+    self.assertEqual(self.server.requests, [])
+
+  def testConnectionReuse(self):
+    """ one host's links share at most MAX_HOST_CONNECTIONS connections """
+    paths = ['/ok?id=%d' % i for i in range(20)]
+    self.assertEqual(self.check(paths), ['200'] * 20)
+    self.assertEqual(len(self.server.requests), 20)
+    self.assertTrue(self.server.connections <=
+                    check_links.MAX_HOST_CONNECTIONS)
+
+  def testRateLimit(self):
+    """ requests to one host are spaced by the delay """
+    self.check(['/ok?id=%d' % i for i in range(6)], delay=0.05)
+    times = sorted([when for when, path in self.server.requests])
+    for i in range(1, len(times)):
+      self.assertTrue(times[i] - times[i - 1] >= 0.04)
+
+  def testStore(self):
+    """ stored results aren't rechecked unless asked """
+    self.check(['/ok', '/missing'])
+    self.assertEqual(len(self.server.requests), 2)
+    bad = check_links.get_bad_links([self.base + '/ok',
+                                     self.base + '/missing'],
+                                    store=self.store)
+    self.assertEqual(bad, set([self.base + '/missing']))
+    self.assertEqual(len(self.server.requests), 2)
+    self.check(['/ok', '/missing'], recheck=True)
+    self.assertEqual(len(self.server.requests), 4)
+
+  def testNoServer(self):
+    """ a refused connection is a bad link """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    url = 'http://127.0.0.1:%d/ok' % port
+    status = check_links.check_statuses([url], store=self.store)[url]
+    self.assertTrue(check_links.is_bad_status(status))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index of opportunity signatures seen so far, used by footprint_lib.py to
+drop duplicate opportunities.
+
+Replaces the empty file per opportunity in dups/.  Two backends:
+  MemoryDedupStore -- a dict of signature -> time added, for single-feed runs
+  SqliteDedupStore -- one sqlite file shared by every footprint_lib.py
+                      process in a pipeline run, for cross-feed dedup
+Entries older than max_age are ignored and pruned.
+
+usage: dedup_store.py [--db dups/dedup.db] [--expire] [--stats]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+from optparse import OptionParser
+
+DEDUP_DB_FN = "dups/dedup.db"
+
+# a pipeline run takes a few hours; anything older is from a previous run
+DEFAULT_MAX_AGE = 86400
+
+# seconds to wait for another process's write lock
+LOCK_TIMEOUT = 60.0
+
+class DedupStore(object):
+  """base class: seen(key) is True if key was added before (and hasn't
+  expired), otherwise it adds key and returns False."""
+  def __init__(self, max_age=DEFAULT_MAX_AGE):
+    self.max_age = max_age
+    # counters for this process
+    self.checked = 0
+    self.duplicates = 0
+
+  def seen(self, key):
+    """check-and-add key, counting duplicates."""
+    self.checked += 1
+    if self.check_and_add(key, int(time.time())):
+      self.duplicates += 1
+      return True
+    return False
+
+  def check_and_add(self, key, now):
+    """backend: True if key is present and unexpired, else add it."""
+    raise NotImplementedError
+
+  def size(self):
+    """number of unexpired entries."""
+    raise NotImplementedError
+
+  def expire(self):
+    """drop expired entries, returns how many were dropped."""
+    raise NotImplementedError
+
+  def close(self):
+    """release any resources."""
+    pass
+
+  def stats(self):
+    """counters for reports."""
+    return {'checked': self.checked, 'duplicates': self.duplicates,
+            'entries': self.size()}
+
+
+class MemoryDedupStore(DedupStore):
+  """in-process store, forgotten when the process exits."""
+  def __init__(self, max_age=DEFAULT_MAX_AGE):
+    DedupStore.__init__(self, max_age)
+    # key -> time added
+    self.entries = {}
+
+  def check_and_add(self, key, now):
+    added = self.entries.get(key)
+    if added is not None and (not self.max_age or
+                              added >= now - self.max_age):
+      return True
+    self.entries[key] = now
+    return False
+
+  def size(self):
+    self.expire()
+    return len(self.entries)
+
+  def expire(self):
+    if not self.max_age:
+      return 0
+    cutoff = int(time.time()) - self.max_age
+    expired = [key for key, added in self.entries.iteritems()
+               if added < cutoff]
+    for key in expired:
+      del self.entries[key]
+    return len(expired)
+
+
+class SqliteDedupStore(DedupStore):
+  """store shared between processes through a sqlite file.  The data is
+  disposable (dups/ is wiped every pipeline run), so writes aren't
+  fsync'd."""
+  def __init__(self, filename=DEDUP_DB_FN, max_age=DEFAULT_MAX_AGE):
+    DedupStore.__init__(self, max_age)
+    self.filename = filename
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    # autocommit: every check is visible to the other processes at once
+    self.conn = sqlite3.connect(filename, timeout=LOCK_TIMEOUT,
+                                isolation_level=None)
+    self.conn.execute("PRAGMA synchronous = OFF")
+    self.conn.execute("CREATE TABLE IF NOT EXISTS seen ("
+                      " key TEXT PRIMARY KEY, added INTEGER)")
+
+  def check_and_add(self, key, now):
+    try:
+      return self.check_and_add_row(key, now)
+    except sqlite3.OperationalError:
+      # e.g. locked for longer than LOCK_TIMEOUT: keep the opportunity
+      return False
+
+  def check_and_add_row(self, key, now):
+    """check_and_add() in the database."""
+    cursor = self.conn.execute(
+      "INSERT OR IGNORE INTO seen (key, added) VALUES (?, ?)", (key, now))
+    if cursor.rowcount == 1:
+      return False
+    if not self.max_age:
+      return True
+    # present: a duplicate unless it's expired, in which case re-add it
+    cursor = self.conn.execute(
+      "UPDATE seen SET added = ? WHERE key = ? AND added < ?",
+      (now, key, now - self.max_age))
+    return cursor.rowcount == 0
+
+  def size(self):
+    if not self.max_age:
+      return self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+    return self.conn.execute("SELECT COUNT(*) FROM seen WHERE added >= ?",
+                             (int(time.time()) - self.max_age,)).fetchone()[0]
+
+  def expire(self):
+    if not self.max_age:
+      return 0
+    cursor = self.conn.execute("DELETE FROM seen WHERE added < ?",
+                               (int(time.time()) - self.max_age,))
+    return cursor.rowcount
+
+  def close(self):
+    self.conn.close()
+
+
+def open_dedup_store(backend, max_age=DEFAULT_MAX_AGE):
+  """backend is 'memory' or the filename of a sqlite store."""
+  if backend == "memory":
+    return MemoryDedupStore(max_age)
+  return SqliteDedupStore(backend, max_age)
+
+
+def main():
+  """expire or report on a shared store."""
+  parser = OptionParser("usage: %prog [--db dups/dedup.db] " +
+                        "[--max_age secs] [--expire] [--stats]")
+  parser.add_option("--db", dest="db", default=DEDUP_DB_FN)
+  parser.add_option("--max_age", type="int", dest="max_age",
+                    default=DEFAULT_MAX_AGE)
+  parser.add_option("--expire", action="store_true", dest="expire",
+                    default=False)
+  parser.add_option("--stats", action="store_true", dest="stats",
+                    default=False)
+  (options, args) = parser.parse_args(sys.argv[1:])
+  if not (options.expire or options.stats):
+    parser.print_help()
+    sys.exit(0)
+
+  store = SqliteDedupStore(options.db, options.max_age)
+  if options.expire:
+    print "removed", store.expire(), "expired entries"
+  if options.stats:
+    print store.size(), "entries"
+  store.close()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+benchmark reading an opportunity's fields with get_tag_val() walks of
+the DOM against a DOMRecord, on the opportunities of an FPXML feed
+(plain or .gz).  Each opportunity's fields are read the way
+footprint_lib.convert_opportunity() reads them, several of them more
+than once, and both ways must return the same values.
+
+usage: dom_record_benchmark.py [--repeat N] feed.xml
+"""
+
+import gzip
+import sys
+import time
+from optparse import OptionParser
+
+import xml_helpers as xmlh
+from directfields import DIRECT_FIELDS
+
+# the fields footprint_lib reads from an opportunity besides
+# DIRECT_FIELDS, in order, repeats included
+OPP_FIELDS = ['volunteerOpportunityID', 'detailURL', 'description',
+              'detailURL', 'abstract', 'description', 'paid',
+              'additionalInfoRequired', 'self_directed', 'micro',
+              'detailURL', 'title', 'volunteersNeeded',
+              'volunteerOpportunityID', 'sponsoringOrganizationID',
+              'volunteerHubOrganizationID', 'hubOrganizationID',
+              'affiliateId', 'affiliateOrganizationID', 'detailURL',
+              'contactPhone', 'contactEmail', 'title', 'description',
+              'skills', 'categories', 'audienceTag']
+# and from each of its locations and dateTimeDurations
+LOCATION_FIELDS = ['virtual', 'streetAddress1', 'streetAddress2',
+                   'streetAddress3', 'city', 'region', 'postalCode',
+                   'country', 'latitude', 'longitude', 'name']
+TIME_FIELDS = ['openEnded', 'startDate', 'startTime', 'endDate', 'endTime',
+               'iCalRecurrence', 'duration', 'commitmentHoursPerWeek']
+
+def load_feed(filename, repeat):
+  """returns [opportunity xml strings]."""
+  if filename.endswith(".gz"):
+    infh = gzip.open(filename, "rb")
+  else:
+    infh = open(filename, "r")
+  opps = []
+  for tag, xmlstr in xmlh.iter_records(infh, ['VolunteerOpportunity']):
+    opps.append(xmlstr)
+  infh.close()
+  return opps * repeat
+
+def read_walks(doc):
+  """every field, with a get_tag_val() walk each."""
+  values = [xmlh.get_tag_val(doc, field) for field in OPP_FIELDS]
+  values.extend([xmlh.get_tag_val(doc, field) for field in DIRECT_FIELDS])
+  for node in doc.getElementsByTagName("location"):
+    values.extend([xmlh.get_tag_val(node, field)
+                   for field in LOCATION_FIELDS])
+  for node in doc.getElementsByTagName("dateTimeDuration"):
+    values.extend([xmlh.get_tag_val(node, field) for field in TIME_FIELDS])
+  return values
+
+def read_record(doc):
+  """every field, from DOMRecords."""
+  rec = xmlh.DOMRecord(doc)
+  values = [rec.get_val(field) for field in OPP_FIELDS]
+  values.extend([rec.get_val(field) for field in DIRECT_FIELDS])
+  for node in rec.get_elements("location"):
+    loc = xmlh.DOMRecord(node)
+    values.extend([loc.get_val(field) for field in LOCATION_FIELDS])
+  for node in rec.get_elements("dateTimeDuration"):
+    opptime = xmlh.DOMRecord(node)
+    values.extend([opptime.get_val(field) for field in TIME_FIELDS])
+  return values
+
+def main():
+  """time both, check they agree, print microseconds per record."""
+  parser = OptionParser("usage: %prog [--repeat N] feed.xml")
+  parser.add_option("--repeat", type="int", dest="repeat", default=1,
+                    help="read the feed's opportunities N times over")
+  (options, args) = parser.parse_args(sys.argv[1:])
+  if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+
+  opps = load_feed(args[0], options.repeat)
+  print len(opps), "opportunities,", len(OPP_FIELDS) + len(DIRECT_FIELDS), \
+      "fields each"
+
+  # one DOM at a time: a big feed's DOMs don't all fit in memory
+  elapsed = {read_walks: 0.0, read_record: 0.0}
+  for opp in opps:
+    values = []
+    for read in (read_walks, read_record):
+      doc = xmlh.simple_parser(opp, None, False)
+      start = time.time()
+      values.append(read(doc))
+      elapsed[read] += time.time() - start
+    if values[0] != values[1]:
+      print "ERROR: DOMRecord values differ from get_tag_val()"
+      sys.exit(1)
+
+  for name, read in (("get_tag_val", read_walks),
+                     ("DOMRecord", read_record)):
+    print "%-12s %8.3f secs %10.1f usecs/record" % (
+      name, elapsed[read], 1000000.0 * elapsed[read] / max(len(opps), 1))
+
+if __name__ == "__main__":
+  main()
@@ -25,13 +25,18 @@ import re
 import random
 import htmlentitydefs
 import xml.sax.saxutils as saxutils
+import xml.parsers.expat
+from xml.dom import minidom
 import json
+import StringIO
 
 import subprocess
 import sys
+import time
 import xml_helpers as xmlh
 from datetime import datetime
 import geocoder_mapsV3 as geocoder
+import geocode_batch
 from optparse import OptionParser
 from BeautifulSoup import BeautifulSoup
 
@@ -51,10 +56,11 @@ import parse_diy
 import parse_volunteermatch
 import providers
 import check_links
+import dedup_store
 
 import utf8
 
-from taggers import get_taggers, XMLRecord
+from taggers import get_taggers, TaggingEngine, XMLRecord
 from spreadsheets.process import sheet_list
 from directfields import DIRECT_FIELDS
 
@@ -80,9 +86,23 @@ EIN501 = 0
 FEED = ''
 FEEDSDIR = 'feeds'
 DUPDIR = 'dups' 
+# 'memory', or a sqlite file shared with the other feeds in this run
+DEDUP_BACKEND = DUPDIR + '/dedup.db'
+DEDUP_STORE = None
 
 IGNORE_DUPLICATES = False
 
+# threads geocoding the locations of a batch of opportunities before
+# they're converted; 0 geocodes each location as it's converted
+GEOCODE_WORKERS = geocode_batch.WORKERS
+# opportunities geocoded at a time
+PREGEOCODE_BATCH = 500
+BATCH_GEOCODER = None
+LOCATION_RX = re.compile(r'<location(?:\s[^>]*)?>.*?</location>', re.DOTALL)
+
+# time each output_field() rule, for report_feed_stats()
+PROFILE_FIELDS = False
+
 
 # set a nice long timeout
 import socket
@@ -275,30 +295,136 @@ def print_debug(msg):
 # http://base.google.com/support/bin/answer.py?
 # answer=78170&hl=en#Events%20and%20Activities
 # and worse, you have to change an env var in python...
+TZINFOS = {}
+def get_tzinfo(timezone):
+  """dateutil.tz.tzstr(timezone), or UTC if it can't be parsed."""
+  tzinfo = TZINFOS.get(timezone)
+  if tzinfo is None:
+    try:
+      tzinfo = dateutil.tz.tzstr(timezone)
+    except:
+      tzinfo = dateutil.tz.tzutc()
+    TZINFOS[timezone] = tzinfo
+  return tzinfo
+
+
+# (datestr, timestr, timezone) -> convert_dt_to_gbase() result; feeds
+# repeat the same few dates, so it's emptied when it gets this big
+GBASE_DATES = {}
+GBASE_DATES_SIZE = 10000
+
 def convert_dt_to_gbase(datestr, timestr, timezone):
   """converts dates like YYYY-MM-DD, times like HH:MM:SS and
   timezones like America/New_York, into Google Base format."""
   if datestr.find('0000') == 0:
     return datestr
 
-  dflt = '2000-01-01T00:00:00'
-  try:
-    try:
-      tzinfo = dateutil.tz.tzstr(timezone)
-    except:
-      tzinfo = dateutil.tz.tzutc()
+  key = (datestr, timestr, timezone)
+  res = GBASE_DATES.get(key)
+  if res is not None:
+    return res
 
+  res = '2000-01-01T00:00:00'
+  try:
+    tzinfo = get_tzinfo(timezone)
     timestr = dateutil.parser.parse(datestr + " " + timestr)
     timestr = timestr.replace(tzinfo=tzinfo)
     utc = dateutil.tz.tzutc()
     timestr = timestr.astimezone(utc)
     res = timestr.strftime("%Y-%m-%dT%H:%M:%S")
     res = re.sub(r'Z$', '', res)
-    return res
   except:
     pass
 
-  return dflt
+  if len(GBASE_DATES) >= GBASE_DATES_SIZE:
+    GBASE_DATES.clear()
+  GBASE_DATES[key] = res
+  return res
+
+
+def fix_url(value):
+  """common errors in datafeeds' url fields."""
+  # common error in datafeeds: http:///
+  value = value.replace('http:///', 'http://')
+  if value != "" and not value.startswith(('http://', 'https://')):
+    # common error in datafeeds: missing leading http://
+    value = "http://" + value
+  # common error in datafeeds: http://http://
+  return value.replace('http://http://', 'http://')
+
+
+# fixes for Scott Stewart: these .org domains are now .gov, except in
+# values mentioning musicnationalservice.org
+DOMAIN_REWRITES = ['americorps', 'learnandserve', 'seniorcorps',
+                   'nationalservice']
+DOMAIN_RX = re.compile(r'(' + '|'.join(DOMAIN_REWRITES) + r')\.org',
+                       re.IGNORECASE)
+MUSIC_RX = re.compile(r'musicnationalservice\.org', re.IGNORECASE)
+
+def rewrite_domains(value):
+  """the DOMAIN_REWRITES, in one pass over the value."""
+  if not DOMAIN_RX.search(value):
+    return value
+  keep_nationalservice = MUSIC_RX.search(value) is not None
+  replaced = {}
+  def replace(match):
+    """the .gov domain for a match, unless it's kept."""
+    domain = match.group(1).lower()
+    if domain == 'nationalservice' and keep_nationalservice:
+      return match.group(0)
+    replaced[domain] = True
+    return domain + '.gov'
+
+  value = DOMAIN_RX.sub(replace, value)
+  for domain in DOMAIN_REWRITES:
+    if domain in replaced:
+      print_progress("replaced " + domain)
+  return value
+
+
+def convert_dt_field(value):
+  """a dateTime field's value, in Google Base format."""
+  return convert_dt_to_gbase(value, "", "UTC")
+
+
+def remove_newlines(value):
+  """a value on one line."""
+  return value.replace('\n', ' ')
+
+
+# field name -> [(rule name, function)], see get_field_rules()
+FIELD_RULES = {}
+# rule name -> [values, seconds], while PROFILE_FIELDS is set
+FIELD_RULE_STATS = {}
+
+def get_field_rules(name):
+  """the rules output_field() applies to a field's values, in order,
+  worked out from its name and type the first time."""
+  rules = FIELD_RULES.get(name)
+  if rules is None:
+    rules = []
+    if 'url' in name.lower():
+      rules.append(('url', fix_url))
+    rules.append(('domains', rewrite_domains))
+    if FIELDTYPES.get(name, 'string') == "dateTime":
+      rules.append(('dateTime', convert_dt_field))
+    else:
+      rules.append(('newlines', remove_newlines))
+    FIELD_RULES[name] = rules
+  return rules
+
+
+def apply_field_rules_timed(rules, value):
+  """apply rules to value, adding their times to FIELD_RULE_STATS."""
+  for rule, func in rules:
+    start = time.time()
+    value = func(value)
+    stats = FIELD_RULE_STATS.get(rule)
+    if stats is None:
+      stats = FIELD_RULE_STATS[rule] = [0, 0.0]
+    stats[0] += 1
+    stats[1] += time.time() - start
+  return value
 
 
 def output_field(name, given_value):
@@ -321,43 +447,15 @@ def output_field(name, given_value):
     else:
       return name+":"+FIELDTYPES.get(name, 'string')
 
-  value = given_value
-
-  # common fixup for URL fields
-  if re.search(r'url', name, re.IGNORECASE):
-    # common error in datafeeds: http:///
-    value = re.sub(r'http:///', 'http://', value)
-    if value != "" and not re.search(r'^https?://', value):
-      # common error in datafeeds: missing leading http://
-      value = "http://" + value
-    # common error in datafeeds: http://http://
-    value = re.sub(r'http://http://', 'http://', value)
-
-  # fixes for Scott Stewart 
-  if re.search(r'americorps\.org', value, re.IGNORECASE):
-    value = re.sub(r'(?i)americorps\.org', 'americorps.gov', value)
-    print_progress("replaced americorps")
-
-  if re.search(r'learnandserve\.org', value, re.IGNORECASE):
-    value = re.sub(r'(?i)learnandserve\.org', 'learnandserve.gov', value)
-    print_progress("replaced learnandserve")
-
-  if re.search(r'seniorcorps\.org', value, re.IGNORECASE):
-    value = re.sub(r'(?i)seniorcorps\.org', 'seniorcorps.gov', value)
-    print_progress("replaced seniorcorps")
-
-  if (not re.search(r'musicnationalservice\.org', value, re.IGNORECASE)
-      and re.search(r'nationalservice\.org', value, re.IGNORECASE)):
-    value = re.sub(r'(?i)nationalservice\.org', 'nationalservice.gov', value)
-    print_progress("replaced nationalservice")
-    
   #if OUTPUTFMT == "basetsv":
   #  value = re.sub(r',', ';;', value)
 
-  if (FIELDTYPES.get(name, 'string') == "dateTime"):
-    return convert_dt_to_gbase(value, "", "UTC")
-
-  value = value.replace('\n', ' ')
+  rules = FIELD_RULES.get(name) or get_field_rules(name)
+  if PROFILE_FIELDS:
+    return apply_field_rules_timed(rules, given_value)
+  value = given_value
+  for rule, func in rules:
+    value = func(value)
   return value
 
 
@@ -396,6 +494,8 @@ def get_full_addr_str(node):
 
 
 JO_SAID = {}
+
+
 def get_revgeo_fields(lat, lng, given_city, given_county, given_state, given_zip, given_country):
   
   city = given_city
@@ -406,32 +506,36 @@ def get_revgeo_fields(lat, lng, given_city, given_county, given_state, given_zip
   if not country:
     country = 'US'
 
-  jo = geocoder.rev_geocode_json(lat, lng, None, 0, JO_SAID)
-  if jo and 'status' in jo:
-    if jo['status'] != "OK":
-      if jo['status'] == 'ZERO_RESULTS':
-        say = "rev_geocode_json: says " + jo['status'] + ' for ' + str(lat) + ',' + str(lng)
+  found = False
+  if BATCH_GEOCODER:
+    found, answer = BATCH_GEOCODER.lookup_reverse(lat, lng)
+  if not found:
+    answer = geocoder.rev_geocode(lat, lng)
+  if answer:
+    status, rev_city, rev_county, rev_state, rev_zip, rev_country = answer
+    if status != "OK":
+      if status == 'ZERO_RESULTS':
+        say = "rev_geocode_json: says " + status + ' for ' + str(lat) + ',' + str(lng)
         if say not in JO_SAID:
           JO_SAID[say] = 1
           print say
-      elif not jo['status'] in JO_SAID:
-        JO_SAID[jo['status']] = 1
-        print "rev_geocode_json: says " + jo['status']
+      elif not status in JO_SAID:
+        JO_SAID[status] = 1
+        print "rev_geocode_json: says " + status
     else:
-      for d in jo['results'][0]['address_components']:
-        if 'locality' in d['types']:
-          city = d['long_name']
-        elif 'postal_code' in d['types']:
-          if not given_zip or len(given_zip) < 5:
-            zip = d['short_name']
-          else:
-            zip = given_zip[:5]
-        elif 'administrative_area_level_1' in d['types']:
-          state = d['short_name']
-        elif 'administrative_area_level_2' in d['types']:
-          county = d['short_name']
-        elif 'country' in d['types']:
-          country = d['short_name']
+      if rev_city is not None:
+        city = rev_city
+      if rev_zip is not None:
+        if not given_zip or len(given_zip) < 5:
+          zip = rev_zip
+        else:
+          zip = given_zip[:5]
+      if rev_state is not None:
+        state = rev_state
+      if rev_county is not None:
+        county = rev_county
+      if rev_country is not None:
+        country = rev_country
 
   if state and country and country != 'US':
      state += '-' + country
@@ -439,51 +543,152 @@ def get_revgeo_fields(lat, lng, given_city, given_county, given_state, given_zip
   return city.strip(), county.strip(), state.strip(), zip.strip(), country.strip()
   
 
-def find_geocoded_location(node):
-  """Try a multitude of field combinations to get a geocode.  Returns:
-  address, latitude, longitude, accuracy (as strings)."""
-  
-  # Combinations of fields to try geocoding.
-  field_combinations = \
-      ["streetAddress1,streetAddress2,streetAddress3,"
-       + "city,region,postalCode,country",
-       "streetAddress2,streetAddress3,"
-       + "city,region,postalCode,country",
-       "streetAddress3,city,region,postalCode,country",
-       "city,region,postalCode,country",
-       "postalCode,country",
-       "city,region,country",
-       "region,country",
-       "latitude,longitude"]
-
-  # Upper bound on the accuracy provided by a given field.  This
-  # prevents false positives like matching the city field to a street
-  # name.
-  field_accuracy = { "streetAddress1": 9,
-                     "streetAddress2": 9,
-                     "streetAddress3": 9,
-                     "city": 5,
-                     "region": 5,
-                     "postalCode": 5,
-                     "country": 1,
-                     "latitude": 9,
-                     "longitude": 9 }
-
-  for fields in field_combinations:
-    field_list = fields.split(",")
-
+# Combinations of fields to try geocoding, in order.
+GEOCODE_FIELD_COMBINATIONS = [
+  "streetAddress1,streetAddress2,streetAddress3,city,region,postalCode,country",
+  "streetAddress2,streetAddress3,city,region,postalCode,country",
+  "streetAddress3,city,region,postalCode,country",
+  "city,region,postalCode,country",
+  "postalCode,country",
+  "city,region,country",
+  "region,country",
+  "latitude,longitude"]
+
+# Upper bound on the accuracy provided by a given field.  This
+# prevents false positives like matching the city field to a street
+# name.
+GEOCODE_FIELD_ACCURACY = { "streetAddress1": 9,
+                           "streetAddress2": 9,
+                           "streetAddress3": 9,
+                           "city": 5,
+                           "region": 5,
+                           "postalCode": 5,
+                           "country": 1,
+                           "latitude": 9,
+                           "longitude": 9 }
+
+def location_queries(node):
+  """the (query, max accuracy) pairs find_geocoded_location() tries for
+  a location node, in order."""
+  values = {}
+  for field in GEOCODE_FIELD_ACCURACY:
+    values[field] = xmlh.get_tag_val(node, field)
+
+  queries = []
+  for fields in GEOCODE_FIELD_COMBINATIONS:
     # Compose the query and find the max accuracy.
     query = []
     max_accuracy = 0
-    for field in field_list:
-      field_val = xmlh.get_tag_val(node, field)
-      if field_val != "":
-        query += [field_val]
-        max_accuracy = max(max_accuracy, field_accuracy[field])
-    query = ",".join(query)
+    for field in fields.split(","):
+      if values[field] != "":
+        query += [values[field]]
+        max_accuracy = max(max_accuracy, GEOCODE_FIELD_ACCURACY[field])
+    queries.append((",".join(query), max_accuracy))
+  return queries
+
+
+def get_batch_geocoder():
+  """the BatchGeocoder for the pre-geocoding pass."""
+  global BATCH_GEOCODER
+  if BATCH_GEOCODER is None:
+    BATCH_GEOCODER = geocode_batch.BatchGeocoder(
+      geocoder.geocode_url, geocoder.GEOCODE_CACHE, workers=GEOCODE_WORKERS,
+      revgeo_store=geocoder.REVGEO_STORE)
+  return BATCH_GEOCODER
+
+
+def geocode(query):
+  """geocoder.geocode(query), from the pre-geocoding pass if it got to
+  the query."""
+  if BATCH_GEOCODER:
+    found, result = BATCH_GEOCODER.lookup(query)
+    if found:
+      return result
+  return geocoder.geocode(query)
+
+
+def pregeocode_locations(nodes):
+  """geocode location nodes the way find_geocoded_location() does, a
+  round of queries at a time, and prefetch the reverse geocodes of what
+  they find, so both are lookups when the opportunities are converted."""
+  batch_geocoder = get_batch_geocoder()
+  pending = [location_queries(node) for node in nodes]
+  points = {}
+  while pending:
+    results = batch_geocoder.geocode_many([queries[0][0]
+                                           for queries in pending])
+    unresolved = []
+    for queries in pending:
+      query, max_accuracy = queries[0]
+      result = results[query]
+      try:
+        accurate = result and int(result[3]) <= max_accuracy
+      except ValueError:
+        accurate = False
+      if accurate:
+        points[(result[1], result[2])] = True
+      elif len(queries) > 1:
+        unresolved.append(queries[1:])
+      else:
+        points[("0.0", "0.0")] = True
+    pending = unresolved
+  batch_geocoder.reverse_geocode_many(points.keys(),
+                                      geocoder.fetch_rev_geocode)
+
+
+def pregeocode_opportunities(oppxmls):
+  """pregeocode_locations() for the <location>s of some opportunities,
+  FPXML or already parsed."""
+  nodes = []
+  for oppxml in oppxmls:
+    if not isinstance(oppxml, basestring):
+      nodes.extend([xmlh.DOMRecord(node)
+                    for node in oppxml.getElementsByTagName("location")])
+      continue
+    for match in LOCATION_RX.finditer(oppxml):
+      try:
+        nodes.append(xmlh.DOMRecord(minidom.parseString(match.group(0))))
+      except xml.parsers.expat.ExpatError:
+        # reported when the opportunity is parsed
+        pass
+  if nodes:
+    pregeocode_locations(nodes)
+
+
+def pregeocode_records(records):
+  """pass (tagname, record) records through, geocoding the locations of
+  the VolunteerOpportunity records PREGEOCODE_BATCH at a time before
+  they go on.  Records keep their order."""
+  if GEOCODE_WORKERS <= 0:
+    for record in records:
+      yield record
+    return
+
+  batch = []
+  for tag, xmlstr in records:
+    if tag == 'VolunteerOpportunity':
+      batch.append(xmlstr)
+      if len(batch) < PREGEOCODE_BATCH:
+        continue
+    if batch:
+      pregeocode_opportunities(batch)
+      for oppxml in batch:
+        yield 'VolunteerOpportunity', oppxml
+      batch = []
+    if tag != 'VolunteerOpportunity':
+      yield tag, xmlstr
+  if batch:
+    pregeocode_opportunities(batch)
+    for oppxml in batch:
+      yield 'VolunteerOpportunity', oppxml
+
 
+def find_geocoded_location(node):
+  """Try a multitude of field combinations to get a geocode.  Returns:
+  address, latitude, longitude, accuracy (as strings)."""
+  for query, max_accuracy in location_queries(node):
     print_debug("trying: " + query + " (" + str(max_accuracy) + ")")
-    result = geocoder.geocode(query)
+    result = geocode(query)
     if result:
       addr, lat, lng, acc = result
       if int(acc) <= max_accuracy:
@@ -534,6 +739,13 @@ def feed_report(id, detail, feed = None, link = None):
       fh.write('\n')
       fh.close()
   
+def get_dedup_store():
+  """open DEDUP_BACKEND on first use."""
+  global DEDUP_STORE
+  if DEDUP_STORE is None:
+    DEDUP_STORE = dedup_store.open_dedup_store(DEDUP_BACKEND)
+  return DEDUP_STORE
+
 # Removes duplicates comparing title, abstract, loc_str, startend
 def duplicate_opp(opp, loc_str, startend):
   rtn = False
@@ -543,8 +755,7 @@ def duplicate_opp(opp, loc_str, startend):
   abstract = get_abstract(opp).lower()
   #dedup_str = "".join([title, desc, detailURL, loc_str, startend])
   dedup_str = "".join([title, abstract, loc_str, startend])
-  dedup_file = DUPDIR + '/' + hashlib.md5(dedup_str).hexdigest()
-  if os.path.exists(dedup_file): 
+  if get_dedup_store().seen(hashlib.md5(dedup_str).hexdigest()):
     global DUPS
     DUPS += 1
     opp_id = xmlh.get_tag_val(opp, "volunteerOpportunityID")
@@ -552,11 +763,6 @@ def duplicate_opp(opp, loc_str, startend):
       link = xmlh.get_tag_val(opp, 'detailURL')
       feed_report(opp_id, 'duplicates', FEED, link)
     rtn = True
-  else:
-    try:
-      open(dedup_file, 'w').close()
-    except:
-      pass
 
   return rtn
 
@@ -682,9 +888,9 @@ def get_direct_mapped_fields(opp, orgs, feed_providerName):
       outstr += FIELDSEP + output_tag_value(opp, field)
 
   # skills/skill requires special handling because 2.12 introduced a design bug that allowed to declare it as an array of skill tags or not
-  skillTag = opp.getElementsByTagName("skill")
+  skillTag = opp.get_elements("skill")
 
-  if (skillTag.length > 0):
+  if len(skillTag) > 0:
     value = output_tag_value_renamed(opp, "skill", "skills")
     # Strip apostrophe or the upload to SOLR will fail
     value = value.replace("'", "")
@@ -705,9 +911,9 @@ def get_direct_mapped_fields(opp, orgs, feed_providerName):
    
   # orgLocation
   outstr += FIELDSEP
-  fieldval = opp.getElementsByTagName("orgLocation")
-  if (fieldval.length > 0):
-    outstr += output_loc_field(fieldval[0], "orgLocation")
+  fieldval = opp.get_elements("orgLocation")
+  if len(fieldval) > 0:
+    outstr += output_loc_field(xmlh.DOMRecord(fieldval[0]), "orgLocation")
   else:
     outstr += output_field("orgLocation", "")
 
@@ -751,6 +957,7 @@ def get_base_other_fields(opp, org):
   return outstr
 
 
+NON_ASCII_RX = re.compile(u'[^\x00-\x7f]+')
 html_tag_rx = re.compile(r'<.*?>')
 sent_start_rx = re.compile(r'((^\s*|[.]\s+)[A-Z])([A-Z0-9 ,;-]{13,})')
 def cleanse_snippet(instr):
@@ -767,7 +974,7 @@ def cleanse_snippet(instr):
     # best chance to handle malformed html and still get contents
     instr = ''.join(BeautifulSoup(instr).findAll(text=True))
     # TODO: only ascii allowed but will need to accomdate i8n eventually
-    instr = "".join(i for i in instr if ord(i)<128)
+    instr = NON_ASCII_RX.sub('', instr)
     # strip any remaining html entities
     instr = re.sub(r'&([a-z]+|#[0-9]+);', '', instr)
     instr = html_tag_rx.sub('', instr)
@@ -819,7 +1026,8 @@ def get_feed_fields(feedinfo):
 
 
 def output_opportunity(opp, feedinfo, known_orgs, totrecs):
-  """main function for outputting a complete opportunity."""
+  """main function for outputting a complete opportunity, an
+  xmlh.DOMRecord like its organizations in known_orgs and feedinfo."""
   outstr_list = []
   opp_id = xmlh.get_tag_val(opp, "volunteerOpportunityID")
   if (opp_id == ""):
@@ -847,8 +1055,10 @@ def output_opportunity(opp, feedinfo, known_orgs, totrecs):
           known_orgs.get(affiliate_org_id, None),
          ]
 
-  opp_locations = opp.getElementsByTagName("location")
-  opp_times = opp.getElementsByTagName("dateTimeDuration")
+  opp_locations = [xmlh.DOMRecord(node)
+                   for node in opp.get_elements("location")]
+  opp_times = [xmlh.DOMRecord(node)
+               for node in opp.get_elements("dateTimeDuration")]
   repeated_fields = get_repeated_fields(feedinfo, opp, orgs)
 
   number_of_opptimes = len(opp_times)
@@ -974,10 +1184,8 @@ def output_opportunity(opp, feedinfo, known_orgs, totrecs):
       outstr_list.append(loc_fields)
       outstr_list.append(RECORDSEP)
 
-  for idx, outstr in enumerate(outstr_list):
-    outstr_list[idx] = "".join(i for i in outstr_list[idx] if ord(i)<128)
-   
-  return totrecs, "".join(outstr_list)
+  return totrecs, "".join([NON_ASCII_RX.sub('', outstr)
+                           for outstr in outstr_list])
 
 def get_time_fields(openended, duration, hrs_per_week, event_date_range, ical_recurrence):
   """output time-related fields, e.g. for multiple times per event."""
@@ -1093,11 +1301,145 @@ def convert_to_footprint_xml(instr, do_fastparse, maxrecs, progress):
     return xmlh.prettyxml(xmldoc)
 
 
+PHONE_RX = re.compile(
+      '[^0-9]'+ # not a number
+      '([0-9]{3}[^0-9][0-9]{3}[^0-9][0-9]{4})'+ # NNN-NNN-NNNN
+      '(\s*(x|ex|ext)(ension)?\s*([0-9]+))?' # opt. extension, capture 'x'
+      '[^0-9]', # not a number
+  re.IGNORECASE)    
+EMAIL_RX = re.compile(r'[^a-z]([a-z0-9.+!-]+@([a-z0-9-]+[.])+[a-z]+)',
+                      re.IGNORECASE)
+
+def reset_feed_stats():
+  """zero the per-feed counters reported by report_feed_stats()."""
+  global DUPS, NOLOC, EIN501, NUMORGS
+  DUPS = NOLOC = EIN501 = NUMORGS = 0
+  FIELD_RULE_STATS.clear()
+  if BATCH_GEOCODER:
+    BATCH_GEOCODER.reset_stats()
+
+
+def record_node(record, known_elements):
+  """a record as a DOM: parsed if it's FPXML, as is if its parser
+  already built the DOM."""
+  if isinstance(record, basestring):
+    return xmlh.simple_parser(record, known_elements, False)
+  return record
+
+
+def record_text(record):
+  """the text to search a record for contact details in: its FPXML, or
+  just the text of a DOM its parser built."""
+  if isinstance(record, basestring):
+    return record
+  return xmlh.get_text(record)
+
+
+def parse_feedinfo(xmlstr):
+  """parse a <FeedInfo> record, as an xmlh.DOMRecord."""
+  return xmlh.DOMRecord(record_node(xmlstr, parse_footprint.KNOWN_ELEMENTS))
+
+
+def parse_organization(xmlstr, known_orgs):
+  """parse an <Organization> record, as an xmlh.DOMRecord, and remember
+  it by organizationID."""
+  org = xmlh.DOMRecord(record_node(xmlstr, parse_footprint.KNOWN_ELEMENTS))
+  sponsoring_org_id = xmlh.get_tag_val(org, "organizationID")
+  if sponsoring_org_id:
+    known_orgs[sponsoring_org_id] = org
+  return org
+
+
+def convert_opportunity(oppxml, feedinfo, known_orgs, example_org, taggers,
+                        tag_count_dict, numopps):
+  """convert one <VolunteerOpportunity> record to TSV rows, preceded by
+  the header line if it hasn't been output yet.  Returns the updated
+  opportunity count and the output string."""
+  opp = XMLRecord(record_node(oppxml, None))
+  # the text for the extractors below, only found if they run
+  opptext = None
+
+  # extractor/guesser for contactPhone-- note that this operates
+  # on the output FPXML rather than the raw input, i.e. could miss
+  # some cases.  The rationale:
+  #  - operating on raw inputs means writing this N times for
+  #    each feed format (mostly testing...).
+  #  - most providers are FPXML now, i.e. not much value.
+  contactPhone = xmlh.get_tag_val(opp, "contactPhone")
+  if contactPhone == "":
+    # US-only
+    # doesn't work for non-numbers, e.g. 1-800-VOLUNTEER
+    # doesn't work with smushed numbers, e.g. 8005567629
+    #print "searching for phone:" # in "+re.sub(r'\n',' ',oppchunk)
+    opptext = record_text(oppxml)
+    m = re.search(PHONE_RX, opptext)
+    if m:
+      extractedPhone = m.group(1)
+      if m.group(5):
+        extractedPhone += " ext."+ m.group(5)
+      opp.append_element('contactPhone', extractedPhone)
+      
+  # extractor/guesser for contactEmail-- see notes above in phone
+  contactEmail = xmlh.get_tag_val(opp, "contactEmail")
+  if contactEmail == "":
+    if opptext is None:
+      opptext = record_text(oppxml)
+    m = re.search(EMAIL_RX, opptext)
+    if m:
+      opp.append_element('contactEmail', m.group(1))
+  else:
+    pass
+
+  tag_count_dict = taggers.do_tagging(opp, feedinfo, tag_count_dict)
+
+  outstr = ""
+  if not HEADER_ALREADY_OUTPUT:
+    outstr = output_header(feedinfo, opp, [example_org, example_org, example_org])
+
+  numopps, spiece = output_opportunity(opp, feedinfo, known_orgs, numopps)
+  return numopps, outstr + spiece
+
+
+def report_feed_stats(tag_count_dict, known_orgs, numopps):
+  """print the per-feed counters and save them for the feed dashboard."""
+  global NUMORGS
+  for tag, tag_count in tag_count_dict.iteritems():
+    print_progress("tagged %s: %d" % (tag, tag_count))
+
+  NUMORGS = len(known_orgs)
+  print_progress("no location: " + str(NOLOC))
+  print_progress(" duplicates: " + str(DUPS))
+  if DEDUP_STORE:
+    print_progress("dedup index: %(entries)d entries, %(duplicates)d of "
+                   "%(checked)d checked were duplicates" %
+                   DEDUP_STORE.stats())
+  if BATCH_GEOCODER:
+    print_progress("   geocodes: %(queries)d queries, %(cached)d cached, "
+                   "%(requests)d requests, %(retries)d retries, "
+                   "%(errors)d errors" % BATCH_GEOCODER.stats)
+    print_progress("     revgeo: %(points)d points, %(points_stored)d stored"
+                   % BATCH_GEOCODER.stats)
+  for rule, stats in sorted(FIELD_RULE_STATS.items()):
+    print_progress("field rule %s: %d values, %.1fms, %.1fus per opp" %
+                   (rule, stats[0], stats[1] * 1000.0,
+                    stats[1] * 1000000.0 / max(1, numopps)))
+  print_progress("    501(c)3: " + str(EIN501))
+  print_progress("parsed opps: " + str(numopps))
+
+  if FEED:
+    fh = open(FEEDSDIR + '/' + FEED + '-last.txt', 'w')
+    if fh:
+      fh.write('numorgs\t' + str(NUMORGS) + '\n')
+      fh.write('noloc\t' + str(NOLOC) + '\n')
+      fh.write('dups\t' + str(DUPS) + '\n')
+      fh.write('ein501c3\t' + str(EIN501) + '\n')
+      fh.close()
+
+
 def convert_to_gbase_events_type(instr, shortname, fastparse, maxrecs, progress):
   """non-trivial logic for converting FPXML to google base formatting."""
   # todo: maxrecs
-  global DUPS, NOLOC, EIN501, NUMORGS
-  DUPS = NOLOC = EIN501 = NUMORGS = 0
+  reset_feed_stats()
 
   outstr = ""
   #print_progress("convert_to_gbase_events_type...", "", progress)
@@ -1110,110 +1452,95 @@ def convert_to_gbase_events_type(instr, shortname, fastparse, maxrecs, progress)
 
     numopps = 0
     feedinfo = None
-    for match in re.finditer(re.compile('<FeedInfo>.+?</FeedInfo>',
-                                        re.DOTALL), instr):
+    for match in re.finditer(parse_footprint.FEEDINFO_RX, instr):
       #print_progress("found FeedInfo.", progress=progress)
-      feedinfo = xmlh.simple_parser(match.group(0), parse_footprint.KNOWN_ELEMENTS, False)
+      feedinfo = parse_feedinfo(match.group(0))
 
     if not feedinfo:
       print_progress("no FeedInfo.", progress=progress)
       return "", 0, 0
 
-    for match in re.finditer(re.compile('<Organization>.+?</Organization>',
-                                        re.DOTALL), instr):
-      org = xmlh.simple_parser(match.group(0), parse_footprint.KNOWN_ELEMENTS, False)
-      sponsoring_org_id = xmlh.get_tag_val(org, "organizationID")
-      if sponsoring_org_id:
-        known_orgs[sponsoring_org_id] = org
-
+    for match in re.finditer(parse_footprint.ORGANIZATION_RX, instr):
+      org = parse_organization(match.group(0), known_orgs)
       if example_org is None:
         example_org = org
       #if progress and len(known_orgs) % 250 == 0:
       #  print_progress(str(len(known_orgs))+" organizations seen.")
 
-    taggers = get_taggers()
-    phoneRx = re.compile(
-          '[^0-9]'+ # not a number
-          '([0-9]{3}[^0-9][0-9]{3}[^0-9][0-9]{4})'+ # NNN-NNN-NNNN
-          '(\s*(x|ex|ext)(ension)?\s*([0-9]+))?' # opt. extension, capture 'x'
-          '[^0-9]', # not a number
-      re.IGNORECASE)    
+    taggers = TaggingEngine(get_taggers())
 
     tag_count_dict = {}
     oppslist_output = []
-    for oppmatch in re.finditer(re.compile(
-        '<VolunteerOpportunity>.+?</VolunteerOpportunity>', re.DOTALL), instr):
-      opp = xmlh.simple_parser(oppmatch.group(0), None, False)
-
-      # extractor/guesser for contactPhone-- note that this operates
-      # on the output FPXML rather than the raw input, i.e. could miss
-      # some cases.  The rationale:
-      #  - operating on raw inputs means writing this N times for
-      #    each feed format (mostly testing...).
-      #  - most providers are FPXML now, i.e. not much value.
-      contactPhone = xmlh.get_tag_val(opp, "contactPhone")
-      if contactPhone == "":
-        # US-only
-        # doesn't work for non-numbers, e.g. 1-800-VOLUNTEER
-        # doesn't work with smushed numbers, e.g. 8005567629
-        #print "searching for phone:" # in "+re.sub(r'\n',' ',oppchunk)
-        m = re.search(phoneRx, oppmatch.group(0))
-        if m:
-          extractedPhone = m.group(1)
-          if m.group(5):
-            extractedPhone += " ext."+ m.group(5)
-          newnode = opp.createElement('contactPhone')
-          newnode.appendChild(opp.createTextNode(extractedPhone))
-          opp.firstChild.appendChild(newnode)
-          
-      # extractor/guesser for contactEmail-- see notes above in phone
-      contactEmail = xmlh.get_tag_val(opp, "contactEmail")
-      if contactEmail == "":
-        m = re.search(r'[^a-z]([a-z0-9.+!-]+@([a-z0-9-]+[.])+[a-z]+)',
-                      oppmatch.group(0), re.IGNORECASE)
-        if m:
-          newnode = opp.createElement('contactEmail')
-          newnode.appendChild(opp.createTextNode(m.group(1)))
-          opp.firstChild.appendChild(newnode)
-      else:
-        pass
-
-      rec = XMLRecord(opp)
-      for tagger in taggers:
-        rec = XMLRecord(opp)
-        rec, tag_count_dict = tagger.do_tagging(rec, feedinfo, tag_count_dict, [])
-
-      opp = rec.opp
-      if not HEADER_ALREADY_OUTPUT:
-        outstr = output_header(feedinfo, opp, [example_org, example_org, example_org])
-
-      numopps, spiece = output_opportunity(opp, feedinfo, known_orgs, numopps)
+    opps = pregeocode_records(
+      ('VolunteerOpportunity', oppmatch.group(0)) for oppmatch in
+      re.finditer(parse_footprint.OPPORTUNITY_RX, instr))
+    for tag, oppxml in opps:
+      numopps, spiece = convert_opportunity(oppxml, feedinfo,
+                                            known_orgs, example_org, taggers,
+                                            tag_count_dict, numopps)
       oppslist_output.append(spiece)
 
       if (maxrecs > 0 and numopps > maxrecs):
         break
-      
-    for tag, tag_count in tag_count_dict.iteritems():
-      print_progress("tagged %s: %d" % (tag, tag_count))
 
     outstr += "".join(oppslist_output)
 
-  NUMORGS = len(known_orgs)
-  print_progress("no location: " + str(NOLOC))
-  print_progress(" duplicates: " + str(DUPS))
-  print_progress("    501(c)3: " + str(EIN501))
-  print_progress("parsed opps: " + str(numopps))
+  report_feed_stats(tag_count_dict, known_orgs, numopps)
+  return outstr, len(known_orgs), numopps
 
-  if FEED:
-    fh = open(FEEDSDIR + '/' + FEED + '-last.txt', 'w')
-    if fh:
-      fh.write('numorgs\t' + str(NUMORGS) + '\n')
-      fh.write('noloc\t' + str(NOLOC) + '\n')
-      fh.write('dups\t' + str(DUPS) + '\n')
-      fh.write('ein501c3\t' + str(EIN501) + '\n')
-      fh.close()
 
-  return outstr, len(known_orgs), numopps
+def convert_to_gbase_events_stream(records, outfh, maxrecs, progress):
+  """streaming version of convert_to_gbase_events_type(): records is an
+  iterable of (tagname, record) pairs, where a record is FPXML or a DOM
+  its parser already built, e.g. from parse_records(), and
+  each TSV row is written to outfh as soon as its opportunity closes,
+  so memory is bounded by one record plus the organization table.
+  Output is byte-identical to the in-memory path as long as the feed
+  puts <FeedInfo> and <Organization> before the opportunities, as the
+  FPXML spec requires."""
+  reset_feed_stats()
+
+  example_org = None
+  known_orgs = {}
+  numopps = 0
+  feedinfo = None
+  taggers = TaggingEngine(get_taggers())
+  tag_count_dict = {}
+  # opportunities seen before any FeedInfo have to wait for it
+  pending_opps = []
+  warned_late_org = False
+  for tag, xmlstr in pregeocode_records(records):
+    if tag == 'FeedInfo':
+      feedinfo = parse_feedinfo(xmlstr)
+    elif tag == 'Organization':
+      if numopps > 0 and not warned_late_org:
+        print_progress("Organization after VolunteerOpportunity: earlier "
+                       "opportunities may be skipped, try --nostream",
+                       progress=progress)
+        warned_late_org = True
+      org = parse_organization(xmlstr, known_orgs)
+      if example_org is None:
+        example_org = org
+    elif tag == 'VolunteerOpportunity':
+      if not feedinfo:
+        pending_opps.append(xmlstr)
+        continue
+      for oppxml in pending_opps + [xmlstr]:
+        numopps, spiece = convert_opportunity(oppxml, feedinfo, known_orgs,
+                                              example_org, taggers,
+                                              tag_count_dict, numopps)
+        outfh.write(spiece)
+      pending_opps = []
+
+      if (maxrecs > 0 and numopps > maxrecs):
+        break
+
+  if not feedinfo:
+    print_progress("no FeedInfo.", progress=progress)
+    return 0, 0
+
+  report_feed_stats(tag_count_dict, known_orgs, numopps)
+  return len(known_orgs), numopps
 
 
 def guess_shortname(filename):
@@ -1604,7 +1931,8 @@ def clean_input_string(instr):
 
 def parse_options():
   """parse cmdline options"""
-  global DEBUG, PROGRESS, FIELDSEP, RECORDSEP, OUTPUTFMT
+  global DEBUG, PROGRESS, FIELDSEP, RECORDSEP, OUTPUTFMT, DEDUP_BACKEND
+  global GEOCODE_WORKERS, PROFILE_FIELDS
   parser = OptionParser("usage: %prog [options] sample_data.xml ...")
   parser.set_defaults(geocode_debug=False)
   parser.set_defaults(debug=False)
@@ -1616,7 +1944,9 @@ def parse_options():
   parser.set_defaults(compress_output=False)
   parser.set_defaults(test=False)
   parser.set_defaults(clean=True)
+  parser.set_defaults(stream=False)
   parser.set_defaults(maxrecs=-1)
+  parser.set_defaults(geocode_workers=GEOCODE_WORKERS)
   parser.add_option("-d", "--dbg", action="store_true", dest="debug")
   parser.add_option("--abridged", action="store_true", dest="abridged")
   parser.add_option("--noabridged", action="store_false", dest="abridged")
@@ -1625,6 +1955,10 @@ def parse_options():
   parser.add_option("--inputfmt", action="store", dest="inputfmt")
   parser.add_option("--test", action="store_true", dest="test")
   parser.add_option("--dbginput", action="store_true", dest="debug_input")
+  # convert FPXML feeds a record at a time, writing rows as they're made
+  # (progress messages will be interleaved if writing to stdout)
+  parser.add_option("--stream", action="store_true", dest="stream")
+  parser.add_option("--nostream", action="store_false", dest="stream")
   parser.add_option("--progress", action="store_true", dest="progress")
   parser.add_option("--outputfmt", action="store", dest="outputfmt")
   parser.add_option("--output", action="store", dest="output")
@@ -1633,11 +1967,22 @@ def parse_options():
   parser.add_option("--nocompress_output", action="store_false",
                     dest="compress_output")
   parser.add_option("-g", "--geodbg", action="store_true", dest="geocode_debug")
+  # threads geocoding each batch of opportunities before it's converted
+  # (0 to geocode each location as it's converted)
+  parser.add_option("--geocode_workers", action="store", type="int",
+                    dest="geocode_workers")
+  # report the time spent in each of output_field()'s rules
+  parser.add_option("--profile_fields", action="store_true",
+                    dest="profile_fields", default=False)
   parser.add_option("--ftpinfo", dest="ftpinfo")
   parser.add_option("--fs", "--fieldsep", action="store", dest="fs")
   parser.add_option("--rs", "--recordsep", action="store", dest="rs")
   parser.add_option("-n", "--maxrecords", action="store", dest="maxrecs")
   parser.add_option("--feed_providername", action="store", dest="feed_providername")
+  # where seen opportunities are kept: 'memory' only dedups within this
+  # feed, a sqlite file (the default) dedups across the run's feeds
+  parser.add_option("--dedup", action="store", dest="dedup",
+                    default=DEDUP_BACKEND)
   (options, args) = parser.parse_args(sys.argv[1:])
   if (len(args) == 0):
     parser.print_help()
@@ -1663,6 +2008,9 @@ def parse_options():
   if options.ftpinfo and not options.outputfmt:
     options.outputfmt = "basetsv"
   OUTPUTFMT = options.outputfmt
+  DEDUP_BACKEND = options.dedup
+  GEOCODE_WORKERS = options.geocode_workers
+  PROFILE_FIELDS = options.profile_fields
   return options, args
 
 def open_input_filename(filename):
@@ -1692,6 +2040,14 @@ def open_input_filename(filename):
     return sys.stdin
   return open(filename, 'rb')
 
+def open_output_filename(options):
+  """open the --output file (or stdout), compressed if requested."""
+  if options.output == "":
+    return sys.stdout
+  elif options.compress_output:
+    return gzip.open(options.output, 'wb', 9)
+  return open(options.output, "w")
+
 def test_parse(footprint_xmlstr, maxrecs):
   """run the data through and then re-parse the output."""
   print datetime.now(), "testing input: generating Footprint XML..."
@@ -1728,7 +2084,93 @@ def test_parse(footprint_xmlstr, maxrecs):
     #print line
 
 
-def process_file(filename, options, providerName="", providerID="", feedID="", providerURL=""):
+def fill_feed_fields(footprint_xmlstr, providerName, providerID, feedID,
+                     providerURL):
+  """fill in empty provider fields, e.g. for spreadsheet feeds."""
+  if (providerID != "" and
+      footprint_xmlstr.find('<providerID></providerID>')):
+    footprint_xmlstr = re.sub(
+      '<providerID></providerID>',
+      '<providerID>%s</providerID>' % providerID, footprint_xmlstr)
+  if (providerName != "" and
+      footprint_xmlstr.find('<providerName></providerName>')):
+    footprint_xmlstr = re.sub(
+      '<providerName></providerName>',
+      '<providerName>%s</providerName>' % providerName, footprint_xmlstr)
+  if (providerID != "" and
+      footprint_xmlstr.find('<feedID></feedID>')):
+    footprint_xmlstr = re.sub(
+      '<feedID></feedID>',
+      '<feedID>%s</feedID>' % feedID, footprint_xmlstr)
+  if (providerURL != "" and
+      footprint_xmlstr.find('<providerURL></providerURL>')):
+    footprint_xmlstr = re.sub(
+      '<providerURL></providerURL>',
+      '<providerURL><![CDATA[%s]]></providerURL>' % providerURL, footprint_xmlstr)
+  return footprint_xmlstr
+
+
+def fill_feed_node(node, providerName, providerID, feedID, providerURL):
+  """fill_feed_fields() for a parsed record: empty provider elements get
+  the given values."""
+  for tag, value in (('providerID', providerID),
+                     ('providerName', providerName),
+                     ('feedID', feedID),
+                     ('providerURL', providerURL)):
+    if value == "":
+      continue
+    for elem in node.getElementsByTagName(tag):
+      if elem.hasChildNodes():
+        continue
+      if tag == 'providerURL':
+        elem.appendChild(node.createCDATASection(value))
+      else:
+        elem.appendChild(node.createTextNode(value))
+  return node
+
+
+def convert_records(records, parsefunc, options, outfh, providerName="",
+                    providerID="", feedID="", providerURL=""):
+  """parse (tagname, FPXML) records with parsefunc.parse_records() and
+  write the converted rows to outfh.  The parser's DOMs are converted
+  as they are, without writing them out as FPXML and parsing that
+  again.  Returns the organization and opportunity counts."""
+  def filled(parsed):
+    """fill_feed_node() for each parsed record."""
+    for tag, node in parsed:
+      yield tag, fill_feed_node(node, providerName, providerID, feedID,
+                                providerURL)
+
+  parsed = parsefunc.parse_records(records, int(options.maxrecs), PROGRESS)
+  return convert_to_gbase_events_stream(filled(parsed), outfh, 0, PROGRESS)
+
+
+def stream_file(infh, parsefunc, shortname, options, outfh,
+                providerName="", providerID="", feedID="", providerURL=""):
+  """streaming version of the parse/convert steps of process_file():
+  records are read incrementally from infh and converted rows are
+  written to outfh as they're produced."""
+  stats = {'bytes' : 0}
+  def records():
+    """read and clean one record at a time."""
+    for tag, xmlstr in xmlh.iter_records(infh, parse_footprint.RECORD_TAGS):
+      stats['bytes'] += len(xmlstr)
+      if options.clean:
+        xmlstr = clean_input_string(xmlstr)
+      yield tag, xmlstr
+
+  print_progress("streaming data...", shortname)
+  numorgs, numopps = convert_records(records(), parsefunc, options, outfh,
+                                     providerName, providerID, feedID,
+                                     providerURL)
+  print_progress("input data: "+str(stats['bytes'])+" bytes", shortname)
+  return stats['bytes'], numorgs, numopps
+
+
+def process_file(filename, options, providerName="", providerID="", feedID="", providerURL="",
+                 outfh=None):
+  """parse and convert one feed.  If outfh is given, the output is written
+  to it rather than returned, streaming the feed if its parser allows."""
   global FEED
 
   shortname = guess_shortname(filename)
@@ -1744,6 +2186,15 @@ def process_file(filename, options, providerName="", providerID="", feedID="", p
   if infh is None:
     return 0, 0, 0, ""
 
+  if (outfh and options.stream and OUTPUTFMT == "basetsv" and
+      not options.test and not options.debug_input):
+    if hasattr(parsefunc, 'parse_records'):
+      ln, numorgs, numopps = stream_file(infh, parsefunc, shortname, options,
+                                         outfh, providerName, providerID,
+                                         feedID, providerURL)
+      return ln, numorgs, numopps, ""
+    print_progress("can't stream " + inputfmt + " input, reading it all.")
+
   print_progress("reading data...")
   # don't put this inside open_input_filename() because it could be large
   instr = infh.read()
@@ -1763,29 +2214,27 @@ def process_file(filename, options, providerName="", providerID="", feedID="", p
   print_progress("input data: "+str(len(instr))+" bytes", shortname)
 
   print_progress("parsing...")
+  if (OUTPUTFMT == "basetsv" and hasattr(parsefunc, 'parse_records') and
+      not options.test and not options.debug_input):
+    # the parser's records go straight to the converter: FPXML is only
+    # written out for --outputfmt fpxml and --test
+    if outfh:
+      convert_outfh = outfh
+    else:
+      convert_outfh = StringIO.StringIO()
+    numorgs, numopps = convert_records(
+      parse_footprint.iter_feed_records(instr), parsefunc, options,
+      convert_outfh, providerName, providerID, feedID, providerURL)
+    outstr = ""
+    if not outfh:
+      outstr = convert_outfh.getvalue()
+    return len(instr), numorgs, numopps, outstr
+
   footprint_xmlstr, numorgs, numopps = \
       parsefunc(instr, int(options.maxrecs), PROGRESS)
 
-  if (providerID != "" and
-      footprint_xmlstr.find('<providerID></providerID>')):
-    footprint_xmlstr = re.sub(
-      '<providerID></providerID>',
-      '<providerID>%s</providerID>' % providerID, footprint_xmlstr)
-  if (providerName != "" and
-      footprint_xmlstr.find('<providerName></providerName>')):
-    footprint_xmlstr = re.sub(
-      '<providerName></providerName>',
-      '<providerName>%s</providerName>' % providerName, footprint_xmlstr)
-  if (providerID != "" and
-      footprint_xmlstr.find('<feedID></feedID>')):
-    footprint_xmlstr = re.sub(
-      '<feedID></feedID>',
-      '<feedID>%s</feedID>' % feedID, footprint_xmlstr)
-  if (providerURL != "" and
-      footprint_xmlstr.find('<providerURL></providerURL>')):
-    footprint_xmlstr = re.sub(
-      '<providerURL></providerURL>',
-      '<providerURL><![CDATA[%s]]></providerURL>' % providerURL, footprint_xmlstr)
+  footprint_xmlstr = fill_feed_fields(footprint_xmlstr, providerName,
+                                      providerID, feedID, providerURL)
 
   if options.test:
     # free some RAM
@@ -1817,6 +2266,10 @@ def process_file(filename, options, providerName="", providerID="", feedID="", p
   if footprint_xmlstr:
     ln = len(footprint_xmlstr)
 
+  if outfh:
+    outfh.write(outstr)
+    outstr = ""
+
   return ln, numorgs, numopps, outstr
 
 def main():
@@ -1824,8 +2277,12 @@ def main():
   start_time = datetime.now()
   options, args = parse_options()
   filename = args[0]
+  outfh = None
+  if options.stream and not options.ftpinfo:
+    outfh = open_output_filename(options)
   if not re.search("spreadsheets[.]google[.]com", filename):
-    bytes, numorgs, numopps, outstr = process_file(filename, options)
+    bytes, numorgs, numopps, outstr = process_file(filename, options,
+                                                   outfh=outfh)
   else:
      # spreadsheets only
     if OUTPUTFMT == "fpxml":
@@ -1910,7 +2367,8 @@ def main():
       providerURL += '&r=' + str(random.random())
 
       providerBytes, providerNumorgs, providerNumopps, tmpstr = process_file(
-        providerURL, options, sheet['pid'], sheet['pid'], sheet['pid'], providerURL)
+        providerURL, options, sheet['pid'], sheet['pid'], sheet['pid'], providerURL,
+        outfh)
 
       bytes += providerBytes
       numorgs += providerNumorgs
@@ -1919,7 +2377,11 @@ def main():
 
   #only need this if Base quoted fields it enabled
   #outstr = re.sub(r'"', r'&quot;', outstr)
-  if (options.ftpinfo):
+  if outfh:
+    # already written by process_file()
+    if outfh is not sys.stdout:
+      outfh.close()
+  elif (options.ftpinfo):
     ftp_to_base(filename, options.ftpinfo, outstr)
   elif options.output == "":
     print outstr,
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+batch geocoding, for footprint_lib's pre-geocoding pass.
+
+geocode_many() takes a list of queries, drops the ones that are the same
+once normalized for the cache, reads the cache for all the rest at once
+and sends only the misses to the Maps API.  Those are requested by a pool
+of WORKERS threads that together send at most RATE requests a second.
+Quota and server errors are retried, holding up the whole pool for an
+exponential backoff, so a quota error slows every thread down instead of
+each one finding out in turn.  Every result is kept, errors included, so
+lookup() can answer for the rest of the run without a request.
+Reverse geocodes are read from a revgeo_store.RevGeoStore all at once,
+and the misses fetched through the same pool and rate limit.
+"""
+
+import threading
+import time
+import urllib2
+import Queue
+from xml.dom import minidom
+
+import xml_helpers as xmlh
+import geocode_cache
+from geocode_cache import filter_cache_delimiters
+
+# threads making requests
+WORKERS = 8
+# requests a second, across all the threads
+RATE = 10.0
+# tries after the first, for quota and server errors
+RETRIES = 4
+# seconds the pool waits after the first error, doubling after each retry
+BACKOFF = 1.0
+# seconds to wait for a response
+TIMEOUT = 10
+
+# Maps API statuses that are worth trying again; anything else but OK
+# means the query can't be geocoded
+RETRY_STATUSES = ['OVER_QUERY_LIMIT', 'UNKNOWN_ERROR']
+
+ACCURACY = { "ROOFTOP" : 5, # precise geocode accurate down to street address
+             "RANGE_INTERPOLATED" : 4, # an approximation interpolated between two precise points
+             "GEOMETRIC_CENTER" : 3, # geometric center of a result such as a polyline
+             "APPROXIMATE" : 2, # indicates that the returned result is approximate.
+           }
+
+STAT_NAMES = ['queries', 'cached', 'requests', 'retries', 'errors',
+              'points', 'points_stored']
+
+
+def cache_key(query):
+  """the key geocoder.geocode() would look query up under."""
+  return geocode_cache.normalize_cache_key(filter_cache_delimiters(query))
+
+
+def parse_geocode_xml(res):
+  """(status, result) for a Maps API xml geocode response: result is
+  (address, latitude, longitude, accuracy) as strings if status is OK.
+  status is None if the response can't be parsed."""
+  try:
+    node = minidom.parseString(res).getElementsByTagName('GeocodeResponse')[0]
+  except Exception:
+    return None, None
+
+  status = xmlh.get_tag_val(node, "status")
+  if status != "OK":
+    return status, None
+
+  try:
+    result_node = node.getElementsByTagName('result')[0]
+    addr = xmlh.get_tag_val(result_node, "formatted_address")
+    # removes "USA" from all addresses.
+    if addr.endswith(', USA'):
+      addr = addr[:-len(', USA')]
+
+    geo_node = result_node.getElementsByTagName('geometry')[0]
+    ll_node = geo_node.getElementsByTagName('location')[0]
+    lat = xmlh.get_tag_val(ll_node, "lat")
+    lng = xmlh.get_tag_val(ll_node, "lng")
+  except IndexError:
+    return None, None
+
+  accuracy = str(ACCURACY.get(xmlh.get_tag_val(geo_node, "location_type"),
+                              "1"))
+  return status, (addr, lat, lng, accuracy)
+
+
+class RateLimiter(object):
+  """spaces requests from any number of threads 1/rate seconds apart,
+  and holds them all up after an error."""
+  def __init__(self, rate):
+    if rate > 0:
+      self.interval = 1.0 / rate
+    else:
+      self.interval = 0.0
+    self.lock = threading.Lock()
+    self.next_request = 0.0
+
+  def wait(self):
+    """sleep until it's this request's turn."""
+    self.lock.acquire()
+    try:
+      now = time.time()
+      when = max(now, self.next_request)
+      self.next_request = when + self.interval
+    finally:
+      self.lock.release()
+    if when > now:
+      time.sleep(when - now)
+
+  def hold(self, seconds):
+    """no more requests for seconds from now."""
+    self.lock.acquire()
+    try:
+      self.next_request = max(self.next_request, time.time() + seconds)
+    finally:
+      self.lock.release()
+
+
+def run_pool(func, items, workers):
+  """{item: func(item)} for each of items, from up to workers threads."""
+  queue = Queue.Queue()
+  for item in items:
+    queue.put(item)
+  results = {}
+
+  def worker():
+    """call func until there are no items left."""
+    while True:
+      try:
+        item = queue.get_nowait()
+      except Queue.Empty:
+        return
+      results[item] = func(item)
+
+  threads = [threading.Thread(target=worker)
+             for i in range(max(1, min(workers, queue.qsize())))]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return results
+
+
+class BatchGeocoder(object):
+  """geocodes lists of queries, cache first and the misses concurrently,
+  and remembers the results.  url_func(query) is the request url for a
+  query; cache is a geocode_cache.GeocodeCache and revgeo_store a
+  revgeo_store.RevGeoStore, both only used from the calling thread."""
+  def __init__(self, url_func, cache, workers=WORKERS, rate=RATE,
+               retries=RETRIES, backoff=BACKOFF, revgeo_store=None):
+    self.url_func = url_func
+    self.cache = cache
+    self.revgeo_store = revgeo_store
+    self.workers = workers
+    self.retries = retries
+    self.backoff = backoff
+    self.limiter = RateLimiter(rate)
+    # cache key -> result, or False if it can't be geocoded or failed
+    self.results = {}
+    # (latitude, longitude) -> revgeo_store answer tuple
+    self.reverse = {}
+    self.stats_lock = threading.Lock()
+    self.reset_stats()
+
+  def reset_stats(self):
+    """zero the counters."""
+    self.stats = dict([(name, 0) for name in STAT_NAMES])
+
+  def count(self, name, delta=1):
+    """add to a counter, from any thread."""
+    self.stats_lock.acquire()
+    try:
+      self.stats[name] += delta
+    finally:
+      self.stats_lock.release()
+
+  def fetch(self, query):
+    """geocode one query with the Maps API: (address, latitude, longitude,
+    accuracy), None if it can't be geocoded (cache that) or False if it
+    kept failing (don't)."""
+    for attempt in range(self.retries + 1):
+      if attempt:
+        self.count('retries')
+      self.limiter.wait()
+      self.count('requests')
+      try:
+        fh = urllib2.urlopen(self.url_func(query), timeout=TIMEOUT)
+        try:
+          res = fh.read()
+        finally:
+          fh.close()
+        status, result = parse_geocode_xml(res)
+      except Exception:
+        status, result = None, None
+      if status == "OK":
+        return result
+      if status is not None and status not in RETRY_STATUSES:
+        return None
+      self.limiter.hold(self.backoff * (2 ** attempt))
+    self.count('errors')
+    return False
+
+  def geocode_many(self, queries):
+    """{query: result} for each of queries, where a result is (address,
+    latitude, longitude, accuracy) or False, as geocoder.geocode()
+    returns."""
+    keys = {}
+    for query in queries:
+      key = cache_key(query)
+      if key not in self.results and key not in keys:
+        keys[key] = filter_cache_delimiters(query)
+    self.count('queries', len(keys))
+
+    found = self.cache.get_many(keys.values())
+    self.count('cached', len(found))
+    self.results.update(found)
+    misses = [key for key in keys if key not in found]
+    if misses:
+      fetched = run_pool(lambda key: self.fetch(keys[key]), misses,
+                         self.workers)
+      to_store = []
+      for key in misses:
+        result = fetched.get(key, False)
+        if result is None:
+          result = False
+          to_store.append((keys[key], result))
+        elif result:
+          result = tuple(map(filter_cache_delimiters, result))
+          to_store.append((keys[key], result))
+        self.results[key] = result
+      self.cache.put_many(to_store)
+
+    return dict([(query, self.results[cache_key(query)])
+                 for query in queries])
+
+  def lookup(self, query):
+    """returns (found, result) for a query geocode_many() has seen."""
+    key = cache_key(query)
+    if key in self.results:
+      return True, self.results[key]
+    return False, None
+
+  def reverse_geocode_many(self, points, rev_func):
+    """prefetch reverse geocodes of (latitude, longitude) points not seen
+    yet, from the revgeo store or else rev_func(latitude, longitude,
+    limiter).  That returns a revgeo_store answer tuple or None, calling
+    limiter.wait() before any request it makes."""
+    def fetch_reverse(point):
+      """one point, retried after quota and server errors."""
+      for attempt in range(self.retries + 1):
+        if attempt:
+          self.count('retries')
+        answer = rev_func(point[0], point[1], self.limiter)
+        if not answer or answer[0] not in RETRY_STATUSES:
+          return answer
+        self.limiter.hold(self.backoff * (2 ** attempt))
+      self.count('errors')
+      return answer
+
+    todo = {}
+    for point in points:
+      if point not in self.reverse:
+        todo[point] = True
+    self.count('points', len(todo))
+    if todo and self.revgeo_store:
+      found = self.revgeo_store.get_many(todo.keys())
+      self.count('points_stored', len(found))
+      self.reverse.update(found)
+      for point in found:
+        del todo[point]
+    if todo:
+      fetched = run_pool(fetch_reverse, todo.keys(), self.workers)
+      self.reverse.update(fetched)
+      if self.revgeo_store:
+        self.revgeo_store.put_many(fetched.items())
+
+  def lookup_reverse(self, lat, lng):
+    """returns (found, answer) for a prefetched point."""
+    if (lat, lng) in self.reverse:
+      return True, self.reverse[(lat, lng)]
+    return False, None
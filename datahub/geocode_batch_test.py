@@ -0,0 +1,284 @@
+ # Copyright 2009 Google Inc.
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #     http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Test for geocode_batch, against a stand-in Maps API geocoder on localhost
+"""
+
+import cgi
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+import geocode_batch
+import geocode_cache
+import revgeo_store
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<GeocodeResponse>
+ <status>%(status)s</status>
+ <result>
+  <formatted_address>%(address)s</formatted_address>
+  <geometry>
+   <location><lat>%(lat)s</lat><lng>%(lng)s</lng></location>
+   <location_type>%(location_type)s</location_type>
+  </geometry>
+ </result>
+</GeocodeResponse>
+"""
+NO_RESULTS = """<?xml version="1.0" encoding="UTF-8"?>
+<GeocodeResponse><status>%s</status></GeocodeResponse>
+"""
+
+# address (lowercased) -> formatted address, lat, lng, location type
+PLACES = {
+  'austin, tx': ('Austin, TX, USA', '30.2671530', '-97.7430608',
+                 'APPROXIMATE'),
+  '1 main st, austin, tx': ('1 Main St, Austin, TX 78701, USA', '30.2643',
+                            '-97.7467', 'ROOFTOP'),
+  'chicago, il': ('Chicago, IL, USA', '41.8781136', '-87.6297982',
+                  'APPROXIMATE'),
+}
+
+class StubGeocoder(BaseHTTPServer.BaseHTTPRequestHandler):
+  """answers /geocode?address=... from PLACES, and /reverse?latlng=...
+  with the latlng, after the server's latency.  The first quota_errors
+  requests are answered OVER_QUERY_LIMIT."""
+  def do_GET(self):
+    """geocode or reverse geocode."""
+    server = self.server
+    server.lock.acquire()
+    try:
+      server.requests.append((time.time(), self.path))
+      server.active += 1
+      server.max_active = max(server.max_active, server.active)
+      over_quota = server.quota_errors > 0
+      if over_quota:
+        server.quota_errors -= 1
+    finally:
+      server.lock.release()
+    time.sleep(server.latency)
+
+    path, query = (self.path.split('?', 1) + [''])[:2]
+    params = cgi.parse_qs(query)
+    if path == '/reverse':
+      if over_quota:
+        body = json.dumps({'status': 'OVER_QUERY_LIMIT'})
+      else:
+        body = json.dumps({'status': 'OK', 'latlng': params['latlng'][0]})
+    elif over_quota:
+      body = NO_RESULTS % 'OVER_QUERY_LIMIT'
+    else:
+      place = PLACES.get(params.get('address', [''])[0].lower())
+      if place:
+        body = RESPONSE % {'status': 'OK', 'address': place[0],
+                           'lat': place[1], 'lng': place[2],
+                           'location_type': place[3]}
+      else:
+        body = NO_RESULTS % 'ZERO_RESULTS'
+
+    server.lock.acquire()
+    server.active -= 1
+    server.lock.release()
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """the stand-in geocoder, on a free port."""
+  daemon_threads = True
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubGeocoder)
+    self.lock = threading.Lock()
+    self.requests = []
+    self.active = self.max_active = 0
+    self.latency = 0.0
+    self.quota_errors = 0
+
+
+class TestBatchGeocoder(unittest.TestCase):
+  """ Unittests on geocode_batch """
+  def setUp(self):
+    """ start the stub geocoder, with a fresh cache """
+    self.server = StubServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.setDaemon(True)
+    self.thread.start()
+    self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache = geocode_cache.GeocodeCache(
+      os.path.join(self.tmpdir, 'geocode_cache.db'), text_filename=None)
+
+  def tearDown(self):
+    """ stop the server """
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.tmpdir)
+
+  def url(self, query):
+    """ stub geocoder url for a query """
+    return self.base + '/geocode?' + urllib.urlencode({'address': query})
+
+  def geocoder(self, cache=None, **kwargs):
+    """ a BatchGeocoder for the stub, by default with no rate limit or
+    backoff """
+    kwargs.setdefault('rate', 0)
+    kwargs.setdefault('backoff', 0.0)
+    return geocode_batch.BatchGeocoder(self.url, cache or self.cache,
+                                       **kwargs)
+
+  def testResults(self):
+    """ results are parsed like geocoder.geocode_call's """
+    results = self.geocoder().geocode_many(['Austin, TX',
+                                            '1 Main St, Austin, TX',
+                                            'Nowhere'])
+    self.assertEqual(results['Austin, TX'],
+                     ('Austin, TX', '30.2671530', '-97.7430608', '2'))
+    self.assertEqual(results['1 Main St, Austin, TX'],
+                     ('1 Main St, Austin, TX 78701', '30.2643', '-97.7467',
+                      '5'))
+    self.assertEqual(results['Nowhere'], False)
+
+  def testDuplicates(self):
+    """ queries the same once normalized are requested once """
+    batch = self.geocoder()
+    queries = ['Austin, TX', 'austin,  tx', ' AUSTIN, TX;', 'Chicago, IL']
+    results = batch.geocode_many(queries)
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(results['austin,  tx'], results['Austin, TX'])
+    self.assertEqual(batch.lookup('Austin,   TX'),
+                     (True, results['Austin, TX']))
+    self.assertEqual(batch.lookup('Boston, MA'), (False, None))
+    # already seen: no more requests
+    batch.geocode_many(queries)
+    self.assertEqual(len(self.server.requests), 2)
+
+  def testCache(self):
+    """ results are cached, found ones and not found ones """
+    self.geocoder().geocode_many(['Austin, TX', 'Nowhere'])
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(self.cache.get('austin, tx'),
+                     (True, ('Austin, TX', '30.2671530', '-97.7430608', '2')))
+    self.assertEqual(self.cache.get('nowhere'), (True, False))
+    # a new process, with the same cache file
+    cache = geocode_cache.GeocodeCache(self.cache.filename, text_filename=None)
+    batch = self.geocoder(cache)
+    results = batch.geocode_many(['Austin, TX', 'Nowhere'])
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(results['Nowhere'], False)
+    self.assertEqual(batch.stats['cached'], 2)
+
+  def testConcurrent(self):
+    """ misses are requested concurrently, up to the number of workers """
+    self.server.latency = 0.2
+    queries = ['Place %d' % i for i in range(16)]
+    start = time.time()
+    self.geocoder(workers=8).geocode_many(queries)
+    elapsed = time.time() - start
+    self.assertEqual(len(self.server.requests), 16)
+    self.assertTrue(self.server.max_active <= 8)
+    self.assertTrue(self.server.max_active > 1)
+    # one at a time would take 3.2s
+    self.assertTrue(elapsed < 1.6, elapsed)
+
+  def testRateLimit(self):
+    """ requests from all the workers are spaced by the rate """
+    self.geocoder(workers=4, rate=20).geocode_many(
+      ['Place %d' % i for i in range(8)])
+    times = sorted([when for when, path in self.server.requests])
+    for i in range(1, len(times)):
+      self.assertTrue(times[i] - times[i - 1] >= 0.04)
+
+  def testQuotaBackoff(self):
+    """ quota errors are retried after a backoff, and not cached """
+    self.server.quota_errors = 2
+    start = time.time()
+    batch = self.geocoder(backoff=0.1)
+    results = batch.geocode_many(['Austin, TX'])
+    self.assertEqual(results['Austin, TX'][0], 'Austin, TX')
+    self.assertEqual(len(self.server.requests), 3)
+    self.assertEqual(batch.stats['retries'], 2)
+    # 0.1s then 0.2s
+    self.assertTrue(time.time() - start >= 0.3)
+
+  def testQuotaExhausted(self):
+    """ a query that keeps failing is False for this run but not cached """
+    self.server.quota_errors = 100
+    batch = self.geocoder(retries=2)
+    results = batch.geocode_many(['Austin, TX'])
+    self.assertEqual(results['Austin, TX'], False)
+    self.assertEqual(len(self.server.requests), 3)
+    self.assertEqual(batch.stats['errors'], 1)
+    self.assertEqual(batch.lookup('Austin, TX'), (True, False))
+    self.assertEqual(self.cache.get('austin, tx'), (False, None))
+
+  def rev_func(self, lat, lng, limiter):
+    """ the stub's reverse geocode, as a revgeo_store answer with the
+    latlng for the city """
+    limiter.wait()
+    fh = urllib2.urlopen(self.base + '/reverse?' +
+                         urllib.urlencode({'latlng': lat + ',' + lng}))
+    try:
+      jo = json.loads(fh.read())
+    finally:
+      fh.close()
+    return (jo['status'], jo.get('latlng'), None, None, None, None)
+
+  def testReverse(self):
+    """ reverse geocodes are prefetched through the pool, with retries """
+    self.server.quota_errors = 1
+    batch = self.geocoder()
+    points = [('30.26', '-97.74'), ('41.87', '-87.62'), ('30.26', '-97.74')]
+    batch.reverse_geocode_many(points, self.rev_func)
+    self.assertEqual(len(self.server.requests), 3)
+    self.assertEqual(batch.lookup_reverse('30.26', '-97.74'),
+                     (True, ('OK', '30.26,-97.74', None, None, None, None)))
+    self.assertEqual(batch.lookup_reverse('41.87', '-87.62')[1][0], 'OK')
+    self.assertEqual(batch.lookup_reverse('0.0', '0.0'), (False, None))
+
+  def testReverseStore(self):
+    """ reverse geocodes are read from the store, and the misses stored """
+    store = revgeo_store.RevGeoStore(
+      os.path.join(self.tmpdir, 'revgeo.db'), dirname=None)
+    store.put('30.26', '-97.74', ('OK', 'Austin', None, 'TX', None, 'US'))
+    batch = self.geocoder(revgeo_store=store)
+    batch.reverse_geocode_many([('30.26', '-97.74'), ('41.87', '-87.62')],
+                               self.rev_func)
+    self.assertEqual(len(self.server.requests), 1)
+    self.assertEqual(batch.stats['points'], 2)
+    self.assertEqual(batch.stats['points_stored'], 1)
+    self.assertEqual(batch.lookup_reverse('30.26', '-97.74')[1][1], 'Austin')
+    # a new process, with the same store
+    store = revgeo_store.RevGeoStore(store.filename, dirname=None)
+    self.assertEqual(store.get('41.87', '-87.62'),
+                     (True, ('OK', '41.87,-87.62', None, None, None, None)))
+    self.geocoder(revgeo_store=store).reverse_geocode_many(
+      [('41.8700', '-87.62')], self.rev_func)
+    self.assertEqual(len(self.server.requests), 1)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk geocode cache, shared by every footprint_lib.py process.
+
+Replaces the append-only geocode_cache.txt: entries live in an indexed
+sqlite table, so a lookup is one indexed read instead of loading the
+whole file, and concurrent pipeline processes can write safely.
+Negative results ("can't be found") expire after NEGATIVE_TTL so they
+get retried.
+
+usage: geocode_cache.py [--import geocode_cache.txt] [--compact] [--stats]
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+from optparse import OptionParser
+
+GEOCODE_DB_FN = "geocode_cache.db"
+# the old text cache, imported when the database is first created
+GEOCODE_TEXT_FN = "geocode_cache.txt"
+
+# retry queries that couldn't be geocoded after 30 days
+NEGATIVE_TTL = (30 * 86400)
+
+# seconds to wait for another process's write lock
+LOCK_TIMEOUT = 60.0
+
+TNRFV_RX = re.compile(r'\\[tnrfv]')
+SPACES_RX = re.compile(r'\s\s+')
+DELIMITERS_RX = re.compile(r'[\n|;]')
+
+def filter_cache_delimiters(s):
+  """replace the characters the old text cache used as delimiters."""
+  return DELIMITERS_RX.sub(r' ', s)
+
+
+def normalize_cache_key(query):
+  """Simplifies the query for better matching in the cache."""
+  # tnrfv: tab, newline, carriage return, form feed, vertical tab
+  query = TNRFV_RX.sub(r' ', query)
+  # multiple spaces to single space
+  query = SPACES_RX.sub(r' ', query)
+  # lower case, strip spaces from beginning and end
+  query = query.lower().strip()
+  return query
+
+
+class GeocodeCache(object):
+  """query -> (address, latitude, longitude, accuracy), or False if the
+  query is known not to geocode."""
+  def __init__(self, filename=GEOCODE_DB_FN, text_filename=GEOCODE_TEXT_FN,
+               negative_ttl=NEGATIVE_TTL):
+    self.filename = filename
+    self.text_filename = text_filename
+    self.negative_ttl = negative_ttl
+    self.conn = None
+    # results already looked up by this process
+    self.memo = {}
+
+  def connect(self):
+    """open the database on first use, creating (and importing the text
+    cache into) it if need be."""
+    if self.conn:
+      return self.conn
+    is_new = not os.path.exists(self.filename)
+    self.conn = sqlite3.connect(self.filename, timeout=LOCK_TIMEOUT)
+    # keep values as the byte strings we were given
+    self.conn.text_factory = str
+    self.conn.execute("CREATE TABLE IF NOT EXISTS geocode ("
+                      " key TEXT PRIMARY KEY,"
+                      " address TEXT, latitude TEXT, longitude TEXT,"
+                      " accuracy TEXT, updated INTEGER)")
+    self.conn.commit()
+    if is_new and self.text_filename and os.path.exists(self.text_filename):
+      self.import_text(self.text_filename)
+    return self.conn
+
+  def get(self, query):
+    """returns (found, result) for the query."""
+    key = normalize_cache_key(query)
+    if key in self.memo:
+      return True, self.memo[key]
+
+    row = self.connect().execute(
+      "SELECT address, latitude, longitude, accuracy, updated"
+      " FROM geocode WHERE key = ?", (key,)).fetchone()
+    if not row:
+      return False, None
+
+    if row[0] is None:
+      if self.negative_ttl and row[4] < time.time() - self.negative_ttl:
+        # expired negative result: try again
+        return False, None
+      result = False
+    else:
+      result = tuple(row[:4])
+    self.memo[key] = result
+    return True, result
+
+  def get_many(self, queries):
+    """returns {normalized key: result} for the queries that are found."""
+    found = {}
+    keys = {}
+    for query in queries:
+      key = normalize_cache_key(query)
+      if key in self.memo:
+        found[key] = self.memo[key]
+      else:
+        keys[key] = True
+    keys = keys.keys()
+    conn = self.connect()
+    expired = time.time() - self.negative_ttl
+    # sqlite allows 999 parameters per statement
+    for i in range(0, len(keys), 500):
+      chunk = keys[i:i + 500]
+      cursor = conn.execute(
+        "SELECT key, address, latitude, longitude, accuracy, updated"
+        " FROM geocode WHERE key IN (" + ",".join(["?"] * len(chunk)) + ")",
+        chunk)
+      for row in cursor:
+        if row[1] is None:
+          if self.negative_ttl and row[5] < expired:
+            # expired negative result: try again
+            continue
+          result = False
+        else:
+          result = tuple(row[1:5])
+        self.memo[row[0]] = found[row[0]] = result
+    return found
+
+  def put(self, query, result, commit=True):
+    """store a result tuple, or None/False if the query can't be found."""
+    key = normalize_cache_key(query)
+    conn = self.connect()
+    conn.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)",
+                 self.make_row(key, result))
+    if commit:
+      conn.commit()
+    if result:
+      self.memo[key] = tuple(result)
+    else:
+      self.memo[key] = False
+
+  def put_many(self, results):
+    """store a list of (query, result), in one transaction."""
+    for query, result in results:
+      self.put(query, result, commit=False)
+    self.connect().commit()
+
+  def make_row(self, key, result):
+    """table row for a normalized key and result."""
+    if result:
+      return (key,) + tuple(result) + (int(time.time()),)
+    return (key, None, None, None, None, int(time.time()))
+
+  def import_text(self, filename):
+    """import a geocode_cache.txt file, returns the number of lines read."""
+    numlines = 0
+    conn = self.connect()
+    fh = open(filename, "r")
+    try:
+      for line in fh:
+        # Cache line format is:
+        #   query|address;latitude;longitude;accuracy
+        # For example:
+        #   ca|California;36.7782610;-119.4179324;2
+        # Or, if the location can't be found:
+        #   Any city anywhere|
+        if "|" not in line:
+          continue
+        try:
+          key, result = line.strip().split("|")
+        except ValueError:
+          continue
+        if ";" in result:
+          result = result.split(";")
+          if len(result) != 4:
+            continue
+        else:
+          result = None
+        # later lines win, as they did when the file was loaded into a dict
+        conn.execute("INSERT OR REPLACE INTO geocode"
+                     " VALUES (?, ?, ?, ?, ?, ?)",
+                     self.make_row(normalize_cache_key(key), result))
+        numlines += 1
+    finally:
+      fh.close()
+    conn.commit()
+    return numlines
+
+  def compact(self):
+    """drop expired negative results and reclaim the space."""
+    conn = self.connect()
+    cursor = conn.execute("DELETE FROM geocode WHERE address IS NULL"
+                          " AND updated < ?",
+                          (int(time.time() - self.negative_ttl),))
+    conn.commit()
+    conn.execute("VACUUM")
+    return cursor.rowcount
+
+  def stats(self):
+    """returns (positive, negative) entry counts."""
+    conn = self.connect()
+    positive = conn.execute("SELECT COUNT(*) FROM geocode"
+                            " WHERE address IS NOT NULL").fetchone()[0]
+    negative = conn.execute("SELECT COUNT(*) FROM geocode"
+                            " WHERE address IS NULL").fetchone()[0]
+    return positive, negative
+
+
+def main():
+  """import, compact or report on the cache."""
+  parser = OptionParser("usage: %prog [--db geocode_cache.db] " +
+                        "[--import geocode_cache.txt] [--compact] [--stats]")
+  parser.add_option("--db", dest="db", default=GEOCODE_DB_FN)
+  parser.add_option("--import", dest="import_fn")
+  parser.add_option("--compact", action="store_true", dest="compact",
+                    default=False)
+  parser.add_option("--stats", action="store_true", dest="stats",
+                    default=False)
+  (options, args) = parser.parse_args(sys.argv[1:])
+  if not (options.import_fn or options.compact or options.stats):
+    parser.print_help()
+    sys.exit(0)
+
+  cache = GeocodeCache(options.db, text_filename=None)
+  if options.import_fn:
+    print "imported", cache.import_text(options.import_fn), "lines"
+  if options.compact:
+    print "removed", cache.compact(), "expired entries"
+  if options.stats:
+    positive, negative = cache.stats()
+    print positive, "results,", negative, "negative results"
+
+if __name__ == "__main__":
+  main()
@@ -23,6 +23,8 @@ import json
 import urllib
 import urllib2
 import xml_helpers as xmlh
+import geocode_cache
+from geocode_cache import filter_cache_delimiters
 from datetime import datetime
 
 #API_KEY = "ABQIAAAAxq97AW0x5_CNgn6-nLxSrxQuOQhskTx7t90ovP5xOuY_YrlyqBQajVan2ia99rD9JgAcFrdQnTD4JQ"
@@ -38,24 +40,7 @@ def print_debug(msg):
     print datetime.now(), msg
 
 
-def normalize_cache_key(query):
-  """Simplifies the query for better matching in the cache."""
-  # tnrfv: tab, newline, carriage return, form feed, vertical tab
-  query = re.sub(r'\\[tnrfv]', r' ', query)
-  # multiple spaces to single space
-  query = re.sub(r'\s\s+', r' ', query)
-  # lower case, strip spaces from beginning and end
-  query = query.lower().strip()
-  return query
-
-
-def filter_cache_delimiters(s):
-  for delim in (r'\n', r'\|', r';'):
-    s = re.sub(delim, r' ', s)
-  return s
-
-GEOCODE_CACHE = None
-GEOCODE_CACHE_FN = "geocode_cache.txt"
+GEOCODE_CACHE = geocode_cache.GeocodeCache()
 def geocode(query):
   """Looks up a location query using GMaps API with a local cache and
   returns: address, latitude, longitude, accuracy (as strings).  On
@@ -64,41 +49,12 @@ def geocode(query):
   Accuracy levels:
   7-9 = street address, 6 = road, 5 = zip code
   4 = city, 3 = county, 2 = state, 1 = country"""
-  global GEOCODE_CACHE
-
   query = filter_cache_delimiters(query)
 
-  # load the cache
-  if GEOCODE_CACHE == None:
-    GEOCODE_CACHE = {}
-    geocode_fh = open(GEOCODE_CACHE_FN, "r")
-    try:
-      for line in geocode_fh:
-        # Cache line format is:
-        #   query|address;latitude;longitude;accuracy
-        # For example:
-        #   ca|California;36.7782610;-119.4179324;2
-        # Or, if the location can't be found:
-        #   Any city anywhere|
-        if "|" in line:
-          key, result = line.strip().split("|")
-          key = normalize_cache_key(key)
-          if ";" in result:
-            result = tuple(result.split(";"))
-          else:
-            result = False
-          GEOCODE_CACHE[key] = result
-
-          #if GEOCODE_DEBUG:
-          #  if len(GEOCODE_CACHE) % 250 == 0:
-          #    print_debug("read " + str(len(GEOCODE_CACHE)) + " geocode cache entries.")
-    finally:
-      geocode_fh.close()
-
   # try the cache
-  key = normalize_cache_key(query)
-  if key in GEOCODE_CACHE:
-    return GEOCODE_CACHE[key]
+  found, result = GEOCODE_CACHE.get(query)
+  if found:
+    return result
 
   # call Google Maps API
   result = geocode_call(query)
@@ -109,17 +65,12 @@ def geocode(query):
   # cache the result
   if result == None:
     result = False
-    cacheline = query + "|"
   else:
-    result = map(filter_cache_delimiters, result)
-    cacheline = query + "|" + ";".join(result)
-
-  geocode_fh = open(GEOCODE_CACHE_FN, "a")
-  xmlh.print_progress("storing cacheline: "+cacheline, "", SHOW_PROGRESS)
-  geocode_fh.write(cacheline + "\n")
-  geocode_fh.close()
+    result = tuple(map(filter_cache_delimiters, result))
 
-  GEOCODE_CACHE[key] = result
+  xmlh.print_progress("storing geocode: " + query + "|" +
+                      ";".join(result or []), "", SHOW_PROGRESS)
+  GEOCODE_CACHE.put(query, result)
   return result
 
 
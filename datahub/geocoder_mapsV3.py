@@ -29,16 +29,17 @@ import hmac
 import base64
 
 import xml_helpers as xmlh
+import geocode_cache
+import geocode_batch
+import revgeo_store
+from geocode_cache import filter_cache_delimiters
 from datetime import datetime
 
 CLIENT_ID = "gme-craigslistfoundation"
 from private_keys import *
- 
-ACCURACY = { "ROOFTOP" : 5, # precise geocode accurate down to street address
-             "RANGE_INTERPOLATED" : 4, # an approximation interpolated between two precise points 
-             "GEOMETRIC_CENTER" : 3, # geometric center of a result such as a polyline 
-             "APPROXIMATE" : 2, # indicates that the returned result is approximate.
-           }
+
+MAPS_API_HOST = "http://maps.googleapis.com"
+ACCURACY = geocode_batch.ACCURACY
 
 # Show status messages (also applies to xml parsing)
 SHOW_PROGRESS = False
@@ -50,24 +51,7 @@ def print_debug(msg):
     print datetime.now(), msg
 
 
-def normalize_cache_key(query):
-  """Simplifies the query for better matching in the cache."""
-  # tnrfv: tab, newline, carriage return, form feed, vertical tab
-  query = re.sub(r'\\[tnrfv]', r' ', query)
-  # multiple spaces to single space
-  query = re.sub(r'\s\s+', r' ', query)
-  # lower case, strip spaces from beginning and end
-  query = query.lower().strip()
-  return query
-
-
-def filter_cache_delimiters(s):
-  for delim in (r'\n', r'\|', r';'):
-    s = re.sub(delim, r' ', s)
-  return s
-
-GEOCODE_CACHE = None
-GEOCODE_CACHE_FN = "geocode_cache.txt"
+GEOCODE_CACHE = geocode_cache.GeocodeCache()
 def geocode(query):
   """Looks up a location query using GMaps API with a local cache and
   returns: address, latitude, longitude, accuracy (as strings).  On
@@ -76,41 +60,12 @@ def geocode(query):
   Accuracy levels:
   7-9 = street address, 6 = road, 5 = zip code
   4 = city, 3 = county, 2 = state, 1 = country"""
-  global GEOCODE_CACHE
-
   query = filter_cache_delimiters(query)
 
-  # load the cache
-  if GEOCODE_CACHE == None:
-    GEOCODE_CACHE = {}
-    geocode_fh = open(GEOCODE_CACHE_FN, "r")
-    try:
-      for line in geocode_fh:
-        # Cache line format is:
-        #   query|address;latitude;longitude;accuracy
-        # For example:
-        #   ca|California;36.7782610;-119.4179324;2
-        # Or, if the location can't be found:
-        #   Any city anywhere|
-        if "|" in line:
-          key, result = line.strip().split("|")
-          key = normalize_cache_key(key)
-          if ";" in result:
-            result = tuple(result.split(";"))
-          else:
-            result = False
-          GEOCODE_CACHE[key] = result
-
-          #if GEOCODE_DEBUG:
-          #  if len(GEOCODE_CACHE) % 250 == 0:
-          #    print_debug("read " + str(len(GEOCODE_CACHE)) + " geocode cache entries.")
-    finally:
-      geocode_fh.close()
-
   # try the cache
-  key = normalize_cache_key(query)
-  if key in GEOCODE_CACHE:
-    return GEOCODE_CACHE[key]
+  found, result = GEOCODE_CACHE.get(query)
+  if found:
+    return result
 
   # call Google Maps API
   result = geocode_call(query)
@@ -121,17 +76,12 @@ def geocode(query):
   # cache the result
   if result == None:
     result = False
-    cacheline = query + "|"
   else:
-    result = map(filter_cache_delimiters, result)
-    cacheline = query + "|" + ";".join(result)
-
-  geocode_fh = open(GEOCODE_CACHE_FN, "a")
-  xmlh.print_progress("storing cacheline: "+cacheline, "", SHOW_PROGRESS)
-  geocode_fh.write(cacheline + "\n")
-  geocode_fh.close()
+    result = tuple(map(filter_cache_delimiters, result))
 
-  GEOCODE_CACHE[key] = result
+  xmlh.print_progress("storing geocode: " + query + "|" +
+                      ";".join(result or []), "", SHOW_PROGRESS)
+  GEOCODE_CACHE.put(query, result)
   return result
 
 def sign_maps_api_request(url):
@@ -142,6 +92,17 @@ def sign_maps_api_request(url):
   return base64.urlsafe_b64encode(signature.digest())
 
 
+def geocode_url(query):
+  """signed Maps API xml geocode request for a query."""
+  params = urllib.urlencode({'address' : query, 
+                             'region' : 'us', 
+                             'sensor' : 'false', 
+                             'client' : CLIENT_ID})
+  request = "/maps/api/geocode/xml?%s" % params
+  signature = sign_maps_api_request(request)
+  return MAPS_API_HOST + request + "&signature=" + signature
+
+
 def geocode_call(query, retries=4):
   """Queries the Google Maps geocoder and returns: address, latitude,
   longitude, accuracy (as strings).  Returns None if the query is
@@ -151,14 +112,8 @@ def geocode_call(query, retries=4):
     print_debug("geocoder retry limit exceeded")
     return False
 
-  params = urllib.urlencode({'address' : query, 
-                             'region' : 'us', 
-                             'sensor' : 'false', 
-                             'client' : CLIENT_ID})
+  url = geocode_url(query)
   try:
-    request = "/maps/api/geocode/xml?%s" % params
-    signature = sign_maps_api_request(request)
-    url = "http://maps.googleapis.com" + request + "&signature=" + signature
     maps_fh = urllib2.urlopen(url)
     res = maps_fh.read()
     maps_fh.close()
@@ -166,82 +121,34 @@ def geocode_call(query, retries=4):
     print_debug("geocode_call: Error calling Maps API" + str(err) + "\n" + url)
     return False
 
-  try:
-    node = xmlh.simple_parser(res, [], False)
-    node = node.getElementsByTagName('GeocodeResponse')[0]
-  except:
+  respcode, result = geocode_batch.parse_geocode_xml(res)
+  if respcode is None:
     print_debug("unparseable response: " + res)
     return False
-    
-  respcode = xmlh.get_tag_val(node, "status")
-  if respcode != "OK":
-    print_debug("Maps API reponded " + respcode)
-    return None
 
-  if respcode == "UNKNOWN_ERROR":  # problem with the server
-    print_debug("geocode_call: Connection problem.  retrying...")
+  if respcode in geocode_batch.RETRY_STATUSES:  # quota or server problem
+    print_debug("geocode_call: Maps API responded " + respcode +
+                ".  retrying...")
     if retries > 0:
       time.sleep(3)
     return geocode_call(query, retries - 1)
 
-  result_node = node.getElementsByTagName('result')[0]
-  addr = xmlh.get_tag_val(result_node, "formatted_address")
-  # removes "USA" from all addresses.
-  addr = re.sub(r', USA$', r'', addr)
-
-  geo_node = result_node.getElementsByTagName('geometry')[0]
-  location_type = xmlh.get_tag_val(geo_node, "location_type")
-
-  ll_node = geo_node.getElementsByTagName('location')[0]
-  lat = xmlh.get_tag_val(ll_node, "lat")
-  lng = xmlh.get_tag_val(ll_node, "lng")
-
-  accuracy = str(ACCURACY.get(xmlh.get_tag_val(geo_node, "location_type"), "1"))
+  if respcode != "OK":
+    print_debug("Maps API reponded " + respcode)
+    return None
 
-  return (addr, lat, lng, accuracy)
+  return result
 
 
-def rev_geocode_json(lat, lng, key = None, retries = 0, msgd = {}):
-  """ """
+def rev_geocode_json(lat, lng, retries = 0, limiter = None):
+  """reverse geocode json object for lat, lng from the Maps API, or None.
+  limiter.wait() is called, if given, before a request."""
 
   jo = None
-  if not key:
-    try:
-      if float(lat) < 0:
-        ns = 'S'
-      else:
-        ns = 'N'
-      if float(lng) < 0:
-        ew ='E'
-      else:
-        ew = 'W'
-
-      lat_str = ns + str(round(abs(float(lat)) * 10000.0)/10000.0).replace('.', '_').rstrip('0')
-      lng_str = ew + str(round(abs(float(lng)) * 10000.0)/10000.0).replace('.', '_').rstrip('0')
-    except:
-      # most likely given junk lat/lng
-      return jo
-
-    key = 'revgeo/G' + 'lat' + lat_str + 'lng' + lng_str + '.json'
-    if 'OVER_QUERY_LIMIT' in msgd and not os.path.isfile(key):
-      lat_str = str(round(float(lat) * 10000.0)/10000.0).replace('.', '_').rstrip('0')
-      lng_str = str(round(float(lng) + 10000.0)/10000.0).replace('.', '_').rstrip('0')
-      key = 'revgeo/' + 'lat' + lat_str + 'lng' + lng_str + '.json'
+  if revgeo_store.point_key(lat, lng) is None:
+    # most likely given junk lat/lng
+    return jo
 
-  if key:
-    try:
-      fh = open(key, 'r')
-      json_str = fh.read()
-      fh.close()
-      try:
-        jo = json.loads(json_str.encode('ascii', 'xmlcharrefreplace'))
-        return jo
-      except:
-        print_debug("rev_geocode_json: could not loads cached " + key)
-    except:
-      # not cached
-      pass
-  
   latlng = str(lat) + ',' + str(lng)
   params = urllib.urlencode({'latlng':latlng, 
                              'sensor':'false', 
@@ -249,10 +156,12 @@ def rev_geocode_json(lat, lng, key = None, retries = 0, msgd = {}):
   request = "/maps/api/geocode/json?%s" % params
   signature = sign_maps_api_request(request)
 
-  url = "http://maps.googleapis.com" + request + "&signature=" + signature
+  url = MAPS_API_HOST + request + "&signature=" + signature
 
   json_str = ""
   try:
+    if limiter:
+      limiter.wait()
     fh = urllib2.urlopen(url)
     json_str = fh.read()
     fh.close()
@@ -262,29 +171,39 @@ def rev_geocode_json(lat, lng, key = None, retries = 0, msgd = {}):
     if retries < 2:
       retries += 1
       time.sleep(1)
-      return rev_geocode_json(lat, lng, key, retries)
+      return rev_geocode_json(lat, lng, retries, limiter)
 
   if json_str:
     try:
       jo = json.loads(json_str.encode('ascii', 'xmlcharrefreplace'))
     except:
-      print_debug("rev_geocode_json: could not loads " + key)
+      print_debug("rev_geocode_json: could not loads " + latlng)
 
-    if jo and key:
-      if jo['status'] == 'OK' or jo['status'] == 'ZERO_RESULTS':
-        try:
-          fh = open(key, 'w')
-          fh.write(json_str)
-          fh.close()
-        except:
-          print_debug("rev_geocode_json: could not cache " + key)
-
-      elif jo['status'] == 'OVER_QUERY_LIMIT':
-        print_debug("rev_geocode_json: OVER_QUERY_LIMIT " + key)
+    if jo and jo.get('status') == 'OVER_QUERY_LIMIT':
+      print_debug("rev_geocode_json: OVER_QUERY_LIMIT " + latlng)
 
   return jo
 
 
+def fetch_rev_geocode(lat, lng, limiter = None):
+  """the revgeo_store answer tuple for lat, lng from the Maps API, or
+  None.  Doesn't use REVGEO_STORE, so it can be called from any thread."""
+  return revgeo_store.extract_fields(rev_geocode_json(lat, lng, 0, limiter))
+
+
+REVGEO_STORE = revgeo_store.RevGeoStore()
+def rev_geocode(lat, lng):
+  """(status, city, county, state, zip, country) for lat, lng, with None
+  for the fields the Maps API didn't give, from REVGEO_STORE or the Maps
+  API.  None on failure."""
+  found, answer = REVGEO_STORE.get(lat, lng)
+  if found:
+    return answer
+  answer = fetch_rev_geocode(lat, lng)
+  REVGEO_STORE.put(lat, lng, answer)
+  return answer
+
+
 def geocode_json(query):
 
   params = urllib.urlencode({'address' : query,
@@ -295,7 +214,7 @@ def geocode_json(query):
   try:
     request = "/maps/api/geocode/json?%s" % params
     signature = sign_maps_api_request(request)
-    url = "http://maps.googleapis.com" + request + "&signature=" + signature
+    url = MAPS_API_HOST + request + "&signature=" + signature
     maps_fh = urllib2.urlopen(url)
     res = maps_fh.read()
     maps_fh.close()
@@ -339,7 +258,7 @@ def main(argv):
         lat = ll[0]
         lng = ll[1]
     if lat and lng:
-      jo = rev_geocode_json(lat, lng, None, 0)
+      jo = rev_geocode_json(lat, lng)
       if jo:
         print json.dumps(jo, indent=2)
 
@@ -110,7 +110,7 @@ do
 		rm -f $fileBase"1.gz"
 		mv $transTSV $fileBase.$whenStamp.transformed
 		./upload.sh $fileBase.$whenStamp.transformed >> $log 2>&1
-		# wget -q -O /dev/null http://staging.servicefootprint.appspot.com/cache-update
+		wget -q -O /dev/null http://staging.servicefootprint.appspot.com/cache-update
 		# echo "processed $feedXML"
 		endTime=$(date +%s)
 		diffTime=$(( $endTime - $startTimeP ))
@@ -137,6 +137,8 @@ then
         		./upload.sh `ls -1 $IT*.transformed`
 		done
 	fi
+	# search results cached for the old data are stale now
+	wget -q -O /dev/null http://staging.servicefootprint.appspot.com/cache-update
 	./notify_michael.sh pipeline upload complete
 
         # update the dash board
@@ -18,6 +18,7 @@ parser for footprint itself (identity parse)
 """
 import xml_helpers as xmlh
 from datetime import datetime
+from xml.dom import minidom
 import re
 
 from pipeline import print_progress
@@ -84,6 +85,85 @@ def set_default_time_elem(parent, entity, tagname, timest=xmlh.current_ts()):
   cdt = xmlh.set_default_value(parent, entity, tagname, timest)
   xmlh.set_default_attr(parent, cdt, "olsonTZ", "America/Los_Angeles")
 
+FEEDINFO_RX = re.compile('<FeedInfo>.+?</FeedInfo>', re.DOTALL)
+ORGANIZATION_RX = re.compile('<Organization>.+?</Organization>', re.DOTALL)
+OPPORTUNITY_RX = re.compile(
+    '<VolunteerOpportunity>.+?</VolunteerOpportunity>', re.DOTALL)
+
+RECORD_TAGS = ['FeedInfo', 'Organization', 'VolunteerOpportunity']
+
+def fast_feedinfo_node(xmlstr):
+  """parse_fast for a single <FeedInfo> element, as a DOM."""
+  node = xmlh.simple_parser(xmlstr, KNOWN_ELEMENTS, False)
+  xmlh.set_default_value(node, node.firstChild, "feedID", "0")
+  set_default_time_elem(node, node.firstChild, "createdDateTime")
+  return node
+
+def fast_feedinfo(xmlstr):
+  """parse_fast for a single <FeedInfo> element."""
+  return xmlh.prettyxml(fast_feedinfo_node(xmlstr), True)
+
+def fast_organization_node(xmlstr):
+  """parse_fast for a single <Organization> element, as a DOM."""
+  return xmlh.simple_parser(xmlstr, KNOWN_ELEMENTS, False)
+
+def fast_organization(xmlstr):
+  """parse_fast for a single <Organization> element."""
+  return xmlh.prettyxml(fast_organization_node(xmlstr), True)
+
+def fast_opportunity_node(xmlstr):
+  """parse_fast for a single <VolunteerOpportunity> element, as a DOM."""
+  opp = xmlh.simple_parser(xmlstr, KNOWN_ELEMENTS, False)
+
+  # these set_default_* functions dont do anything if the field
+  # doesnt already exists
+  xmlh.set_default_value(opp, opp, "volunteersNeeded", -8888)
+  xmlh.set_default_value(opp, opp, "paid", "No")
+  xmlh.set_default_value(opp, opp, "sexRestrictedTo", "Neither")
+  xmlh.set_default_value(opp, opp, "language", "English")
+  set_default_time_elem(opp, opp, "lastUpdated")
+  set_default_time_elem(opp, opp, "expires", 
+      xmlh.current_ts(DEFAULT_EXPIRATION))
+ 
+  try:
+    opplocs = opp.getElementsByTagName("location")
+  except:
+    opplocs = []
+
+  for loc in opplocs:
+    xmlh.set_default_value(opp, loc, "virtual", "No")
+    xmlh.set_default_value(opp, loc, "country", "US")
+
+  try:
+    dttms = opp.getElementsByTagName("dateTimeDurations")
+  except:
+    dttms = []
+
+  for dttm in dttms:
+    # redundant xmlh.set_default_value(opp, dttm, "openEnded", "No")
+    xmlh.set_default_value(opp, dttm, "iCalRecurrence", "")
+    if (dttm.getElementsByTagName("startTime") == None and
+        dttm.getElementsByTagName("endTime") == None):
+      set_default_time_elem(opp, dttm, "timeFlexible", "Yes")
+    else:
+      set_default_time_elem(opp, dttm, "timeFlexible", "No")
+    xmlh.set_default_value(opp, dttm, "openEnded", "No")
+
+  try:
+    time_elems = opp.getElementsByTagName("startTime")
+    time_elems += opp.getElementsByTagName("endTime")
+  except:
+    time_elems = []
+
+  for el in time_elems:
+    xmlh.set_default_attr(opp, el, "olsonTZ", "America/Los_Angeles")
+
+  return opp
+
+def fast_opportunity(xmlstr):
+  """parse_fast for a single <VolunteerOpportunity> element."""
+  return xmlh.prettyxml(fast_opportunity_node(xmlstr), True)
+
 def parse_fast(instr, maxrecs, progress):
   """fast parser but doesn't check correctness,
   i.e. must be pre-checked by caller."""
@@ -92,84 +172,72 @@ def parse_fast(instr, maxrecs, progress):
   outstr_list.append('<FootprintFeed schemaVersion="0.1">')
 
   # note: processes Organizations first, so ID lookups work
-  for match in re.finditer(re.compile('<FeedInfo>.+?</FeedInfo>',
-                                      re.DOTALL), instr):
-    node = xmlh.simple_parser(match.group(0), KNOWN_ELEMENTS, False)
-    xmlh.set_default_value(node, node.firstChild, "feedID", "0")
-    set_default_time_elem(node, node.firstChild, "createdDateTime")
-    outstr_list.append(xmlh.prettyxml(node, True))
+  for match in re.finditer(FEEDINFO_RX, instr):
+    outstr_list.append(fast_feedinfo(match.group(0)))
 
   outstr_list.append('<Organizations>')
-  for match in re.finditer(re.compile('<Organization>.+?</Organization>',
-                                      re.DOTALL), instr):
-    node = xmlh.simple_parser(match.group(0), KNOWN_ELEMENTS, False)
+  for match in re.finditer(ORGANIZATION_RX, instr):
     numorgs += 1
-    outstr_list.append(xmlh.prettyxml(node, True))
+    outstr_list.append(fast_organization(match.group(0)))
   outstr_list.append('</Organizations>')
                
   outstr_list.append('<VolunteerOpportunities>')
-  for match in re.finditer(re.compile(
-      '<VolunteerOpportunity>.+?</VolunteerOpportunity>', re.DOTALL), instr):
-    opp = xmlh.simple_parser(match.group(0), KNOWN_ELEMENTS, False)
-
+  for match in re.finditer(OPPORTUNITY_RX, instr):
     numopps += 1
     if (maxrecs > 0 and numopps > maxrecs):
       break
     #if progress and numopps % 250 == 0:
     #  print datetime.now(), ": ", numopps, " records generated."
 
-    # these set_default_* functions dont do anything if the field
-    # doesnt already exists
-    xmlh.set_default_value(opp, opp, "volunteersNeeded", -8888)
-    xmlh.set_default_value(opp, opp, "paid", "No")
-    xmlh.set_default_value(opp, opp, "sexRestrictedTo", "Neither")
-    xmlh.set_default_value(opp, opp, "language", "English")
-    set_default_time_elem(opp, opp, "lastUpdated")
-    set_default_time_elem(opp, opp, "expires", 
-        xmlh.current_ts(DEFAULT_EXPIRATION))
-   
-    try:
-      opplocs = opp.getElementsByTagName("location")
-    except:
-      opplocs = []
-
-    for loc in opplocs:
-      xmlh.set_default_value(opp, loc, "virtual", "No")
-      xmlh.set_default_value(opp, loc, "country", "US")
-
-    try:
-      dttms = opp.getElementsByTagName("dateTimeDurations")
-    except:
-      dttms = []
-
-    for dttm in dttms:
-      # redundant xmlh.set_default_value(opp, dttm, "openEnded", "No")
-      xmlh.set_default_value(opp, dttm, "iCalRecurrence", "")
-      if (dttm.getElementsByTagName("startTime") == None and
-          dttm.getElementsByTagName("endTime") == None):
-        set_default_time_elem(opp, dttm, "timeFlexible", "Yes")
-      else:
-        set_default_time_elem(opp, dttm, "timeFlexible", "No")
-      xmlh.set_default_value(opp, dttm, "openEnded", "No")
-
-    try:
-      time_elems = opp.getElementsByTagName("startTime")
-      time_elems += opp.getElementsByTagName("endTime")
-    except:
-      time_elems = []
-
-    for el in time_elems:
-      xmlh.set_default_attr(opp, el, "olsonTZ", "America/Los_Angeles")
-
-    str_opp = xmlh.prettyxml(opp, True)
-
-    outstr_list.append(str_opp)
+    outstr_list.append(fast_opportunity(match.group(0)))
 
   outstr_list.append('</VolunteerOpportunities>')
 
   outstr_list.append('</FootprintFeed>')
   return "".join(outstr_list), numorgs, numopps
 
+def iter_feed_records(instr):
+  """(tagname, xmlstr) for each record of an FPXML string, in the order
+  parse_fast handles them: FeedInfo, then Organizations, then
+  opportunities."""
+  for tag, regexp in (('FeedInfo', FEEDINFO_RX),
+                      ('Organization', ORGANIZATION_RX),
+                      ('VolunteerOpportunity', OPPORTUNITY_RX)):
+    for match in re.finditer(regexp, instr):
+      yield tag, match.group(0)
+
+def parse_records(records, maxrecs, progress, feedinfo=None):
+  """streaming version of parse_fast: given (tagname, xmlstr) pairs, e.g.
+  from xmlh.iter_records() or iter_feed_records(), yield (tagname, DOM)
+  with each record rewritten exactly as parse_fast would have, but
+  left parsed: the DOM goes straight to footprint_lib's converter
+  instead of being written out as FPXML and parsed again.  If feedinfo
+  is given, it replaces every <FeedInfo>, as in parser()."""
+  numopps = 0
+  for tag, xmlstr in records:
+    if tag == 'FeedInfo':
+      if feedinfo is not None:
+        node = xmlh.simple_parser(feedinfo, KNOWN_ELEMENTS, False)
+      else:
+        node = fast_feedinfo_node(xmlstr)
+    elif tag == 'Organization':
+      node = fast_organization_node(xmlstr)
+    elif tag == 'VolunteerOpportunity':
+      numopps += 1
+      if (maxrecs > 0 and numopps > maxrecs):
+        break
+      node = fast_opportunity_node(xmlstr)
+    else:
+      continue
+    if not isinstance(node, minidom.Node):
+      # parse_or_die()'s last resort, which parse_fast writes out as
+      # nothing
+      continue
+    yield tag, node
+
+# parsers which can stream expose parse_records(records, maxrecs, progress)
+parse_fast.parse_records = parse_records
+
 def parse(instr, maxrecs, progress):
   """return python DOM object given FPXML"""
   # parsing footprint format is the identity operation
@@ -193,6 +261,9 @@ def parser(providerID, providerName, feedID, providerURL, feedDescription):
   def parse_func(instr, maxrecs, progress):
     """closure-- generated parse func"""
     outstr, numorgs, numopps = parse_fast(instr, maxrecs, progress)
-    return re.sub(re.compile(r'<FeedInfo>.+?</FeedInfo>', re.DOTALL),
-                  feedinfo, outstr), numorgs, numopps
+    return re.sub(FEEDINFO_RX, feedinfo, outstr), numorgs, numopps
+  def parse_records_func(records, maxrecs, progress):
+    """closure-- generated streaming parse func"""
+    return parse_records(records, maxrecs, progress, feedinfo)
+  parse_func.parse_records = parse_records_func
   return parse_func
@@ -16,6 +16,9 @@ from datetime import datetime
 import random
 import commands
 import subprocess
+import fcntl
+import multiprocessing
+import traceback
 
 from dateutil import parser
 from dateutil import relativedelta
@@ -26,7 +29,7 @@ import optparse
 import providers
 import pipeline_keys
 
-from csv import DictReader, DictWriter, excel_tab, register_dialect, QUOTE_NONE
+from csv import reader, writer, excel_tab, register_dialect, QUOTE_NONE
 
 import footprint_lib
 import xml_helpers as xmlh
@@ -45,6 +48,14 @@ LOG_FN = "load_gbase.log"
 LOG_FN_BZ2 = "load_gbase.log.bz2"
 DETAILED_LOG_FN = "load_gbase_detail.log"
 
+# rough peak memory of a footprint_lib.py run per byte of input feed,
+# used to keep concurrent feeds within --memory_budget.  Feeds are run
+# with --stream, but formats without a record parser are still read
+# whole, so this allows for those.
+FEED_MEMORY_FACTOR = 10
+# how often the scheduler checks for finished feeds, in seconds
+SCHEDULER_POLL_SECS = 1.0
+
 # TODO: this file needs to be copied over to frontend/autocomplete/
 POPULAR_WORDS_FN = "popular_words.txt"
 FIELD_STATS_FN = "field_stats.txt"
@@ -159,6 +170,15 @@ def get_options():
   solr_group.add_option('--feed_providername',
                         default=None,
                         dest='feed_providername')
+  # Scheduling options
+  sched_group = parser.add_option_group("Scheduling options")
+  sched_group.add_option('-w', '--workers', type='int', default=1,
+                         dest='workers',
+                         help='Number of feeds to process concurrently.')
+  sched_group.add_option('--memory_budget', type='int', default=0,
+                         dest='memory_budget',
+                         help='Approximate RAM in MB that concurrent feeds ' + \
+                              'may use, 0 for no limit.')
   (OPTIONS, FILENAMES) = parser.parse_args()
 
 
@@ -321,8 +341,34 @@ def print_field_histograms():
   outfh.close()
   print_progress("done writing "+FIELD_HISTOGRAMS_FN)
 
+# when set (i.e. in a worker process), append_log() collects output here
+# so that each feed's log is written out in one piece by flush_log()
+DEFERRED_LOG = None
+
 def append_log(outstr):
   """append to the detailed and truncated log, for stats collection."""
+  if DEFERRED_LOG is not None:
+    DEFERRED_LOG.append(outstr)
+    return
+
+  # other feeds may be logging at the same time
+  lockfh = open(LOGPATH+DETAILED_LOG_FN, "a")
+  fcntl.flock(lockfh, fcntl.LOCK_EX)
+  try:
+    write_log(outstr)
+  finally:
+    fcntl.flock(lockfh, fcntl.LOCK_UN)
+    lockfh.close()
+
+def flush_log():
+  """write out the output collected by append_log()."""
+  global DEFERRED_LOG
+  outstr = "".join(DEFERRED_LOG)
+  DEFERRED_LOG = None
+  append_log(outstr)
+
+def write_log(outstr):
+  """see append_log()."""
   outfh = open(LOGPATH+DETAILED_LOG_FN, "a")
   outfh.write(outstr)
   outfh.close()
@@ -422,7 +468,7 @@ def run_pipeline(name, url, do_processing=True, do_ftp=True):
     feed_file_size = os.path.getsize(url)
 
   # run as a subprocess so we can ignore failures and keep going.
-  # later, we'll run these concurrently, but for now we're RAM-limited.
+  # run_feeds() can run several of these concurrently, see --workers.
   # ignore retcode
   # match the filenames to the feed filenames in Google Base, so we can
   # manually upload for testing.
@@ -438,7 +484,10 @@ def run_pipeline(name, url, do_processing=True, do_ftp=True):
       for it in ["--feed_providername", OPTIONS.feed_providername]:
         cmd_list.append(it)
 
-    for it in ["--progress", "--output", tsv_filename, url, "--compress_output"]:
+    # --stream writes the same TSV, but one record at a time instead of
+    # holding the whole feed in memory
+    for it in ["--progress", "--output", tsv_filename, url, "--compress_output",
+               "--stream"]:
       cmd_list.append(it)
 
     if name == "diy":
@@ -456,8 +505,9 @@ def run_pipeline(name, url, do_processing=True, do_ftp=True):
   print_progress("reading TSV data...")
 
   try:
+    # just enough to tell if it's empty
     gzip_fh = gzip.open(tsv_filename, 'r')
-    tsv_data = gzip_fh.read()
+    tsv_data = gzip_fh.read(1)
     gzip_fh.close()
   except:
     print_progress("Warning: %s could not be read." % tsv_filename)
@@ -473,19 +523,119 @@ def run_pipeline(name, url, do_processing=True, do_ftp=True):
   create_solr_TSV(name+'1', start_time, feed_file_size)
 
 
+def get_feed_size(name, url):
+  """size of a feed in bytes: the downloaded file if there is one,
+  else the most recent size in its -history.txt, else 0."""
+  if os.path.isfile(url):
+    return os.path.getsize(url)
+
+  shortname = footprint_lib.guess_shortname(name + '1')
+  if not shortname:
+    shortname = name + '1'
+  feed_bytes = 0
+  try:
+    fh = open(FEEDSDIR + '/' + shortname + '-history.txt', 'r')
+  except:
+    return feed_bytes
+
+  for line in fh:
+    if line.startswith('bytes\t'):
+      try:
+        feed_bytes = int(line.split('\t')[1])
+      except ValueError:
+        pass
+  fh.close()
+  return feed_bytes
+
+
+def run_pipeline_worker(name, url, do_processing, do_ftp, log_fn):
+  """run_pipeline() in a worker process, logging to its own file."""
+  global DEFERRED_LOG
+  DEFERRED_LOG = []
+  logfh = open(log_fn, "w", 0)
+  sys.stdout = sys.stderr = logfh
+  try:
+    run_pipeline(name, url, do_processing, do_ftp)
+  except Exception:
+    traceback.print_exc()
+    sys.exit(1)
+  finally:
+    flush_log()
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    logfh.close()
+
+
+def run_feeds(feeds, do_processing=True, do_ftp=True):
+  """run_pipeline() for each (name, url) in feeds.  With --workers > 1,
+  up to that many feeds run at once, largest first, while their
+  estimated memory fits in --memory_budget (a feed that doesn't fit
+  still runs, but only on its own).  Each feed logs to its own file,
+  which is copied to stdout in one piece when the feed is done."""
+  if OPTIONS.workers <= 1:
+    for name, url in feeds:
+      run_pipeline(name, url, do_processing, do_ftp)
+    return
+
+  budget = OPTIONS.memory_budget * 1024 * 1024
+  pending = []
+  for name, url in feeds:
+    feed_bytes = get_feed_size(name, url)
+    pending.append((feed_bytes, name, url, feed_bytes * FEED_MEMORY_FACTOR))
+  pending.sort(reverse=True)
+
+  running = []
+  used = 0
+  while pending or running:
+    for job in pending[:]:
+      if len(running) >= OPTIONS.workers:
+        break
+      feed_bytes, name, url, memory = job
+      if running and budget > 0 and used + memory > budget:
+        # try the next (smaller) feed instead
+        continue
+      log_fn = FEEDSDIR + '/' + name + '-pipeline.log'
+      proc = multiprocessing.Process(target=run_pipeline_worker,
+                                     args=(name, url, do_processing, do_ftp,
+                                           log_fn))
+      print_progress("starting %s (%d bytes), %d running" %
+                     (name, feed_bytes, len(running) + 1))
+      proc.start()
+      running.append((proc, name, memory, log_fn))
+      used += memory
+      pending.remove(job)
+
+    time.sleep(SCHEDULER_POLL_SECS)
+    for job in running[:]:
+      proc, name, memory, log_fn = job
+      if proc.is_alive():
+        continue
+      proc.join()
+      running.remove(job)
+      used -= memory
+      try:
+        fh = open(log_fn, "r")
+        sys.stdout.write(fh.read())
+        fh.close()
+      except IOError:
+        print_progress("no log for " + name)
+      if proc.exitcode != 0:
+        print name+":RETCODE: "+str(proc.exitcode)
+      print_progress("finished %s, %d running" % (name, len(running)))
+
+
 def test_loaders():
   """for testing, read from local disk as much as possible."""
-  run_pipeline("americanredcross", "americanredcross.xml", False, False)
-  run_pipeline("mlk_day", "mlk_day.xml", False, False)
-  run_pipeline("gspreadsheets",
-               "https://spreadsheets.google.com/ccc?key=rOZvK6aIY7HgjO-hSFKrqMw",
-               False, False)
-  run_pipeline("craigslist", "craigslist-cache.txt", False, False)
+  run_feeds([("americanredcross", "americanredcross.xml"),
+             ("mlk_day", "mlk_day.xml"),
+             ("gspreadsheets",
+              "https://spreadsheets.google.com/ccc?key=rOZvK6aIY7HgjO-hSFKrqMw"),
+             ("craigslist", "craigslist-cache.txt")], False, False)
 
 
 def loaders():
   """put all loaders in one function for easier testing."""
 
+  feeds = []
   for name in [
                "handsonnetworkconnect",
                #DEV "handsonnetworkconnect_dev",
@@ -543,17 +693,17 @@ def loaders():
                ]:
 
     if not FILENAMES or name in FILENAMES:
-      run_pipeline(name, name + ".xml")
+      feeds.append((name, name + ".xml"))
 
   if not FILENAMES or "diy" in FILENAMES:
-    run_pipeline("diy", "diy.tsv")
+    feeds.append(("diy", "diy.tsv"))
 
   if FILENAMES:
     for file in FILENAMES:
       if re.search('updateHON', file):
 	theFileName = file.replace('./HONupdates/','')
         theFileName = file.replace('.xml','')
-        run_pipeline(theFileName, file)
+        feeds.append((theFileName, file))
         # run_pipeline("updateHON", file)
 
   # requires special crawling
@@ -561,13 +711,15 @@ def loaders():
   # The sheet parameter is from a deprecated sheet and it won't be processed
   # in reality it will only process the sheets that are listed in ./spreadsheets/process.py
   if not FILENAMES or "gspreadsheets" in FILENAMES:
-    run_pipeline("gspreadsheets",
-                 "https://spreadsheets.google.com/ccc?key=rOZvK6aIY7HgjO-hSFKrqMw")
+    feeds.append(("gspreadsheets",
+                  "https://spreadsheets.google.com/ccc?key=rOZvK6aIY7HgjO-hSFKrqMw"))
 
   # if we ever want to try craigslist again, uncomment these
   # note: craiglist crawler is run asynchronously, hence the local file
   #if not FILENAMES or "craigslist" in FILENAMES:
-  #  run_pipeline("craigslist", "craigslist-cache.txt")
+  #  feeds.append(("craigslist", "craigslist-cache.txt"))
+
+  run_feeds(feeds)
 
 
 def ftp_to_base(filename, ftpinfo, instr):
@@ -620,88 +772,186 @@ def ftp_to_base(filename, ftpinfo, instr):
   ftp.quit()
   data_fh.close()
 
-  
+
+def get_detail_url(link):
+  """a detailURL, unescaped and with a scheme."""
+  link = link.replace("&amp;", '&')
+  if not link.lower().startswith('http'):
+    link = 'http://' + link
+  return link
+
+# fixed-format ISO dates, as footprint_lib writes them
+ISO_DATE_RX = re.compile(
+  r'^(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d):(\d\d))?Z?$')
+
+def parse_date(datestr):
+  """parser.parse(datestr, ignoretz=True), with a fast path for the
+  ISO dates footprint_lib outputs."""
+  match = ISO_DATE_RX.match(datestr)
+  # dateutil moves years before 100 into the current century
+  if match and match.group(1) >= '0100':
+    try:
+      return datetime(*[int(part) for part in match.groups() if part])
+    except ValueError:
+      pass
+  return parser.parse(datestr, ignoretz=True)
+
+DELTA_DAYS = {}
+def get_delta_days_between(dt1, dt2):
+  """memoized get_delta_days(relativedelta(dt1, dt2))-- feeds reuse the
+  same few dates over and over."""
+  key = (dt1, dt2)
+  if key not in DELTA_DAYS:
+    DELTA_DAYS[key] = get_delta_days(relativedelta.relativedelta(dt1, dt2))
+  return DELTA_DAYS[key]
+
+INTEGER_RX = re.compile(r'^.*?([0-9]+).*$')
+
+def open_feed_tsv(fname):
+  """open a footprint_lib TSV file, gzip'd or not."""
+  if fname.endswith('.gz'):
+    return gzip.open(fname, 'rb')
+  return open(fname, 'r')
+
 # row dictionary reference
 # see rowdictionaryreference.txt
 
-def solr_retransform(fname, start_time, feed_file_size):
-  """Create Solr-compatible versions of a datafile"""
+def solr_retransform(fname, start_time, feed_file_size, in_fname=None):
+  """Create Solr-compatible versions of a datafile.  Reads in_fname
+  (default fname, may be gzip'd) and writes fname.transformed."""
   numopps = 0
 
+  if not in_fname:
+    in_fname = fname
   print_progress('Creating Solr transformed file for: ' + fname)
   out_filename = fname + '.transformed'
-  data_file = open(fname, "r")
+  data_file = open_feed_tsv(in_fname)
   try:
-    csv_reader = DictReader(data_file, dialect='our-dialect')
+    csv_reader = reader(data_file, dialect='our-dialect')
+    in_fnames = csv_reader.next()
     csv_reader.next()
   except:
     print data_file.read()
-    print_progress("error processing %s" % str(fname))
+    print_progress("error processing %s" % str(in_fname))
     return
+  data_file.close()
 
   shortname = footprint_lib.guess_shortname(fname)
   if not shortname:
     shortname = fname
 
-  fnames = csv_reader.fieldnames[:]
+  # columns are handled by index rather than by name
+  col = dict([(name, i) for i, name in enumerate(in_fnames)])
+  numcols = len(in_fnames)
+
+  def read_rows():
+    """the rows of the input file, padded or clipped to the header."""
+    if not 'c:OpportunityID:string' in col:
+      return
+    data_file = open_feed_tsv(in_fname)
+    csv_reader = reader(data_file, dialect='our-dialect')
+    csv_reader.next()
+    for row in csv_reader:
+      if not row:
+        continue
+      if len(row) != numcols:
+        row = (row + [''] * numcols)[:numcols]
+      yield row
+    data_file.close()
+
+  # check the feed's links up front, concurrently
+  links = set()
+  if "c:detailURL:URL" in col:
+    for row in read_rows():
+      links.add(get_detail_url(row[col["c:detailURL:URL"]]))
+  bad_links = check_links.get_bad_links(links, RECHECK_BAD_LINKS)
+
+  fnames = in_fnames[:]
   fnames.append("c:eventrangestart:dateTime")
   fnames.append("c:eventrangeend:dateTime")
   fnames.append("c:eventduration:integer")
   fnames.append("c:aggregatefield:string")
   fnames.append("c:dateopportunityidgroup:string")
   fnames.append("c:randomsalt:float")
-  fnamesdict = dict([(x, x) for x in fnames])
-
-  data_file = open(fname, "r")
-  # TODO: Switch to TSV - Faster and simpler
-  csv_reader = DictReader(data_file, dialect='our-dialect')
-  csv_writer = DictWriter(open (out_filename, 'w'),
-                          dialect='excel-tab',
-                          fieldnames=fnames)
-  for field_name in fnamesdict.keys():
-    fnamesdict[field_name] = fnamesdict[field_name].lower()
-    if fnamesdict[field_name].startswith('c:'):
-      fnamesdict[field_name] = fnamesdict[field_name].split(':')[1]
-
-  csv_writer.writerow(fnamesdict)
+  out_fnames = []
+  for field_name in fnames:
+    field_name = field_name.lower()
+    if field_name.startswith('c:'):
+      field_name = field_name.split(':')[1]
+    out_fnames.append(field_name)
+
+  (rangestart_col, rangeend_col, duration_col, aggregate_col,
+   dateidgroup_col, salt_col) = range(numcols, numcols + 6)
+  date_cols = [i for i, name in enumerate(fnames)
+               if name.find(':dateTime') != -1]
+  # only the input's integer columns: eventduration is set below
+  integer_cols = [i for i, name in enumerate(in_fnames)
+                  if name.find(':dateTime') == -1 and
+                  name.find(':integer') != -1]
+  # the fields that go into aggregatefield
+  skills_col = col.get("c:skills:string", col.get("c:skill:string"))
+  category_tags_col = col.get("c:categoryTags:string",
+                              col.get("c:categoryTag:string"))
+  aggregate_cols = [col["title"], col["description"],
+                    col["c:provider_proper_name:string"], skills_col,
+                    category_tags_col, col["c:org_name:string"],
+                    col["c:eventName:string"]]
+  id_col = col.get('c:OpportunityID:string')
+  lat_col = col['c:latitude:float']
+  lng_col = col['c:longitude:float']
+
+  # an opportunity's rows (one per date/location) are adjacent, so
+  # remember the last snippet cleansed in each field
+  last_cleansed = {}
+  def cleanse(field, instr):
+    """footprint_lib.cleanse_snippet(), skipping repeats."""
+    last = last_cleansed.get(field)
+    if last and last[0] == instr:
+      return last[1]
+    outstr = footprint_lib.cleanse_snippet(instr)
+    last_cleansed[field] = (instr, outstr)
+    return outstr
+
+  out_file = open(out_filename, 'w')
+  csv_writer = writer(out_file, dialect='excel-tab')
+  csv_writer.writerow(out_fnames)
   now = parser.parse(commands.getoutput("date"))
   today = now.date()
   expired_by_end_date = num_bad_links = 0
-  for rows in csv_reader:
-    if rows["title"] and rows["title"].lower().find('anytown museum') >= 0:
+  transform_start = time.time()
+  for row in read_rows():
+    title = row[col["title"]]
+    if title and title.lower().find('anytown museum') >= 0:
       #bogus event
       continue
 
-    if not 'c:OpportunityID:string' in rows:
-      continue
+    row.extend(['', '', '', '', '', ''])
 
     # Split the date range into separate fields
     # event_date_range can be either start_date or start_date/end_date
     split_date_range = []
-    if rows["event_date_range"]:
-      split_date_range = rows["event_date_range"].split('/')
+    if row[col["event_date_range"]]:
+      split_date_range = row[col["event_date_range"]].split('/')
 
     if split_date_range:
-      rows["c:eventrangestart:dateTime"] = split_date_range[0]
+      row[rangestart_col] = split_date_range[0]
       if len(split_date_range) > 1:
-        rows["c:eventrangeend:dateTime"] = split_date_range[1]
+        row[rangeend_col] = split_date_range[1]
       else:
-        if rows["c:openended:boolean"] == "Yes":
-          rows["c:eventrangeend:dateTime"] = rows["c:expires:dateTime"]
+        if row[col["c:openended:boolean"]] == "Yes":
+          row[rangeend_col] = row[col["c:expires:dateTime"]]
         else:
-          rows["c:eventrangeend:dateTime"] = rows["c:eventrangestart:dateTime"]
+          row[rangeend_col] = row[rangestart_col]
 
     # in case we somehow got here without already doing this
-    rows["title"] = footprint_lib.cleanse_snippet(rows["title"])
-    rows["description"] = footprint_lib.cleanse_snippet(rows["description"])
-    rows["c:detailURL:URL"] = rows["c:detailURL:URL"].replace("&amp;", '&'); 
-    if not rows["c:detailURL:URL"].lower().startswith('http'):
-      rows["c:detailURL:URL"] = 'http://' + rows["c:detailURL:URL"]
-
-    link = str(rows["c:detailURL:URL"])
-    if link in BAD_LINKS or check_links.is_bad_link(link, RECHECK_BAD_LINKS):
+    row[col["title"]] = cleanse("title", title)
+    row[col["description"]] = cleanse("description", row[col["description"]])
+    row[col["c:detailURL:URL"]] = link = get_detail_url(
+                                            row[col["c:detailURL:URL"]])
+
+    if link in BAD_LINKS or link in bad_links:
       num_bad_links += 1
-      footprint_lib.feed_report(rows['c:OpportunityID:string'], 'badlinks', shortname, link)
+      footprint_lib.feed_report(row[col['c:OpportunityID:string']], 'badlinks', shortname, link)
       dlink = "'" + str(link) + "'"
       if dlink not in BAD_LINKS:
         BAD_LINKS[dlink] = 0
@@ -709,64 +959,58 @@ def solr_retransform(fname, start_time, feed_file_size):
       BAD_LINKS[dlink] += 1
       continue
 
-    rows["c:org_missionStatement:string"] = footprint_lib.cleanse_snippet(
-                                               rows["c:org_missionStatement:string"])
-    rows["c:org_description:string"] = footprint_lib.cleanse_snippet(
-                                               rows["c:org_description:string"])
-
-    rows["c:aggregatefield:string"] = footprint_lib.cleanse_snippet(' '.join([
-                                               rows["title"],
-                                               rows["description"],
-                                               rows["c:provider_proper_name:string"],
-                                               rows.get("c:skills:string", rows.get("c:skill:string", '')),
-                                               rows.get("c:categoryTags:string", rows.get("c:categoryTag:string", '')),
-                                               rows["c:org_name:string"],
-                                               rows["c:eventName:string"],
-                                               ]))
-
-    ids = rows.get('c:OpportunityID:string', rows.get('c:opportunityID:string', 'OpportunityID'))
-    ds = str(rows.get("c:eventrangestart:dateTime", '2001'))
-    if ds.find('T') > 0:
-      ds = ds.split('T')[0]
-    rows["c:dateopportunityidgroup:string"] = ''.join([ds, ids])
-
-    for key in rows.keys():
-      if key.find(':dateTime') != -1:
-        if rows[key].find(':') > 0:
-          rows[key] += 'Z'
-      elif key.find(':integer') != -1:
-        if rows[key] == '':
-          rows[key] = 0
-        else:
-          # find the first numbers from the string, e.g. abc123.4 => 123
-          try:
-            rows[key] = int(re.sub(r'^.*?([0-9]+).*$', r'\1', rows[key]))
-          except:
-            print_progress("error parsing rows[key]=%s -- rejecting record." % str(rows[key]))
-            continue
+    for key in ["c:org_missionStatement:string", "c:org_description:string"]:
+      row[col[key]] = cleanse(key, row[col[key]])
 
-    try:
-      start_date = parser.parse(rows["c:eventrangestart:dateTime"], ignoretz=True)
-    except:
-      start_date = "2001-01-01T00:00:00"
+    row[aggregate_col] = cleanse("c:aggregatefield:string", ' '.join([
+      (i is not None and row[i]) or '' for i in aggregate_cols]))
 
-    try:
-      end_date = parser.parse(rows["c:eventrangeend:dateTime"], ignoretz=True)
-    except:
-      end_date = "2020-12-31T23:59:59"
+    ds = '2001'
+    if split_date_range:
+      ds = row[rangestart_col]
+    if ds.find('T') > 0:
+      ds = ds.split('T')[0]
+    row[dateidgroup_col] = ''.join([ds, row[id_col]])
+
+    for i in date_cols:
+      if row[i].find(':') > 0:
+        row[i] += 'Z'
+    for i in integer_cols:
+      value = row[i]
+      if value == '':
+        row[i] = 0
+      elif value.isdigit():
+        row[i] = int(value)
+      else:
+        # find the first numbers from the string, e.g. abc123.4 => 123
+        try:
+          row[i] = int(INTEGER_RX.sub(r'\1', value))
+        except:
+          print_progress("error parsing rows[key]=%s -- rejecting record." % str(value))
+
+    start_date = "2001-01-01T00:00:00"
+    end_date = "2020-12-31T23:59:59"
+    if split_date_range:
+      try:
+        start_date = parse_date(row[rangestart_col])
+      except:
+        pass
+      try:
+        end_date = parse_date(row[rangeend_col])
+      except:
+        pass
 
     try:
       # check for expired opportunities
-      delta_days = get_delta_days(relativedelta.relativedelta(end_date, today))
+      delta_days = get_delta_days_between(end_date, today)
       if delta_days < -2 and delta_days > -3000:
         # more than 3000? it's the 1971 thing
         # else it expired at least two days ago
-        footprint_lib.feed_report(rows['c:OpportunityID:string'], 'expired', shortname, link)
+        footprint_lib.feed_report(row[col['c:OpportunityID:string']], 'expired', shortname, link)
         expired_by_end_date += 1
         continue
 
-      duration_rdelta = relativedelta.relativedelta(end_date, start_date) 
-      duration_delta_days = get_delta_days(duration_rdelta)
+      duration_delta_days = get_delta_days_between(end_date, start_date)
     
       # Check whether start/end dates are the wrong way around.
       if duration_delta_days < 0:
@@ -777,11 +1021,6 @@ def solr_retransform(fname, start_time, feed_file_size):
         # to spreadsheet checker, then reject start>end here.
         # even this is the wrong place to do this-- should apply to
         # both Base and SOLR.
-        #print_progress('Date error: start > end. Swapping dates...')
-        #duration_delta_days = -duration_delta_days
-        #temp = rows["c:eventrangestart:dateTime"]
-        #rows["c:eventrangestart:dateTime"] = rows["c:eventrangeend:dateTime"]
-        #rows["c:eventrangeend:dateTime"] = temp
         print_progress("start date after end date: rejecting record.")
         continue
 
@@ -790,28 +1029,29 @@ def solr_retransform(fname, start_time, feed_file_size):
       #
       # These events get a large eventduration (used for ranking) so that
       # they are not erroneously boosted for having a short duration.
-      current_rdelta = relativedelta.relativedelta(today, end_date)
-      current_delta_days = get_delta_days(current_rdelta)
-      rows["c:eventduration:integer"] = max(duration_delta_days,
-                                          current_delta_days)
+      current_delta_days = get_delta_days_between(today, end_date)
+      row[duration_col] = max(duration_delta_days, current_delta_days)
     except:
       pass
 
     # GBASE LEGACY: Fix to the +1000 to lat/long hack   
-    if not rows['c:latitude:float'] is None and float(rows['c:latitude:float']) > 500:
-      rows['c:latitude:float'] = float(rows['c:latitude:float']) - 1000.0
-    if not rows['c:longitude:float'] is None and float(rows['c:longitude:float']) > 500:
-      rows['c:longitude:float'] = float(rows['c:longitude:float']) - 1000.0
+    if row[lat_col] and float(row[lat_col]) > 500:
+      row[lat_col] = float(row[lat_col]) - 1000.0
+    if row[lng_col] and float(row[lng_col]) > 500:
+      row[lng_col] = float(row[lng_col]) - 1000.0
 
     # The random salt is added to the result score during ranking to prevent
     # groups of near-identical results with identical scores from appearing
     # together in the same result pages without harming quality.
-    rows["c:randomsalt:float"] = str(random.uniform(0.0, 1.0))
+    row[salt_col] = str(random.uniform(0.0, 1.0))
 
-    csv_writer.writerow(rows)
+    csv_writer.writerow(row)
     numopps += 1
 
-  data_file.close()
+  out_file.close()
+  transform_secs = max(time.time() - transform_start, 0.001)
+  print_progress("retransformed %d rows in %.1f secs (%d rows/sec)" %
+                 (numopps, transform_secs, numopps / transform_secs))
   print_progress("bad links: %d" % num_bad_links)
   print_progress("  expired: %d" % expired_by_end_date)
 
@@ -862,15 +1102,9 @@ def solr_retransform(fname, start_time, feed_file_size):
 
 def create_solr_TSV(filename, start_time, feed_file_size):
   """ Transform FPXML to SOLR TSV """
-  in_fname = filename + '.gz'
-  f_out = open(filename, 'wb')
-  f_in = gzip.open(in_fname, 'rb')
-
-  f_out.writelines(f_in)
-  f_out.close()
-  f_in.close()
-
-  solr_filename = solr_retransform(filename, start_time, feed_file_size)
+  # read straight from footprint_lib's gzip'd output
+  solr_filename = solr_retransform(filename, start_time, feed_file_size,
+                                   filename + '.gz')
 
 
 def main():
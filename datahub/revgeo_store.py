@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk reverse geocode store, shared by every footprint_lib.py process.
+
+Replaces the revgeo/ directory of one Maps API json file per location:
+each location is a row of a sqlite table keyed by its latitude and
+longitude rounded to 1/PRECISION degrees, as the file names were, and
+holds only the fields footprint_lib.get_revgeo_fields() uses.  A lookup
+is one read by primary key instead of an open, a read and a json parse.
+Only OK and ZERO_RESULTS answers are stored, as they were in the files.
+
+export_cells() writes the state and country of every frontend statewide
+grid cell whose stored locations all agree, for frontend/statewide.py to
+answer from without a lookup.
+
+usage: revgeo_store.py [--import revgeo/] [--export_cells revgeo_cells.txt]
+                       [--stats]
+"""
+
+import os
+import re
+import sys
+import time
+import json
+import sqlite3
+from optparse import OptionParser
+
+REVGEO_DB_FN = "revgeo.db"
+# the old json files, imported when the database is first created
+REVGEO_DIR = "revgeo"
+# the frontend's copy of export_cells()
+REVGEO_CELLS_FN = "revgeo_cells.txt"
+
+# locations are rounded to 1/PRECISION degrees
+PRECISION = 10000
+# the frontend's statewide.CELLS_PER_DEGREE
+CELLS_PER_DEGREE = 10
+
+# seconds to wait for another process's write lock
+LOCK_TIMEOUT = 60.0
+
+# Maps API statuses worth keeping: anything else is tried again
+STORED_STATUSES = ['OK', 'ZERO_RESULTS']
+
+# a stored answer is (status, city, county, state, zip, country), with
+# None for the fields the answer didn't have
+FIELD_NAMES = ['status', 'city', 'county', 'state', 'zip', 'country']
+
+# the address component type each field comes from, and the name it uses
+COMPONENT_FIELDS = [('locality', 'long_name', 1),
+                    ('postal_code', 'short_name', 4),
+                    ('administrative_area_level_1', 'short_name', 3),
+                    ('administrative_area_level_2', 'short_name', 2),
+                    ('country', 'short_name', 5)]
+
+# rev_geocode_json() named the files for the absolute values, with N/S
+# for the sign of the latitude and W/E for positive/negative longitude
+FILE_RX = re.compile(r'^Glat([NS])([0-9_]+)lng([EW])([0-9_]+)\.json$')
+
+# one more than the largest rounded longitude, so a latitude and
+# longitude pack into one integer key
+LNG_SPAN = 360 * PRECISION + 1
+
+
+def point_key(lat, lng):
+  """the table key for a location, or None if it's junk."""
+  try:
+    lat_int = int(round(float(lat) * PRECISION))
+    lng_int = int(round(float(lng) * PRECISION))
+  except (TypeError, ValueError, OverflowError):
+    return None
+  if not (-90 * PRECISION <= lat_int <= 90 * PRECISION and
+          -180 * PRECISION <= lng_int <= 180 * PRECISION):
+    return None
+  return (lat_int + 90 * PRECISION) * LNG_SPAN + lng_int + 180 * PRECISION
+
+
+def key_point(key):
+  """the rounded (latitude, longitude) of a table key, in 1/PRECISION
+  degrees."""
+  lat_int, lng_int = divmod(key, LNG_SPAN)
+  return lat_int - 90 * PRECISION, lng_int - 180 * PRECISION
+
+
+def extract_fields(jo):
+  """the stored tuple for a Maps API reverse geocode json object, or None
+  if it has no status.  When a component type appears more than once the
+  last one wins, as in get_revgeo_fields()."""
+  if not jo or 'status' not in jo:
+    return None
+  fields = [jo['status'], None, None, None, None, None]
+  if jo['status'] == 'OK':
+    for component in jo['results'][0]['address_components']:
+      for component_type, name, i in COMPONENT_FIELDS:
+        if component_type in component['types']:
+          fields[i] = component[name]
+          break
+  return tuple(fields)
+
+
+def parse_file_name(name):
+  """(latitude, longitude) from a revgeo/ file name, or None."""
+  match = FILE_RX.match(name)
+  if not match:
+    return None
+  ns, lat_str, ew, lng_str = match.groups()
+  try:
+    lat = float(lat_str.replace('_', '.'))
+    lng = float(lng_str.replace('_', '.'))
+  except ValueError:
+    return None
+  if ns == 'S':
+    lat = -lat
+  if ew == 'E':
+    lng = -lng
+  return lat, lng
+
+
+class RevGeoStore(object):
+  """(latitude, longitude) -> stored answer tuple, see FIELD_NAMES."""
+  def __init__(self, filename=REVGEO_DB_FN, dirname=REVGEO_DIR):
+    self.filename = filename
+    self.dirname = dirname
+    self.conn = None
+    # key -> answer, for the locations already looked up by this process
+    self.memo = {}
+
+  def connect(self):
+    """open the database on first use, creating (and importing the
+    revgeo/ files into) it if need be."""
+    if self.conn:
+      return self.conn
+    is_new = not os.path.exists(self.filename)
+    self.conn = sqlite3.connect(self.filename, timeout=LOCK_TIMEOUT)
+    # the key is the rowid, so there is no separate index
+    self.conn.execute("CREATE TABLE IF NOT EXISTS revgeo ("
+                      " key INTEGER PRIMARY KEY, status TEXT,"
+                      " city TEXT, county TEXT, state TEXT, zip TEXT,"
+                      " country TEXT, updated INTEGER)")
+    self.conn.commit()
+    if is_new and self.dirname and os.path.isdir(self.dirname):
+      self.import_dir(self.dirname)
+    return self.conn
+
+  def get(self, lat, lng):
+    """returns (found, answer) for the location."""
+    key = point_key(lat, lng)
+    if key is None:
+      return False, None
+    if key in self.memo:
+      return True, self.memo[key]
+
+    row = self.connect().execute(
+      "SELECT status, city, county, state, zip, country"
+      " FROM revgeo WHERE key = ?", (key,)).fetchone()
+    if not row:
+      return False, None
+    self.memo[key] = tuple(row)
+    return True, self.memo[key]
+
+  def get_many(self, points):
+    """returns {(latitude, longitude): answer} for the points found."""
+    found = {}
+    keys = {}
+    for point in points:
+      key = point_key(point[0], point[1])
+      if key is None:
+        continue
+      if key in self.memo:
+        found[point] = self.memo[key]
+      else:
+        keys.setdefault(key, []).append(point)
+    key_list = keys.keys()
+    conn = self.connect()
+    # sqlite allows 999 parameters per statement
+    for i in range(0, len(key_list), 500):
+      chunk = key_list[i:i + 500]
+      cursor = conn.execute(
+        "SELECT key, status, city, county, state, zip, country"
+        " FROM revgeo WHERE key IN (" + ",".join(["?"] * len(chunk)) + ")",
+        chunk)
+      for row in cursor:
+        self.memo[row[0]] = answer = tuple(row[1:])
+        for point in keys[row[0]]:
+          found[point] = answer
+    return found
+
+  def put(self, lat, lng, answer, commit=True):
+    """store an answer tuple, if its status is worth keeping.  Returns
+    whether it was stored."""
+    key = point_key(lat, lng)
+    if key is None or not answer or answer[0] not in STORED_STATUSES:
+      return False
+    conn = self.connect()
+    conn.execute("INSERT OR REPLACE INTO revgeo VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (key,) + tuple(answer) + (int(time.time()),))
+    if commit:
+      conn.commit()
+    self.memo[key] = tuple(answer)
+    return True
+
+  def put_many(self, answers):
+    """store a list of ((latitude, longitude), answer), in one transaction.
+    Returns the number stored."""
+    stored = 0
+    for point, answer in answers:
+      if self.put(point[0], point[1], answer, commit=False):
+        stored += 1
+    self.connect().commit()
+    return stored
+
+  def import_dir(self, dirname):
+    """import a revgeo/ directory of json files, returns (imported,
+    skipped).  Files named for their rounded location are imported;
+    the rest (the old lat...lng... names don't hold a usable longitude)
+    and answers not worth keeping are skipped."""
+    imported = skipped = 0
+    conn = self.connect()
+    for name in os.listdir(dirname):
+      point = parse_file_name(name)
+      if not point:
+        skipped += 1
+        continue
+      try:
+        fh = open(os.path.join(dirname, name), 'r')
+        try:
+          json_str = fh.read()
+        finally:
+          fh.close()
+        answer = extract_fields(
+          json.loads(json_str.encode('ascii', 'xmlcharrefreplace')))
+      except Exception:
+        answer = None
+      if self.put(point[0], point[1], answer, commit=False):
+        imported += 1
+      else:
+        skipped += 1
+    conn.commit()
+    return imported, skipped
+
+  def export_cells(self, fh, cells_per_degree=CELLS_PER_DEGREE):
+    """write a cell<tab>state<tab>country line for each grid cell, as in
+    frontend statewide.get_cell(), whose OK answers all agree on a state
+    and country.  Returns the number of cells written."""
+    cells = {}
+    cursor = self.connect().execute(
+      "SELECT key, state, country FROM revgeo WHERE status = 'OK'")
+    for key, state, country in cursor:
+      lat_int, lng_int = key_point(key)
+      cell = '%d,%d' % ((lat_int * cells_per_degree) // PRECISION,
+                        (lng_int * cells_per_degree) // PRECISION)
+      if state and country and cells.get(cell, (state, country)) == (state,
+                                                                    country):
+        cells[cell] = (state, country)
+      else:
+        # disagrees, or can't tell
+        cells[cell] = None
+
+    written = 0
+    for cell in sorted(cells.keys()):
+      if cells[cell]:
+        state, country = cells[cell]
+        fh.write(('%s\t%s\t%s\n' % (cell, state, country)).encode('utf-8'))
+        written += 1
+    return written
+
+  def stats(self):
+    """returns {status: entry count}."""
+    return dict(self.connect().execute(
+      "SELECT status, COUNT(*) FROM revgeo GROUP BY status").fetchall())
+
+
+def main():
+  """import, export or report on the store."""
+  parser = OptionParser("usage: %prog [--db revgeo.db] [--import revgeo/] " +
+                        "[--export_cells revgeo_cells.txt] [--stats]")
+  parser.add_option("--db", dest="db", default=REVGEO_DB_FN)
+  parser.add_option("--import", dest="import_dir")
+  parser.add_option("--export_cells", dest="export_cells")
+  parser.add_option("--stats", action="store_true", dest="stats",
+                    default=False)
+  (options, args) = parser.parse_args(sys.argv[1:])
+  if not (options.import_dir or options.export_cells or options.stats):
+    parser.print_help()
+    sys.exit(0)
+
+  store = RevGeoStore(options.db, dirname=None)
+  if options.import_dir:
+    imported, skipped = store.import_dir(options.import_dir)
+    print "imported", imported, "files, skipped", skipped
+  if options.export_cells:
+    fh = open(options.export_cells, "w")
+    try:
+      print "exported", store.export_cells(fh), "cells"
+    finally:
+      fh.close()
+  if options.stats:
+    for status, count in sorted(store.stats().items()):
+      print count, status
+
+if __name__ == "__main__":
+  main()
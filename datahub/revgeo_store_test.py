@@ -0,0 +1,150 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test for revgeo_store, importing a revgeo/ directory like the pipeline's
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import revgeo_store
+
+def component(name, types, short_name=None):
+  """ a Maps API address component """
+  return {'long_name': name, 'short_name': short_name or name,
+          'types': types}
+
+AUSTIN = {'status': 'OK', 'results': [{'address_components': [
+  component('Austin', ['locality', 'political']),
+  component('Travis', ['administrative_area_level_2', 'political']),
+  component('Texas', ['administrative_area_level_1', 'political'], 'TX'),
+  component('United States', ['country', 'political'], 'US'),
+  component('78701', ['postal_code']),
+]}]}
+TORONTO = {'status': 'OK', 'results': [{'address_components': [
+  component('Toronto', ['locality', 'political']),
+  component('Ontario', ['administrative_area_level_1', 'political'], 'ON'),
+  component('Canada', ['country', 'political'], 'CA'),
+]}]}
+NOWHERE = {'status': 'ZERO_RESULTS', 'results': []}
+OVER_QUOTA = {'status': 'OVER_QUERY_LIMIT', 'results': []}
+
+AUSTIN_ANSWER = ('OK', 'Austin', 'Travis', 'TX', '78701', 'US')
+
+
+class TestRevGeoStore(unittest.TestCase):
+  """ Unittests on revgeo_store """
+  def setUp(self):
+    """ an empty revgeo/ directory and store """
+    self.tmpdir = tempfile.mkdtemp()
+    self.dirname = os.path.join(self.tmpdir, 'revgeo')
+    os.mkdir(self.dirname)
+    self.filename = os.path.join(self.tmpdir, 'revgeo.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def write_file(self, name, jo):
+    """ a revgeo/ file """
+    fh = open(os.path.join(self.dirname, name), 'w')
+    if isinstance(jo, dict):
+      jo = json.dumps(jo)
+    fh.write(jo)
+    fh.close()
+
+  def testPointKey(self):
+    """ locations are rounded like the revgeo/ file names """
+    key = revgeo_store.point_key('30.26714', '-97.74306')
+    self.assertEqual(key, revgeo_store.point_key(30.2671, -97.7431))
+    self.assertEqual(revgeo_store.key_point(key), (302671, -977431))
+    self.assertNotEqual(key, revgeo_store.point_key(30.2672, -97.7431))
+    self.assertEqual(revgeo_store.key_point(
+        revgeo_store.point_key(-90, 180)), (-900000, 1800000))
+    self.assertEqual(revgeo_store.point_key('junk', '1.0'), None)
+    self.assertEqual(revgeo_store.point_key('91.0', '1.0'), None)
+    self.assertEqual(revgeo_store.point_key(None, None), None)
+
+  def testExtract(self):
+    """ only the fields get_revgeo_fields() uses are kept """
+    self.assertEqual(revgeo_store.extract_fields(AUSTIN), AUSTIN_ANSWER)
+    self.assertEqual(revgeo_store.extract_fields(TORONTO),
+                     ('OK', 'Toronto', None, 'ON', None, 'CA'))
+    self.assertEqual(revgeo_store.extract_fields(NOWHERE),
+                     ('ZERO_RESULTS', None, None, None, None, None))
+    self.assertEqual(revgeo_store.extract_fields(None), None)
+    self.assertEqual(revgeo_store.extract_fields({}), None)
+
+  def testImport(self):
+    """ a new store imports the revgeo/ files it can use """
+    self.write_file('GlatN30_2671lngE97_7431.json', AUSTIN)
+    self.write_file('GlatN43_6532lngE79_3832.json', TORONTO)
+    self.write_file('GlatS10_lngW20_5.json', NOWHERE)
+    self.write_file('GlatN1_lngW1_.json', OVER_QUOTA)
+    self.write_file('GlatN2_lngW2_.json', '{not json')
+    self.write_file('lat30_2671lng0_9902.json', AUSTIN)
+    store = revgeo_store.RevGeoStore(self.filename, self.dirname)
+    self.assertEqual(store.get('30.2671', '-97.7431'), (True, AUSTIN_ANSWER))
+    self.assertEqual(store.get(43.6532, -79.3832)[1][3], 'ON')
+    self.assertEqual(store.get('-10.0', '20.5'),
+                     (True, ('ZERO_RESULTS', None, None, None, None, None)))
+    self.assertEqual(store.get('1.0', '1.0'), (False, None))
+    self.assertEqual(store.stats(), {'OK': 2, 'ZERO_RESULTS': 1})
+    # the old style name, over quota and unparseable files are skipped
+    self.assertEqual(revgeo_store.RevGeoStore(
+        self.filename, self.dirname).import_dir(self.dirname), (3, 3))
+
+  def testPutGet(self):
+    """ answers worth keeping are stored, for other processes too """
+    store = revgeo_store.RevGeoStore(self.filename, None)
+    self.assertTrue(store.put('30.2671', '-97.7431', AUSTIN_ANSWER))
+    self.assertFalse(store.put('1.0', '1.0', ('OVER_QUERY_LIMIT', None, None,
+                                              None, None, None)))
+    self.assertFalse(store.put('1.0', '1.0', None))
+    self.assertEqual(store.put_many([
+      (('-10.0', '20.5'), ('ZERO_RESULTS', None, None, None, None, None)),
+      (('junk', '0'), AUSTIN_ANSWER)]), 1)
+
+    store = revgeo_store.RevGeoStore(self.filename, None)
+    points = [('30.26712', '-97.74308'), ('30.2671', '-97.7431'),
+              ('1.0', '1.0'), ('-10.0', '20.5'), ('junk', '0')]
+    found = store.get_many(points)
+    self.assertEqual(sorted(found.keys()), sorted(points[:2] + points[3:4]))
+    self.assertEqual(found[('30.2671', '-97.7431')], AUSTIN_ANSWER)
+    self.assertEqual(store.get('30.26712', '-97.74308'),
+                     (True, AUSTIN_ANSWER))
+
+  def testExportCells(self):
+    """ cells whose answers agree are exported """
+    store = revgeo_store.RevGeoStore(self.filename, None)
+    store.put_many([
+      (('30.2671', '-97.7431'), AUSTIN_ANSWER),
+      (('30.2999', '-97.7001'), ('OK', None, None, 'TX', None, 'US')),
+      (('30.25', '-97.79'), ('ZERO_RESULTS', None, None, None, None, None)),
+      (('43.6532', '-79.3832'), ('OK', 'Toronto', None, 'ON', None, 'CA')),
+      # a cell on a border
+      (('35.01', '-114.61'), ('OK', None, None, 'AZ', None, 'US')),
+      (('35.02', '-114.69'), ('OK', None, None, 'NV', None, 'US')),
+      (('45.0', '-150.0'), ('OK', None, None, None, None, None)),
+    ])
+    fh = StringIO.StringIO()
+    self.assertEqual(store.export_cells(fh), 2)
+    self.assertEqual(fh.getvalue(), '302,-978\tTX\tUS\n436,-794\tON\tCA\n')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+benchmark TaggingEngine against running each tagger's do_tagging() in
+turn, on the opportunities of an FPXML feed (plain or .gz).  Both are
+run with every tagger in get_taggers(), active or not, and must add the
+same tags to every record.
+
+usage: tagger_benchmark.py [--repeat N] [--active] feed.xml
+"""
+
+import gzip
+import sys
+import time
+from optparse import OptionParser
+
+import xml_helpers as xmlh
+from taggers import get_taggers, TaggingEngine, XMLRecord
+
+def load_feed(filename, repeat):
+  """returns (feedinfo, [opportunity xml strings])."""
+  if filename.endswith(".gz"):
+    infh = gzip.open(filename, "rb")
+  else:
+    infh = open(filename, "r")
+  feedinfo = None
+  opps = []
+  for tag, xmlstr in xmlh.iter_records(infh, ['FeedInfo',
+                                              'VolunteerOpportunity']):
+    if tag == 'FeedInfo':
+      feedinfo = xmlh.simple_parser(xmlstr, None, False)
+    else:
+      opps.append(xmlstr)
+  infh.close()
+  return feedinfo, opps * repeat
+
+def get_tags(opp):
+  """the categories on a tagged opportunity."""
+  return [node.firstChild.data
+          for node in opp.getElementsByTagName('categories')
+          if node.firstChild]
+
+def run_taggers(taggers, opps, feedinfo):
+  """the old loop from footprint_lib.convert_opportunity()."""
+  tag_count_dict = {}
+  for opp in opps:
+    for tagger in taggers:
+      rec = XMLRecord(opp)
+      rec, tag_count_dict = tagger.do_tagging(rec, feedinfo,
+                                              tag_count_dict, [])
+  return tag_count_dict
+
+def run_engine(engine, opps, feedinfo):
+  """the TaggingEngine loop."""
+  tag_count_dict = {}
+  for opp in opps:
+    tag_count_dict = engine.do_tagging(XMLRecord(opp), feedinfo,
+                                       tag_count_dict)
+  return tag_count_dict
+
+def main():
+  """time both, check they agree, print records/sec and tags/sec."""
+  parser = OptionParser("usage: %prog [--repeat N] [--active] feed.xml")
+  parser.add_option("--repeat", type="int", dest="repeat", default=1,
+                    help="tag the feed's opportunities N times over")
+  parser.add_option("--active", action="store_true", dest="active",
+                    default=False, help="only the taggers in use")
+  (options, args) = parser.parse_args(sys.argv[1:])
+  if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+
+  feedinfo, opps = load_feed(args[0], options.repeat)
+  taggers = get_taggers(include_inactive=not options.active)
+  print len(opps), "opportunities,", len(taggers), "taggers"
+
+  results = []
+  for name, run, tagging in (
+      ("do_tagging", run_taggers, taggers),
+      ("TaggingEngine", run_engine, TaggingEngine(taggers))):
+    docs = [xmlh.simple_parser(opp, None, False) for opp in opps]
+    start = time.time()
+    tag_count_dict = run(tagging, docs, feedinfo)
+    elapsed = max(time.time() - start, 0.000001)
+    numtags = sum(tag_count_dict.values())
+    print "%-14s %8.3f secs %10.1f records/sec %10.1f tags/sec" % (
+      name, elapsed, len(docs) / elapsed, numtags / elapsed)
+    results.append([get_tags(doc) for doc in docs])
+
+  if results[0] != results[1]:
+    print "ERROR: TaggingEngine tags differ from do_tagging()"
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
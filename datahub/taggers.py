@@ -25,21 +25,16 @@ import re
 # get_val(field) and add_tag(tag) functions that access data about the listing
 # and add a tag to the 'categories' field, respectively.
 
-class XMLRecord(object):
+class XMLRecord(xmlh.DOMRecord):
   """Stores a record in xml dom form, used in footprint_lib.py"""
   def __init__(self, opp):
     """initialize record from dom record opp"""
+    xmlh.DOMRecord.__init__(self, opp)
     self.opp = opp
 
-  def get_val(self, field):
-    """return a value for this record"""
-    return xmlh.get_tag_val(self.opp, field)
-
   def add_tag(self, tag):
     """add a tag to the record"""
-    newnode = self.opp.createElement('categories')
-    newnode.appendChild(self.opp.createTextNode(str(tag)))
-    self.opp.firstChild.appendChild(newnode)
+    self.append_element('categories', str(tag))
 
 class DictRecord(object):
   """Stores a record in dict form, used when tagging TSV files"""
@@ -236,6 +231,100 @@ class WSVKeywordTagger(KeywordTagger):
       [1.0]*len(keywords_list.split())))
     KeywordTagger.__init__(self, tag_name, keywords_dict)
 
+# the taggers have always called pattern.search(value, re.I), which python
+# takes as pos=2: matching is case sensitive and starts at the third
+# character.  TaggingEngine searches the same way so tags don't change.
+SEARCH_POS = re.I
+
+class TaggingEngine(object):
+  """Runs a list of taggers over records in one pass.
+
+  Each KeywordTagger's keywords and each RegexTagger's regexes are
+  compiled once into a single alternation, searched once per field, and
+  the field values are fetched from the record once.  FeedProviderIDTagger
+  results are computed once per feed.  Anything else (e.g. DateRangeTagger,
+  or taggers with weights that need real scoring) falls back to
+  do_tagging().  Tags are added in the same order as running each tagger's
+  do_tagging() in turn."""
+  def __init__(self, taggers):
+    self.taggers = taggers
+    self.rules = [self.compile_tagger(tagger) for tagger in taggers]
+    self.fields = []
+    for kind, tagger, fields, rx in self.rules:
+      for field in fields:
+        if field not in self.fields:
+          self.fields.append(field)
+    # feedinfo -> {tagger: matched}
+    self.feed_results = (None, {})
+
+  def compile_tagger(self, tagger):
+    """returns a (kind, tagger, fields, regex) rule for one tagger."""
+    if (tagger.score_threshold != 0.0 or len(tagger.tagging_functions) != 1):
+      return ('generic', tagger, [], None)
+
+    func = tagger.tagging_functions[0]
+    if (isinstance(tagger, KeywordTagger) and
+        func == tagger.tag_by_keywords and
+        weights_are_positive(tagger.keywords) and tagger.examine_fields):
+      # only the last field's match has ever counted, see tag_by_keywords()
+      alternatives = [keyword.lower().replace('+', ' ')
+                      for keyword in tagger.keywords]
+      rx = re.compile('(^|\s)(?:' + '|'.join(alternatives) + ')($|\s)')
+      return ('search', tagger, tagger.examine_fields[-1:], rx)
+
+    if (isinstance(tagger, RegexTagger) and func == tagger.tag_by_regex and
+        weights_are_positive(tagger.regex_dict) and
+        not BACKREF_RX.search(''.join(tagger.regex_dict))):
+      rx = re.compile('|'.join(['(?:' + regex + ')'
+                                for regex in tagger.regex_dict]))
+      return ('search', tagger, tagger.examine_fields, rx)
+
+    if isinstance(tagger, FeedProviderIDTagger):
+      return ('feed', tagger, [], None)
+
+    return ('generic', tagger, [], None)
+
+  def feed_matches(self, tagger, feedinfo):
+    """memoized tag_by_source_id() for the current feed."""
+    if self.feed_results[0] is not feedinfo:
+      self.feed_results = (feedinfo, {})
+    results = self.feed_results[1]
+    if tagger not in results:
+      results[tagger] = tagger.tag_by_source_id(None, feedinfo) > 0.0
+    return results[tagger]
+
+  def do_tagging(self, rec, feedinfo, tag_count_dict):
+    """tag one record, returns the tag_count_dict."""
+    values = {}
+    for field in self.fields:
+      values[field] = rec.get_val(field)
+
+    for kind, tagger, fields, rx in self.rules:
+      if kind == 'generic':
+        rec, tag_count_dict = tagger.do_tagging(rec, feedinfo,
+                                                tag_count_dict, [])
+        continue
+      if kind == 'feed':
+        matched = self.feed_matches(tagger, feedinfo)
+      else:
+        matched = False
+        for field in fields:
+          if rx.search(values[field], SEARCH_POS):
+            matched = True
+            break
+      if matched:
+        rec.add_tag(tagger.tag_name)
+        tag_count_dict[tagger.tag_name] = (
+          tag_count_dict.get(tagger.tag_name, 0) + 1)
+    return tag_count_dict
+
+# numbered/named backreferences can't be combined into one alternation
+BACKREF_RX = re.compile(r'\\[1-9]|\(\?P=')
+
+def weights_are_positive(weights):
+  """with a 0.0 threshold, any match tags iff every weight is positive."""
+  return len(weights) > 0 and min(weights.values()) > 0.0
+
 # Right now, EducationTagger is implemented just as an instance of
 # KeywordTagger, but in the future it may want to inherit from multiple
 # Tagger types.  This code is how it would be implemented as a subclass.
@@ -244,8 +333,9 @@ class WSVKeywordTagger(KeywordTagger):
 #    KeywordTagger.__init__(self, 'Education', {'education':1.0, 'school':1.0,
 #                      'teacher':1.0, 'classroom':1.0, 'leaning':1.0})
 
-def get_taggers():
-  """returns the current tagger instances we're using"""
+def get_taggers(include_inactive=False):
+  """returns the current tagger instances we're using, or with
+  include_inactive, every tagger defined below (for benchmarking)."""
 
   # Create basic keyword taggers
 
@@ -426,4 +516,14 @@ def get_taggers():
     #september11_tagger
     ]
 
+  if include_inactive:
+    taggers = [vetted_tagger, earthday_tagger, mlk_tagger, mlk_date_tagger,
+      mom_tagger, hunger_tagger, nature_tagger, education_tagger,
+      animals_tagger, health_tagger, seniors_tagger, technology_tagger,
+      hph_tagger, tutoring_tagger, gardening_tagger, artist_tagger,
+      lawyer_tagger, doctor_tagger, programmer_tagger, repairman_tagger,
+      videographer_tagger, graphicdesigner_tagger, oilspill_tagger,
+      spanish_tagger, veteransday_provider_tagger, veteransday_tagger,
+      september11_tagger]
+
   return taggers
@@ -101,24 +101,12 @@ def print_rps_progress(noun, progress, recno, maxrecs):
     print str(now)+": ", recno, noun, "processed" + maxrecs_str +\
         " ("+str(int(rps))+" recs/sec)"
 
-def get_tag_val(entity, tag):
-  """walk the DOM of entity looking for the first child named (tag)."""
-  #print "----------------------------------------"
-  if not entity:
-    return ""
+# bytes get_tag_val() drops: control characters and non-ASCII
+UNPRINTABLE_CHARS = ''.join(map(chr, range(0, 32) + range(128, 256)))
 
-  try:
-    nodes = entity.getElementsByTagName(tag)
-  except:
-    return ""
-  
-  if not nodes or nodes.length < 1:
-    return ""
-  
-  if not nodes[0]:
-    return ""
-
-  if not nodes[0].firstChild:
+def nodes_val(nodes):
+  """get_tag_val() for the elements named (tag), in document order."""
+  if not nodes or not nodes[0] or not nodes[0].firstChild:
     return ""
 
   try:
@@ -127,7 +115,7 @@ def get_tag_val(entity, tag):
   except:
     return ""
 
-  outstr = ""
+  values = []
   for node in nodes:
     for child_node in node.childNodes:
       value = ''
@@ -136,13 +124,100 @@ def get_tag_val(entity, tag):
       elif child_node.nodeType == child_node.CDATA_SECTION_NODE:
         value = child_node.data.strip().encode('UTF-8')
       if value:
-        value = value.replace(RECORD_DELIMITER, ' ')
-        outstr += FIELD_LIST_DELIMITER if len(outstr) > 0 else ''
-        outstr += value
-  
-  outstr = "".join(i for i in outstr if ord(i)<128 and ord(i)>31)
+        values.append(value.replace(RECORD_DELIMITER, ' '))
 
-  return outstr
+  return FIELD_LIST_DELIMITER.join(values).translate(None, UNPRINTABLE_CHARS)
+
+
+def get_tag_val(entity, tag):
+  """walk the DOM of entity looking for the first child named (tag).
+  entity can also be a DOMRecord, which has already walked it."""
+  #print "----------------------------------------"
+  if not entity:
+    return ""
+
+  if isinstance(entity, DOMRecord):
+    return entity.get_val(tag)
+
+  try:
+    nodes = entity.getElementsByTagName(tag)
+  except:
+    return ""
+
+  return nodes_val(nodes)
+
+
+def get_text(entity):
+  """the text and CDATA under entity, each node on a line of its own,
+  e.g. for searching a parsed record with a regexp."""
+  values = []
+  stack = [entity]
+  while stack:
+    node = stack.pop()
+    if (node.nodeType == node.TEXT_NODE or
+        node.nodeType == node.CDATA_SECTION_NODE):
+      values.append(node.data)
+    elif node.childNodes:
+      children = list(node.childNodes)
+      children.reverse()
+      stack.extend(children)
+  return "\n%s\n" % "\n".join(values)
+
+
+class DOMRecord(object):
+  """a parsed record (a minidom document or element) with its elements
+  filed by tag name in one walk of the DOM, so get_tag_val() on it is a
+  dict lookup instead of a walk per field.  Each tag's value is worked
+  out the first time it's asked for.  The DOM may only be added to
+  through append_element(), which keeps the index in step."""
+  def __init__(self, entity):
+    self.entity = entity
+    # tag -> elements under entity, in document order
+    self.elements = {}
+    # tag -> get_tag_val() value
+    self.values = {}
+    try:
+      stack = list(entity.childNodes)
+    except:
+      # not a DOM, e.g. parse_or_die()'s last resort: no values
+      stack = []
+    stack.reverse()
+    elements = self.elements
+    while stack:
+      node = stack.pop()
+      if node.nodeType == node.ELEMENT_NODE:
+        nodes = elements.get(node.tagName)
+        if nodes is None:
+          elements[node.tagName] = [node]
+        else:
+          nodes.append(node)
+        if node.childNodes:
+          children = list(node.childNodes)
+          children.reverse()
+          stack.extend(children)
+
+  def __nonzero__(self):
+    return bool(self.entity)
+
+  def get_val(self, tag):
+    """get_tag_val(entity, tag)."""
+    value = self.values.get(tag)
+    if value is None:
+      value = self.values[tag] = nodes_val(self.elements.get(tag))
+    return value
+
+  def get_elements(self, tag):
+    """entity.getElementsByTagName(tag), as a list."""
+    return self.elements.get(tag, [])
+
+  def append_element(self, tag, text):
+    """add <tag>text</tag> at the end of the document's root element."""
+    newnode = self.entity.createElement(tag)
+    newnode.appendChild(self.entity.createTextNode(text))
+    self.entity.firstChild.appendChild(newnode)
+    self.elements.setdefault(tag, []).append(newnode)
+    self.values.pop(tag, None)
+    return newnode
 
 
 def get_tag_attr(entity, tag, attribute):
@@ -158,7 +233,7 @@ def get_tag_attr(entity, tag, attribute):
   outstr = nodes[0].getAttribute(attribute)
   outstr = xml.sax.saxutils.escape(outstr).encode('UTF-8')
   outstr = re.sub(r'\n', ' ', outstr)
-  outstr = "".join(i for i in outstr if ord(i)<128 and ord(i)>31)
+  outstr = outstr.translate(None, UNPRINTABLE_CHARS)
   return outstr
 
 def set_default_value(parent, entity, tagname, default_value):
@@ -319,6 +394,64 @@ def simple_parser(instr, known_elnames_list, progress):
   return xmldoc
 
 
+READ_CHUNK_SIZE = 1024 * 1024
+
+def iter_records(infh, tagnames, chunk_size=READ_CHUNK_SIZE):
+  """incrementally scan a file handle (plain or gzip) and yield
+  (tagname, xmlstr) for each <tagname>...</tagname> element as soon as
+  it closes.  Matches the same text as the '<tag>.+?</tag>' regexps
+  used by the in-memory parsers, but only the current record and one
+  read buffer are ever held in memory.  Elements are returned in
+  document order; nesting one record type inside another isn't
+  supported (FPXML doesn't do that)."""
+  starts = dict([(tag, "<" + tag + ">") for tag in tagnames])
+  ends = dict([(tag, "</" + tag + ">") for tag in tagnames])
+  keep = max([len(start) for start in starts.values()]) - 1
+  buf = ""
+  pos = 0
+  eof = False
+  # next known offset of each start tag in buf (-1: none left), so that
+  # tags which no longer occur aren't rescanned for every record
+  next_start = {}
+  while True:
+    # find the earliest start tag in the buffer
+    tag = None
+    start = -1
+    for name, start_tag in starts.iteritems():
+      idx = next_start.get(name)
+      if idx is None or 0 <= idx < pos:
+        idx = next_start[name] = buf.find(start_tag, pos)
+      if idx >= 0 and (start < 0 or idx < start):
+        tag, start = name, idx
+
+    end = -1
+    if tag:
+      # '.+?' requires at least one char between the tags
+      end = buf.find(ends[tag], start + len(starts[tag]) + 1)
+
+    if end >= 0:
+      end += len(ends[tag])
+      yield tag, buf[start:end]
+      pos = end
+      continue
+
+    if eof:
+      return
+
+    # need more data: drop whatever has been consumed, but keep enough
+    # of the tail to complete a start tag split across reads
+    if tag:
+      buf = buf[start:]
+    else:
+      buf = buf[max(pos, len(buf) - keep):]
+    pos = 0
+    next_start = {}
+    chunk = infh.read(chunk_size)
+    if not chunk:
+      eof = True
+    buf += chunk
+
+
 def prettyxml(doc, strip_header = False):
   """return pretty-printed XML for doc."""
   if doc and doc.toxml:
@@ -22,7 +22,6 @@ from xml.dom.minidom import Document
 
 import template_helpers
 import api
-import utils
 from templatetags.dateutils_tags import custom_date_format
 
 SEARCH_RESULTS_DEBUG_TEMPLATE = 'search_results_debug.html'
@@ -373,6 +372,102 @@ ARRAY_FIELDS = [
   'activityTypes',
 ]
 
+# lowercased field names each output variant may include
+STANDARD_HOC_FIELDS = set(STANDARD_FIELDS + HOC_FIELDS)
+STANDARD_EXELIS_FIELDS = set(STANDARD_FIELDS + EXELIS_FIELDS)
+STANDARD_FIELDS_SET = set(STANDARD_FIELDS)
+CALENDAR_FIELDS_SET = set(CALENDAR_FIELDS)
+
+# output names left out of the plain json output
+JSON_OMITTED_FIELDS = set([
+  "appropriateFors", "activityTypes", "categoryTags", "Distance",
+  "sponsoringOrganizationUrl", "affiliateOrganizationName",
+  "affiliateOrganizationUrl", "opportunityId", "opportunityType",
+  "registerType", "occurrenceId", "occurrenceDuration", "eventId",
+  "eventName", "frequencyURL", "frequency", "availabilityDays",
+  "audienceTags", "volunteerHubOrganizationUrl",
+  "volunteerHubOrganizationName", "volunteersNeeded",
+  "affiliateOrganizationID", "rsvpCount", "sexrestrictedto",
+  "scheduleType",
+])
+
+# output names left out of the hoc, cal, exelis and rss output
+VARIANT_OMITTED_FIELDS = set(["addrname1", "contactNoneNeeded"])
+
+#standard RSS fields
+RSS_STANDARD_FIELDS = [
+  ('title',),
+  ('link', 'xml_url'),
+  ('description', 'snippet'),
+  ('pubDate',), 
+  ('guid', 'xml_url')
+]
+
+def output_variant(result_set):
+  """(is_hoc, is_rss, is_cal, is_exelis) for a result set."""
+  return (result_set.is_hoc, result_set.is_rss, result_set.is_cal,
+          result_set.is_exelis)
+
+
+def get_json_item_fields(is_hoc, is_rss, is_cal, is_exelis):
+  """the FIELD_TUPLES a json variant outputs, as the (name, lowercase name)
+  pairs to look for on a result, in order."""
+  item_fields = []
+  for field_info in FIELD_TUPLES:
+    name = field_info[0]
+    api_name = API_FIELD_NAMES_MAP.get(name, name)
+    if (is_hoc or is_rss) and name.lower() not in STANDARD_HOC_FIELDS:
+      continue
+    if is_exelis and name.lower() not in STANDARD_EXELIS_FIELDS:
+      continue
+    if is_cal and name.lower() not in CALENDAR_FIELDS_SET:
+      continue
+    if (len(name) < 2) and is_hoc and is_cal:
+      continue
+    if (not is_hoc and not is_rss and not is_cal and not is_exelis and
+        api_name in JSON_OMITTED_FIELDS):
+      continue
+    if ((is_hoc or is_cal or is_exelis or is_rss) and
+        api_name in VARIANT_OMITTED_FIELDS):
+      continue
+    names = [(name, name.lower())]
+    if len(field_info) > 1:
+      names.append((field_info[1], field_info[1].lower()))
+    item_fields.append(names)
+  return item_fields
+
+
+def get_rss_item_fields(is_hoc, is_rss, is_cal, is_exelis):
+  """the FIELD_TUPLES an rss variant outputs, as lists of
+  (name, element name) to look for on a result, in order, and the element
+  name for list values."""
+  def element_name(name):
+    """our namespaced element for a result attribute, or None if this
+    variant leaves it out."""
+    name = RssApiWriter.OurNamespace + ':' + API_FIELD_NAMES_MAP.get(name,
+                                                                     name)
+    if (not is_hoc and not is_rss) and name.lower() not in STANDARD_FIELDS_SET:
+      return None
+    if is_cal and name.lower() not in CALENDAR_FIELDS_SET:
+      return None
+    return name
+
+  item_fields = []
+  for field_info in FIELD_TUPLES:
+    names = [(field_info[0], element_name(field_info[0]))]
+    list_name = None
+    if len(field_info) > 1:
+      names.append((field_info[1], element_name(field_info[1])))
+      list_name = RssApiWriter.OurNamespace + ':' + field_info[1]
+    if [name for name, elem_name in names if elem_name]:
+      item_fields.append((names, list_name))
+  return item_fields
+
+
+# projections, by output variant
+JSON_ITEM_FIELDS = {}
+RSS_ITEM_FIELDS = {}
+
 def get_writer(output):
   """Returns the appropriate ApiWriter class for the requested output type."""
   if output.find('rss') >= 0:
@@ -388,10 +483,13 @@ class ApiWriter:
   def __init__(self, content_type):
     """Initializer, content_type will be the expected output type."""
     self.content_type = content_type
+    self.out = None
+    self.fragments = []
   
-  def setup(self, request, result_set):
-    """Do any setup based on the result set here."""
-    pass
+  def setup(self, request, result_set, out = None):
+    """Do any setup based on the result set here.  Writers that stream
+    write to out as they go, if it's given."""
+    self.out = out
   
   def add_result(self, result, result_set = {}):
     """Process one result item at a time."""
@@ -400,6 +498,21 @@ class ApiWriter:
   def finalize(self):
     """Finalize the results, and return them as a string."""
     return None
+
+  def write(self, text):
+    """stream some output, or keep it for finalize()."""
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+    if self.out:
+      self.out.write(text)
+    else:
+      self.fragments.append(text)
+
+  def get_unwritten(self):
+    """the output kept for finalize()."""
+    text = ''.join(self.fragments)
+    self.fragments = []
+    return text
   
 class DjangoTemplateApiWriter(ApiWriter):
   """Base class for any API output we still want to use Django templates for."""
@@ -410,7 +523,7 @@ class DjangoTemplateApiWriter(ApiWriter):
     self.template_values = None
     self.result_set = None
     
-  def setup(self, request, result_set):
+  def setup(self, request, result_set, out = None):
     """setup the template we will use"""
     self.result_set = result_set
     self.template_values = template_helpers.get_default_template_values(
@@ -450,20 +563,45 @@ class DebugHtmlApiWriter(DjangoTemplateApiWriter):
   def add_result(self, result, result_set = {}):
     pass
       
+
+def get_json_encoder():
+  """the encoder for json output."""
+  from django.utils import simplejson
+  class MyEncoder(simplejson.JSONEncoder):
+    """JSONEncoder doesn't handle datetime, so we have to extend it."""
+    datetime_class = type(datetime)
+    def default(self, obj):
+      """If the obj is a datetime, return it as a string."""
+      if isinstance(obj, datetime):
+        return str(obj)
+      return simplejson.JSONEncoder.default(self, obj)
+  return MyEncoder(indent=1)
+
+
 class JsonApiWriter(ApiWriter):
-  """Outputs the search results as JSON."""
-  
-  # Fields we output per item
-  item_fields = FIELD_TUPLES
+  """Outputs the search results as JSON.
+
+  The response is encoded around the items list, which is written an item
+  at a time: each item is encoded by itself and indented to its place in
+  the list, which gives the same bytes as encoding the whole thing."""
+
+  # stands in for the items when encoding the rest of the response
+  ITEM_MARKER = 'AFG_ITEM_MARKER'
   
   def __init__(self, content_type):
     """No special initialization."""
-    self.items = None
     self.json = None
+    self.encoder = None
+    self.item_fields = None
+    self.fulldesc = False
+    self.num_items = 0
+    self.list_open = self.item_separator = self.item_indent = None
+    self.list_close = self.tail = ''
     ApiWriter.__init__(self, content_type)
     
-  def setup(self, request, result_set):
-    """Setup a dict that will eventually be converted to JSON."""
+  def setup(self, request, result_set, out = None):
+    """Write the response up to the items list."""
+    ApiWriter.setup(self, request, result_set, out)
     self.json = {
       'version' : 1.0,
       'href' : result_set.request_url,
@@ -492,50 +630,49 @@ class JsonApiWriter(ApiWriter):
         self.json['TotalOpportunities'] = result_set.total_opportunities
         self.json['TotalMatch'] =  result_set.total_match
 
-    self.items = self.json['items']
-    
     if result_set.is_hoc or result_set.is_json2 or result_set.is_exelis:
       self.json['num'] = len(result_set.clipped_results)
       self.json['MergedCount'] = result_set.merged_count
       self.json['BackendCount'] = result_set.backend_count
- 
+
+    variant = output_variant(result_set)
+    if variant not in JSON_ITEM_FIELDS:
+      JSON_ITEM_FIELDS[variant] = get_json_item_fields(*variant)
+    self.item_fields = JSON_ITEM_FIELDS[variant]
+    self.fulldesc = (result_set.args.get('fulldesc', '') == '1')
+
+    # encode the response with no items, and with two marker items to see
+    # where the list starts and ends and how items are separated
+    self.encoder = get_json_encoder()
+    empty = self.encoder.encode(self.json)
+    self.json['items'] = [self.ITEM_MARKER, self.ITEM_MARKER]
+    marked = self.encoder.encode(self.json)
+    self.json['items'] = []
+    marker = self.encoder.encode(self.ITEM_MARKER)
+    first = marked.index(marker)
+    second = marked.index(marker, first + len(marker))
+    list_start = marked.rindex('[', 0, first)
+    head = marked[:list_start]
+    self.tail = empty[len(head) + len('[]'):]
+    self.list_open = marked[list_start:first]
+    self.item_separator = marked[first + len(marker):second]
+    self.list_close = marked[second + len(marker):len(marked) - len(self.tail)]
+    self.item_indent = '\n' + self.item_separator.split('\n')[-1]
+    self.write(head)
         
   def add_result(self, result, result_set = {}):
-    """Add an item dict to the items array."""
+    """Write an item's dict."""
     #result is instance of SearchResult
     
-    f1 = 1
-    first_zip = 1 
     item = {}
-    for field_info in self.item_fields:
-      name = field_info[0]
-      
-      if (result_set.is_hoc or result_set.is_rss) and name.lower() not in utils.unique_list(STANDARD_FIELDS + HOC_FIELDS):
-        continue
-
-      if result_set.is_exelis and name.lower() not in utils.unique_list(STANDARD_FIELDS + EXELIS_FIELDS):
-        continue
-    
-      if result_set.is_cal and name.lower() not in CALENDAR_FIELDS:
-        continue
-
-      if (len(name) < 2) and result_set.is_hoc and result_set.is_cal:
-        continue
-      
-   
-      
-      if (not result_set.is_hoc) and (not result_set.is_rss) and (not result_set.is_cal) and (not result_set.is_exelis) and (API_FIELD_NAMES_MAP.get(name, name) == "appropriateFors" or API_FIELD_NAMES_MAP.get(name, name) == "activityTypes" or API_FIELD_NAMES_MAP.get(name, name) == "categoryTags" or API_FIELD_NAMES_MAP.get(name, name) == "Distance" or API_FIELD_NAMES_MAP.get(name, name) == "sponsoringOrganizationUrl" or API_FIELD_NAMES_MAP.get(name, name) == "affiliateOrganizationName" or API_FIELD_NAMES_MAP.get(name, name) == "affiliateOrganizationUrl" or API_FIELD_NAMES_MAP.get(name, name) == "opportunityId" or API_FIELD_NAMES_MAP.get(name, name) == "opportunityType" or API_FIELD_NAMES_MAP.get(name, name) == "registerType" or API_FIELD_NAMES_MAP.get(name, name) == "occurrenceId" or API_FIELD_NAMES_MAP.get(name, name) == "occurrenceDuration" or API_FIELD_NAMES_MAP.get(name, name) == "eventId" or API_FIELD_NAMES_MAP.get(name, name) == "eventName" or API_FIELD_NAMES_MAP.get(name, name) == "frequencyURL" or API_FIELD_NAMES_MAP.get(name, name) == "frequency" or API_FIELD_NAMES_MAP.get(name, name) == "availabilityDays" or API_FIELD_NAMES_MAP.get(name, name) == "audienceTags" or API_FIELD_NAMES_MAP.get(name, name) == "volunteerHubOrganizationUrl" or API_FIELD_NAMES_MAP.get(name, name) == "volunteerHubOrganizationName" or API_FIELD_NAMES_MAP.get(name, name) == "volunteersNeeded" or API_FIELD_NAMES_MAP.get(name, name) == "affiliateOrganizationID" or API_FIELD_NAMES_MAP.get(name, name) == "rsvpCount" or API_FIELD_NAMES_MAP.get(name, name) == "sexrestrictedto" or API_FIELD_NAMES_MAP.get(name, name) == "eventName" or API_FIELD_NAMES_MAP.get(name, name) == "eventId" or API_FIELD_NAMES_MAP.get(name, name) == "scheduleType"):
-          continue
-      
-      if (result_set.is_hoc or result_set.is_cal or result_set.is_exelis or result_set.is_rss) and (API_FIELD_NAMES_MAP.get(name, name) == "addrname1" or API_FIELD_NAMES_MAP.get(name, name) == "contactNoneNeeded"):
-          continue
-      
+    for names in self.item_fields:
+      name, lower_name = names[0]
       if not hasattr(result, name):
-        name = name.lower()
-        if not hasattr(result, name) and len(field_info) > 1:
-          name = field_info[1]
+        name = lower_name
+        if not hasattr(result, name) and len(names) > 1:
+          name, lower_name = names[1]
           if not hasattr(result, name):
-            name = name.lower()
+            name = lower_name
 
       content = getattr(result, name, '')
       #print name, '=', content, '<br>'
@@ -544,7 +681,7 @@ class JsonApiWriter(ApiWriter):
         if custom_date_format(content) == 'Present':
           content = ''
       elif name == "description":
-        if result_set.args.get('fulldesc', '') != '1':
+        if not self.fulldesc:
           content = content[:300]
       elif name in ["eventrangestart", "eventrangeend"]:
         content = content.replace('T', ' ').strip('Z')
@@ -552,97 +689,119 @@ class JsonApiWriter(ApiWriter):
       if isinstance(content, basestring):
          content = content.strip()
     
-      
+      api_name = API_FIELD_NAMES_MAP.get(name, name)
       # handle lists
       if isinstance(content, basestring) and content.find('\t') > 0: 
-        item[API_FIELD_NAMES_MAP.get(name, name)] = content.split('\t')
-      elif API_FIELD_NAMES_MAP.get(name, name) in ARRAY_FIELDS and not isinstance(content, list):
+        item[api_name] = content.split('\t')
+      elif api_name in ARRAY_FIELDS and not isinstance(content, list):
         if content:
-          item[API_FIELD_NAMES_MAP.get(name, name)] = [content]
+          item[api_name] = [content]
         else:   
-          item[API_FIELD_NAMES_MAP.get(name, name)] = []
+          item[api_name] = []
       else: 
-          item[API_FIELD_NAMES_MAP.get(name,name)] = content
-
-    self.items.append(item)
+        item[api_name] = content
+
+    if self.num_items:
+      self.write(self.item_separator)
+    else:
+      self.write(self.list_open)
+    self.num_items += 1
+    self.write(self.encoder.encode(item).replace('\n', self.item_indent))
     
   def finalize(self):
-    """Convert the dict to a JSON string."""
-    from django.utils import simplejson
-    class MyEncoder(simplejson.JSONEncoder):
-      """JSONEncoder doesn't handle datetime, so we have to extend it."""
-      datetime_class = type(datetime)
-      def default(self, obj):
-        """If the obj is a datetime, return it as a string."""
-        if isinstance(obj, datetime):
-          return str(obj)
-        return simplejson.JSONEncoder.default(self, obj)
-    encoder = MyEncoder(indent=1)
-    return encoder.encode(self.json)
+    """Write the end of the response."""
+    if self.num_items:
+      self.write(self.list_close)
+    else:
+      self.write('[]')
+    self.write(self.tail)
+    return self.get_unwritten()
+
+
+def xml_escape(data):
+  """escape text and attribute values as minidom does."""
+  return data.replace("&", "&amp;").replace("<", "&lt;").replace(
+    "\"", "&quot;").replace(">", "&gt;")
+
+
+def minidom_inlines_text():
+  """does this python's toprettyxml() put an element's only text node on
+  the same line (2.7), rather than on a line of its own?"""
+  doc = Document()
+  elem = doc.createElement('a')
+  elem.appendChild(doc.createTextNode('b'))
+  doc.appendChild(elem)
+  return doc.toprettyxml(indent='  ', newl='\n').find('<a>b</a>') >= 0
+
+INLINE_TEXT = minidom_inlines_text()
+
 
-  
 class RssApiWriter(ApiWriter):
-  """Output the search results as an RSS data feed."""
+  """Output the search results as an RSS data feed.
+
+  The feed is written as text, laid out as xml.dom.minidom's
+  toprettyxml(indent='  ') lays it out."""
   
   OurNamespace = "fp" #TODO change to afg?
 
   def __init__(self, content_type):
     """No special initialization."""
-    self.doc = None
-    self.rss = None
-    self.channel = None
+    self.item_fields = None
+    self.fulldesc = False
     ApiWriter.__init__(self, content_type)
+
+  def element(self, indent, name, content=None, attrs=None):
+    """an element with no children, or one text node."""
+    attr_text = ''
+    if attrs:
+      for k in sorted(attrs.keys()):
+        attr_text += ' %s="%s"' % (k, xml_escape(attrs[k]))
+    if content is None:
+      return '%s<%s%s/>\n' % (indent, name, attr_text)
+    if INLINE_TEXT:
+      return '%s<%s%s>%s</%s>\n' % (indent, name, attr_text,
+                                    xml_escape(content), name)
+    return '%s<%s%s>\n%s  %s\n%s</%s>\n' % (indent, name, attr_text, indent,
+                                           xml_escape(content), indent, name)
     
-  def setup(self, request, result_set):
+  def setup(self, request, result_set, out = None):
     """
-    Create the RSS preamble, everything before the results list.
+    Write the RSS preamble, everything before the results list.
     """
-    self.doc = Document()
-    self.rss = self.doc.createElement('rss')
-    self.rss.setAttribute('version','2.0')
-    self.rss.setAttribute('xmlns:georss', "http://www.georss.org/georss")
-    self.rss.setAttribute('xmlns:gml', "http://www.opengis.net/gml")
-    self.rss.setAttribute('xmlns:atom', "http://www.w3.org/2005/Atom")
-    self.rss.setAttribute('xmlns:' + self.OurNamespace,
-                          "http://www.allforgood.org/")
-    self.doc.appendChild(self.rss)
-    channel = self.doc.createElement('channel')
-    self.rss.appendChild(channel)
-    
-    def create_text_element(parent, name, content=None, attrs = None):
-      elem = self.doc.createElement(name)
-      if attrs:
-        for k, v in attrs.items():
-          elem.setAttribute(k, v)
-
-      parent.appendChild(elem)
-      if content != None:
-        elem.appendChild(self.doc.createTextNode(str(content)))
-      return elem
-    
-    create_text_element(channel, 'title', 'All for Good search results')
-    create_text_element(channel, 'link', 'http://www.allforgood.org/')
-    
-    atom_link = self.doc.createElement('atom:link')
-    channel.appendChild(atom_link)
-    atom_link.setAttribute('href', result_set.request_url)
-    atom_link.setAttribute('rel', 'self')
-    atom_link.setAttribute('type', str(self.content_type))
-    
-    create_text_element(channel,
-                        'description',
-                        'All for Good search results')
-    create_text_element(channel, 'language', content='en-us')
-    create_text_element(channel, 'pubDate') #TODO: fill this in
-    create_text_element(channel,
-                        'lastBuildDate',
-                        content=result_set.last_build_date)
+    ApiWriter.setup(self, request, result_set, out)
+    variant = output_variant(result_set)
+    if variant not in RSS_ITEM_FIELDS:
+      RSS_ITEM_FIELDS[variant] = get_rss_item_fields(*variant)
+    self.item_fields = RSS_ITEM_FIELDS[variant]
+    self.fulldesc = (result_set.args.get('fulldesc', '') == '1')
+
+    self.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    self.write('<rss version="2.0"'
+               ' xmlns:atom="http://www.w3.org/2005/Atom"'
+               ' xmlns:' + self.OurNamespace + '="http://www.allforgood.org/"'
+               ' xmlns:georss="http://www.georss.org/georss"'
+               ' xmlns:gml="http://www.opengis.net/gml">\n')
+    self.write('  <channel>\n')
+
+    indent = '    '
+    self.write(self.element(indent, 'title', 'All for Good search results'))
+    self.write(self.element(indent, 'link', 'http://www.allforgood.org/'))
+    self.write(self.element(indent, 'atom:link', None,
+                            {'href': result_set.request_url,
+                             'rel': 'self',
+                             'type': str(self.content_type)}))
+    self.write(self.element(indent, 'description',
+                            'All for Good search results'))
+    self.write(self.element(indent, 'language', 'en-us'))
+    self.write(self.element(indent, 'pubDate')) #TODO: fill this in
+    self.write(self.element(indent, 'lastBuildDate',
+                            str(result_set.last_build_date)))
 
     if result_set.is_hoc:
-      facets_node = create_text_element(channel, 'facets')
+      facets = []
       for facet, facet_list in result_set.hoc_facets.items():
         if facet_list:
-          facet_node = create_text_element(facets_node, 'facet', None, {'name' : facet})
+          counts = []
           facet_name = facet_value = ''
           for fv in facet_list:
             if not facet_name:
@@ -650,63 +809,64 @@ class RssApiWriter(ApiWriter):
               facet_value = ''
             elif not facet_value:
               facet_value = fv
-              facet_value_node = create_text_element(facet_node, 'count', facet_value, {'name' : facet_name})
+              counts.append(self.element(indent + '    ', 'count',
+                                         str(facet_value),
+                                         {'name' : facet_name}))
               facet_name = facet_value = ''
+          if counts:
+            facets.append(indent + '  <facet name="%s">\n' % xml_escape(facet))
+            facets.extend(counts)
+            facets.append(indent + '  </facet>\n')
+          else:
+            facets.append(self.element(indent + '  ', 'facet', None,
+                                       {'name' : facet}))
+      if facets:
+        self.write(indent + '<facets>\n')
+        for text in facets:
+          self.write(text)
+        self.write(indent + '</facets>\n')
+      else:
+        self.write(self.element(indent, 'facets'))
           
       if not result_set.is_cal:
-        create_text_element(channel,
-                            'TotalMatch',
-                            content=str(result_set.total_match))
-        create_text_element(channel,
-                            'TotalOpportunities',
-                            content=str(result_set.total_opportunities))
-
-    self.channel = channel
+        self.write(self.element(indent, 'TotalMatch',
+                                str(result_set.total_match)))
+        self.write(self.element(indent, 'TotalOpportunities',
+                                str(result_set.total_opportunities)))
+
+  def get_content(self, result, name):
+    """the text for one of a result's attributes."""
+    content = ''
+    if hasattr(result, name):
+      try:
+        content = str(getattr(result, name, ''))
+      except UnicodeEncodeError:
+        content = getattr(result, name, '').encode('ascii', 'ignore')
+
+    if name == "enddate": 
+      if custom_date_format(content) == 'Present':
+        content = ''
+    elif name == "description":
+      if not self.fulldesc:
+        content = content[:300]
+    elif name in ["eventrangestart", "eventrangeend"]:
+      content = content.replace('T', ' ').strip('Z')
+    return content
     
   def add_result(self, result, result_set = {}):
     """
-    Add an <item/> stanza to the results.  The stanza will include the required
+    Write an <item/> stanza.  The stanza will include the required
     RSS elements, plus our own namespaced elements.
     """
-    def build_result_element(field_info, result):
-
-      content = ''
+    indent = '      '
+    item = ['    <item>\n']
+    
+    added_list = set()
+    for field_info in RSS_STANDARD_FIELDS:
       name = field_info[0]
       if not hasattr(result, name) and len(field_info) > 1:
         name = field_info[1]
-
-      if hasattr(result, name):
-        try:
-          content = str(getattr(result, name, ''))
-        except UnicodeEncodeError:
-          content = getattr(result, name, '').encode('ascii', 'ignore')
-
-      if name == "enddate": 
-        if custom_date_format(content) == 'Present':
-          content = ''
-      elif name == "description":
-        if result_set.args.get('fulldesc', '') != '1':
-          content = content[:300]
-      elif name in ["eventrangestart", "eventrangeend"]:
-        content = content.replace('T', ' ').strip('Z')
-
-    
-      return (name, content, None)
-    
-    item = self.doc.createElement('item')
-    self.channel.appendChild(item)
-    
-    #standard RSS fields
-    standard_fields = [
-      ('title',),
-      ('link', 'xml_url'),
-      ('description', 'snippet'),
-      ('pubDate',), 
-      ('guid', 'xml_url')
-    ]
-    added_list = []
-    for field in standard_fields:
-      (name, content, comment) = build_result_element(field, result)
+      content = self.get_content(result, name)
       if len(name) < 3:
         continue
 
@@ -717,56 +877,35 @@ class RssApiWriter(ApiWriter):
 
       if name in added_list:
         continue
-      added_list.append(name)
+      added_list.add(name)
 
-      if comment:
-        item.appendChild(self.doc.createComment(comment))
-      subitem = self.doc.createElement(name)
-      if content:
-        text = self.doc.createTextNode(content)
-        subitem.appendChild(text)
-      item.appendChild(subitem)
+      item.append(self.element(indent, name, content or None))
 
     #and now our namespaced fields
-    namespaced_fields = FIELD_TUPLES
+    added_list = set()
+    for names, list_name in self.item_fields:
+      name, elem_name = names[0]
+      if len(names) > 1 and not hasattr(result, name):
+        name, elem_name = names[1]
 
-    added_list = []
-    for field_info in namespaced_fields:
-      (name, content, comment) = build_result_element(field_info, result)
-
-      name = self.OurNamespace + ':' + API_FIELD_NAMES_MAP.get(name, name)
-
-      if (not result_set.is_hoc and not result_set.is_rss) and name.lower() not in STANDARD_FIELDS:
-        continue
-
-      if result_set.is_cal and name.lower() not in CALENDAR_FIELDS:
+      if not elem_name or elem_name in added_list:
         continue
+      added_list.add(elem_name)
+
+      content = self.get_content(result, name)
+      if list_name and content.find('\t') > 0:
+        item.append('%s<%s>\n' % (indent, elem_name))
+        for value in content.split('\t'):
+          item.append(self.element(indent + '  ', list_name, value))
+        item.append('%s</%s>\n' % (indent, elem_name))
+      else:
+        item.append(self.element(indent, elem_name, content or None))
 
-      if name in added_list:
-        continue
-      added_list.append(name)
-
-      if comment:
-        item.appendChild(self.doc.createComment(comment))
-
-      subitem = self.doc.createElement(name)
-      if content:
-        if len(field_info) > 1 and isinstance(content, basestring) and content.find('\t') > 0:
-          content = content.split('\t')
-
-        if isinstance(content, list):
-          for value in content:
-            subsubitem = self.doc.createElement(self.OurNamespace + ':' + field_info[1])
-            text = self.doc.createTextNode(value)
-            subsubitem.appendChild(text)
-            subitem.appendChild(subsubitem)
-        else:
-          text = self.doc.createTextNode(content)
-          subitem.appendChild(text)
-          
-      item.appendChild(subitem)
+    item.append('    </item>\n')
+    self.write(''.join(item))
       
   def finalize(self):
-    """Return a string from the XML document."""
-    #return self.doc.toxml(encoding='utf-8')
-    return self.doc.toprettyxml(indent='  ', newl='\n', encoding='utf-8')
+    """Write the end of the feed."""
+    self.write('  </channel>\n')
+    self.write('</rss>\n')
+    return self.get_unwritten()
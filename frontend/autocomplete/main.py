@@ -24,35 +24,58 @@ main() for autocomplete handler
 
 import os
 import logging
+import threading
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 
+from autocomplete import word_index
+
 AUTOCOMPLETE_FILENAME = "popular_words.txt"
 
-POPULAR_WORDS = None
+WORD_INDEX = None
+# held while an index is built
+INDEX_LOCK = threading.Lock()
 DEFAULT_MAXRESULTS = 10
 MAX_MAXRESULTS = 100
 
+
+def load_index():
+  """build a WordIndex from AUTOCOMPLETE_FILENAME."""
+  logging.info("reloading words...")
+  path = os.path.join(os.path.dirname(__file__), AUTOCOMPLETE_FILENAME)
+  index = word_index.WordIndex(word_index.load_words(path), MAX_MAXRESULTS)
+  logging.info("loaded %d words." % len(index))
+  return index
+
+
+def get_index(reload_words=False):
+  """the WordIndex, building it on first use.  A reload builds a new
+  index while requests keep using the old one, then swaps it in; if
+  another reload is already under way, this one is skipped."""
+  global WORD_INDEX
+  if WORD_INDEX is None:
+    INDEX_LOCK.acquire()
+    try:
+      if WORD_INDEX is None:
+        WORD_INDEX = load_index()
+    finally:
+      INDEX_LOCK.release()
+  elif reload_words and INDEX_LOCK.acquire(False):
+    try:
+      WORD_INDEX = load_index()
+    finally:
+      INDEX_LOCK.release()
+  return WORD_INDEX
+
+
 class Query(webapp.RequestHandler):
   """prefix query on autocomplete."""
   def get(self):
     """HTTP get method."""
-    global POPULAR_WORDS
-
-    reload_words = self.request.get('reload_words')
-    if POPULAR_WORDS == None or reload_words == "1":
-      logging.info("reloading words...")
-      POPULAR_WORDS = []
-      path = os.path.join(os.path.dirname(__file__), AUTOCOMPLETE_FILENAME)
-      fh = open(path, 'r')
-      for line in fh:
-        count, word = line.rstrip('\n\r').split("\t")
-        count = count  # shutup pylint
-        POPULAR_WORDS.append(word)
-      logging.info("loaded %d words." % len(POPULAR_WORDS))
+    index = get_index(self.request.get('reload_words') == "1")
 
     querystr = self.request.get('q') or ""
-    querystr = querystr.strip().lower()
+    querystr = querystr.strip().lower().encode('utf-8')
     if querystr == "":
       self.response.headers['Content-Type'] = 'text/plain'
       self.response.out.write("please provide &q= to query the autocompleter.")
@@ -68,16 +91,11 @@ class Query(webapp.RequestHandler):
     elif maxwords < 1:
       maxwords = 1
 
-    outstr = ""
-    numresults = 0
-    for word in POPULAR_WORDS:
-      if word.find(querystr) == 0:
-        outstr += word + "\n"
-        numresults += 1
-        if numresults >= maxwords:
-          break
+    # &typos=0 for exact prefix matches only
+    typos = self.request.get('typos') != "0"
+    words = index.complete(querystr, maxwords, typos)
     self.response.headers['Content-Type'] = 'text/plain'
-    self.response.out.write(outstr)
+    self.response.out.write("".join([word + "\n" for word in words]))
 
 APP = webapp.WSGIApplication(
   [('/autocomplete/query', Query)],
@@ -0,0 +1,145 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+prefix index of the autocomplete words.
+
+A word's rank is its position in popular_words.txt, which is sorted by
+count, most popular first.  The words are also kept in alphabetical
+order, so the words starting with a prefix are one bisect range; the
+most popular of those are the lowest ranks in the range.  Prefixes of
+up to TOP_PREFIX_LEN letters have long ranges, so their top words are
+worked out when the index is built.
+
+A query of MIN_TYPO_LEN or more letters with too few matches is filled
+up with the matches for prefixes one typo away: a letter dropped,
+added, changed, or two letters swapped.
+"""
+
+import bisect
+import heapq
+
+# prefixes this long or shorter have their top words precomputed
+TOP_PREFIX_LEN = 3
+# shortest query that gets typo matches
+MIN_TYPO_LEN = 3
+# sorts after any word that starts with the same prefix
+AFTER_PREFIX = '\xff'
+
+
+def load_words(path):
+  """the words in a popular_words.txt file (count<tab>word lines), in
+  file order."""
+  words = []
+  fh = open(path, 'r')
+  try:
+    for line in fh:
+      count, word = line.rstrip('\n\r').split("\t")
+      words.append(word)
+  finally:
+    fh.close()
+  return words
+
+
+class WordIndex(object):
+  """the words, ranked by popularity and searchable by prefix.  Not
+  changed once built: to reload, build a new one."""
+  def __init__(self, words, top_size=100):
+    """words are strs, most popular first; top_size is the most results a
+    query can ask for."""
+    self.top_size = top_size
+    # rank -> word
+    self.words = list(words)
+    ranked = sorted([(word, rank) for rank, word in enumerate(self.words)])
+    self.sorted_words = [word for word, rank in ranked]
+    # rank of each of sorted_words
+    self.sorted_ranks = [rank for word, rank in ranked]
+
+    # prefix -> the ranks of its top words, in rank order
+    self.top_ranks = {}
+    for rank, word in enumerate(self.words):
+      for length in range(1, min(len(word), TOP_PREFIX_LEN) + 1):
+        ranks = self.top_ranks.setdefault(word[:length], [])
+        if len(ranks) < top_size:
+          ranks.append(rank)
+
+    alphabet = {}
+    for word in self.words:
+      for char in word:
+        alphabet[char] = True
+    self.alphabet = sorted(alphabet.keys())
+
+  def __len__(self):
+    return len(self.words)
+
+  def prefix_range(self, prefix):
+    """(lo, hi): sorted_words[lo:hi] start with prefix."""
+    lo = bisect.bisect_left(self.sorted_words, prefix)
+    hi = bisect.bisect_left(self.sorted_words, prefix + AFTER_PREFIX, lo)
+    return lo, hi
+
+  def has_prefix(self, prefix):
+    """does any word start with prefix?"""
+    i = bisect.bisect_left(self.sorted_words, prefix)
+    return (i < len(self.sorted_words) and
+            self.sorted_words[i].startswith(prefix))
+
+  def prefix_ranks(self, prefix, num):
+    """ranks of the num most popular words starting with prefix."""
+    if len(prefix) <= TOP_PREFIX_LEN:
+      return self.top_ranks.get(prefix, [])[:num]
+    lo, hi = self.prefix_range(prefix)
+    if hi - lo <= num:
+      return sorted(self.sorted_ranks[lo:hi])
+    return heapq.nsmallest(num, self.sorted_ranks[lo:hi])
+
+  def near_prefixes(self, prefix):
+    """prefixes one typo away from prefix that some word starts with."""
+    # a typo at i leaves prefix[:i] as it is, so there's nothing to find
+    # for typos past the longest start of prefix that some word has
+    known = 0
+    while known < len(prefix) and self.has_prefix(prefix[:known + 1]):
+      known += 1
+
+    candidates = {}
+    for i in range(min(known + 1, len(prefix))):
+      candidates[prefix[:i] + prefix[i + 1:]] = True
+      if i + 1 < len(prefix):
+        swapped = prefix[:i] + prefix[i + 1] + prefix[i] + prefix[i + 2:]
+        candidates[swapped] = True
+      for char in self.alphabet:
+        candidates[prefix[:i] + char + prefix[i + 1:]] = True
+    for i in range(known + 1):
+      for char in self.alphabet:
+        candidates[prefix[:i] + char + prefix[i:]] = True
+    candidates.pop(prefix, None)
+
+    return [candidate for candidate in candidates
+            if self.has_prefix(candidate)]
+
+  def complete(self, prefix, num, typos=True):
+    """the num most popular words starting with prefix, then if that's
+    fewer than num and typos is set, the most popular of the words
+    starting with prefixes one typo away."""
+    num = max(0, min(num, self.top_size))
+    ranks = self.prefix_ranks(prefix, num)
+    if typos and len(ranks) < num and len(prefix) >= MIN_TYPO_LEN:
+      exact = dict.fromkeys(ranks)
+      near = {}
+      for near_prefix in self.near_prefixes(prefix):
+        for rank in self.prefix_ranks(near_prefix, num):
+          if rank not in exact:
+            near[rank] = True
+      ranks = ranks + heapq.nsmallest(num - len(ranks), near.keys())
+    return [self.words[rank] for rank in ranks]
@@ -0,0 +1,112 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+micro-benchmark for WordIndex.complete() on popular_words.txt at 1, 2
+and 3 letter prefixes, compared against the old scan of the word list.
+Checks that both give the same exact-prefix results first.
+
+usage: python word_index_benchmark.py
+"""
+
+import os
+import random
+import time
+
+import word_index
+
+AUTOCOMPLETE_FILENAME = "popular_words.txt"
+PREFIX_LENS = [1, 2, 3]
+NUMS = [10, 100]
+# queries timed per prefix length
+QUERIES = 2000
+
+
+def scan_complete(words, querystr, maxwords):
+  """the old handler's loop."""
+  outstr = ""
+  numresults = 0
+  for word in words:
+    if word.find(querystr) == 0:
+      outstr += word + "\n"
+      numresults += 1
+      if numresults >= maxwords:
+        break
+  return outstr
+
+
+def index_complete(index, querystr, maxwords, typos):
+  """the new handler's output."""
+  return "".join([word + "\n" for word in
+                  index.complete(querystr, maxwords, typos)])
+
+
+def check(words, index, prefixes):
+  """exact results match the scan; typo results start with them."""
+  for prefix in prefixes:
+    for num in NUMS:
+      expected = scan_complete(words, prefix, num)
+      got = index_complete(index, prefix, num, False)
+      if got != expected:
+        raise AssertionError("%r %d: %r != %r" % (prefix, num, got, expected))
+      if not index_complete(index, prefix, num, True).startswith(expected):
+        raise AssertionError("%r %d: typo results dropped exact ones" %
+                             (prefix, num))
+
+
+def time_queries(func, queries):
+  """microseconds per query."""
+  start = time.time()
+  for query in queries:
+    func(query)
+  return (time.time() - start) * 1000000.0 / len(queries)
+
+
+def main():
+  """check, then time each prefix length."""
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      AUTOCOMPLETE_FILENAME)
+  words = word_index.load_words(path)
+  start = time.time()
+  index = word_index.WordIndex(words)
+  print "%d words, index built in %.3fs" % (len(words),
+                                             time.time() - start)
+
+  rnd = random.Random(0)
+  for length in PREFIX_LENS:
+    prefixes = sorted(set([word[:length] for word in words
+                           if len(word) >= length]))
+    check(words, index, prefixes)
+    # the prefixes people type, weighted like the words
+    queries = [rnd.choice(words[:5000])[:length] for i in range(QUERIES)]
+    scan_us = time_queries(lambda q: scan_complete(words, q, 10),
+                           queries[:QUERIES / 10])
+    exact_us = time_queries(lambda q: index_complete(index, q, 10, False),
+                            queries)
+    typo_us = time_queries(lambda q: index_complete(index, q, 10, True),
+                           queries)
+    print ("%d letters (%d prefixes checked): scan %.1fus, index %.1fus, "
+           "with typos %.1fus" % (length, len(prefixes), scan_us, exact_us,
+                                  typo_us))
+
+  # misspelled queries: no exact match, so all typo matches
+  misspelled = ["volunter", "hungr", "anmial", "eviroment", "tutro"]
+  typo_us = time_queries(lambda q: index_complete(index, q, 10, True),
+                         misspelled * (QUERIES / len(misspelled)))
+  print "misspelled, with typos: %.1fus" % typo_us
+  for query in misspelled:
+    print "  %s: %s" % (query, ", ".join(index.complete(query, 5)))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,45 @@
+"""
+/cache-update: hit by the datahub scripts after they load new data into
+SOLR, so cached search result sets aren't served for the old data.
+"""
+
+from google.appengine.dist import use_library
+use_library('django', '1.2')
+
+from google.appengine.ext import webapp
+from google.appengine.ext.webapp.util import run_wsgi_app
+
+import result_cache
+
+class handleRequest(webapp.RequestHandler):
+  """ handle request """
+
+  def get(self):
+    """ handle get request """
+    update(self)
+
+  def post(self):
+    """ handle post request """
+    update(self)
+
+
+def update(app):
+  """ start a new result cache version """
+  app.response.headers['Content-Type'] = 'text/plain'
+  if result_cache.update_cache_key():
+    app.response.out.write('ok\n')
+  else:
+    app.response.set_status(500)
+    app.response.out.write('failed\n')
+
+APP = webapp.WSGIApplication(
+    [ (".*", handleRequest)
+    ], debug=True)
+
+def main():
+  """ this program starts here """
+  run_wsgi_app(APP)
+
+
+if __name__ == '__main__':
+  main()
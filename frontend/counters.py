@@ -0,0 +1,284 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+integer properties counted in memcache and written to the datastore in
+batches, for counts bumped too often for a transaction each (popular
+opportunities' VolunteerOpportunityStats, page counts).
+
+increment() adds to one of NUM_SHARDS memcache counters per property,
+picked at random, and doesn't touch the datastore.  The first increment
+to an entity since it was last flushed also appends it to a list in
+memcache of entities with pending counts.  flush(), run from cron, takes
+entities off that list, subtracts their pending counts from the shards
+and adds them to the datastore, one transaction per entity.  Counts
+added while that runs wait for the next flush.  get_pending() is for
+reads that want the counts not flushed yet.
+
+memcache counters can't go below zero, so the shards start at BIAS.
+Pending counts are lost if memcache evicts them before a flush, which
+is the price of not writing the datastore on every increment.  The keys
+are not versioned, so counts pending when a new version is deployed are
+flushed by the new version.
+"""
+
+import logging
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+import utils
+
+NUM_SHARDS = 8
+BIAS = 1 << 32
+PENDING_PREFIX = 'counter:'
+# kind:key_name -> 1 while the entity is on the list.  They expire in
+# case the list entry is lost, so the next increment lists it again.
+LISTED_PREFIX = 'counter_listed:'
+LISTED_TIME = 10*60  # seconds
+# the list: numbered entries, how many were added and how many flushed
+LIST_PREFIX = 'counter_list:'
+LIST_COUNT_KEY = 'counter_list_count'
+LIST_DONE_KEY = 'counter_list_done'
+LIST_TIME = 24*60*60  # seconds
+# entities read from the list at a time
+FLUSH_BATCH = 200
+# flush() stops after this long, to stay clear of the request deadline
+FLUSH_SECONDS = 20
+FLUSH_LOCK_KEY = 'counter_flush_lock'
+FLUSH_LOCK_TIME = 5*60  # seconds
+
+STATS_KEY_PREFIX = 'counter_stats:'
+STAT_NAMES = ['increments', 'direct_writes', 'flushed', 'flush_failures']
+
+# kind -> (model class, names of its counted properties)
+counted = {}
+
+# counter events, for the admin page
+stats = utils.Stats(STATS_KEY_PREFIX, STAT_NAMES)
+
+
+def register(model, names):
+  """count these integer properties of model through here."""
+  counted[model.kind()] = (model, list(names))
+
+
+def get_stats():
+  """totals for every instance, for the admin page."""
+  totals = stats.get()
+  try:
+    counts = memcache.get_multi([LIST_COUNT_KEY, LIST_DONE_KEY])
+  except:
+    logging.warning("counters.get_stats failed")
+    counts = {}
+  totals['listed'] = max(0, counts.get(LIST_COUNT_KEY, 0) -
+                         counts.get(LIST_DONE_KEY, 0))
+  return totals
+
+
+def shard_key(kind, key_name, name, shard):
+  """memcache key (less PENDING_PREFIX) of one shard of a count."""
+  return '%s:%s:%s:%d' % (kind, key_name, name, shard)
+
+
+def write(model, key_name, deltas):
+  """add deltas to the entity in the datastore, creating it if need be.
+  Returns the entity, or None on failure."""
+  def txn():
+    """add the deltas in a transaction."""
+    entity = model.get_by_key_name(key_name)
+    if not entity:
+      entity = model(key_name=key_name)
+    for name, delta in deltas.iteritems():
+      setattr(entity, name, (getattr(entity, name) or 0) + delta)
+    entity.put()
+    return entity
+
+  try:
+    return db.run_in_transaction(txn)
+  except:
+    logging.exception('counters.write failed for %s %s' %
+                      (model.kind(), key_name))
+    return None
+
+
+def add_to_list(kind, key_name):
+  """list an entity as having pending counts, unless it already is."""
+  listed_key = LISTED_PREFIX + kind + ':' + key_name
+  try:
+    if not memcache.add(listed_key, 1, time=LISTED_TIME):
+      return
+    slot = memcache.incr(LIST_COUNT_KEY, initial_value=0)
+    if slot is None or not memcache.set(LIST_PREFIX + str(slot),
+                                        (kind, key_name), time=LIST_TIME):
+      # try again on the next increment
+      memcache.delete(listed_key)
+  except:
+    logging.warning("counters.add_to_list failed")
+
+
+def increment(model, key_name, deltas):
+  """add deltas, a dict of property name: amount, to the counts of the
+  model entity with this key name.  Deltas that can't be put in memcache
+  are written to the datastore.  Returns success."""
+  kind = model.kind()
+  shard = random.randrange(NUM_SHARDS)
+  offsets = {}
+  for name, delta in deltas.iteritems():
+    if delta:
+      offsets[shard_key(kind, key_name, name, shard)] = delta
+  if not offsets:
+    return True
+
+  try:
+    results = memcache.offset_multi(offsets, key_prefix=PENDING_PREFIX,
+                                    initial_value=BIAS)
+  except:
+    logging.warning("counters.increment failed")
+    results = {}
+  stats.record('increments')
+
+  unbuffered = {}
+  for name, delta in deltas.iteritems():
+    if delta and results.get(shard_key(kind, key_name, name, shard)) is None:
+      unbuffered[name] = delta
+  success = True
+  if unbuffered:
+    stats.record('direct_writes')
+    success = write(model, key_name, unbuffered) is not None
+  if len(unbuffered) < len(offsets):
+    add_to_list(kind, key_name)
+  stats.flush()
+  return success
+
+
+def get_pending(model, key_names, names=None):
+  """counts not flushed yet: {key_name: {property name: delta}}, for the
+  key names with any.  names defaults to all the counted properties."""
+  kind = model.kind()
+  if names is None:
+    names = counted[kind][1]
+  keys = []
+  for key_name in key_names:
+    for name in names:
+      for shard in range(NUM_SHARDS):
+        keys.append(shard_key(kind, key_name, name, shard))
+  try:
+    values = memcache.get_multi(keys, key_prefix=PENDING_PREFIX)
+  except:
+    logging.warning("counters.get_pending failed")
+    values = {}
+
+  pending = {}
+  for key_name in key_names:
+    for name in names:
+      delta = 0
+      for shard in range(NUM_SHARDS):
+        value = values.get(shard_key(kind, key_name, name, shard))
+        if value:
+          delta += int(value) - BIAS
+      if delta:
+        pending.setdefault(key_name, {})[name] = delta
+  return pending
+
+
+def flush_entities(entities):
+  """move the pending counts of these (kind, key_name)s to the datastore.
+  Returns the number written."""
+  # taken off the list first so increments from here on list them again
+  memcache.delete_multi([LISTED_PREFIX + kind + ':' + key_name
+                         for kind, key_name in entities])
+
+  keys = []
+  for kind, key_name in entities:
+    for name in counted[kind][1]:
+      for shard in range(NUM_SHARDS):
+        keys.append(shard_key(kind, key_name, name, shard))
+  values = memcache.get_multi(keys, key_prefix=PENDING_PREFIX)
+
+  # take what was read out of the shards, leaving anything added since
+  taken = {}
+  for key, value in values.iteritems():
+    if value and int(value) != BIAS:
+      taken[key] = int(value) - BIAS
+  if taken:
+    memcache.offset_multi(dict([(key, -delta) for key, delta in
+                                taken.iteritems()]),
+                          key_prefix=PENDING_PREFIX, initial_value=BIAS)
+
+  written = 0
+  for kind, key_name in entities:
+    model, names = counted[kind]
+    deltas = {}
+    entity_taken = {}
+    for name in names:
+      for shard in range(NUM_SHARDS):
+        key = shard_key(kind, key_name, name, shard)
+        if key in taken:
+          deltas[name] = deltas.get(name, 0) + taken[key]
+          entity_taken[key] = taken[key]
+    if not [delta for delta in deltas.itervalues() if delta]:
+      continue
+    if write(model, key_name, deltas) is not None:
+      written += 1
+    else:
+      # put them back for the next flush
+      memcache.offset_multi(entity_taken, key_prefix=PENDING_PREFIX,
+                            initial_value=BIAS)
+      add_to_list(kind, key_name)
+      stats.record('flush_failures')
+  return written
+
+
+def flush(batch_size=FLUSH_BATCH, seconds=FLUSH_SECONDS):
+  """move pending counts to the datastore, for the entities on the list
+  when it starts, until they're done or seconds have passed.  Returns the number of
+  entities written, or None if another flush is running."""
+  if not memcache.add(FLUSH_LOCK_KEY, 1, time=FLUSH_LOCK_TIME):
+    return None
+  written = 0
+  try:
+    deadline = time.time() + seconds
+    # entities listed from here on, including any put back after a
+    # failed write, wait for the next flush
+    count = memcache.get(LIST_COUNT_KEY) or 0
+    while time.time() < deadline:
+      done = memcache.get(LIST_DONE_KEY) or 0
+      if count < done:
+        # the count was evicted and started again
+        done = 0
+      last = min(count, done + batch_size)
+      if last <= done:
+        break
+
+      slots = [str(i) for i in range(done + 1, last + 1)]
+      listed = memcache.get_multi(slots, key_prefix=LIST_PREFIX)
+      entities = []
+      seen = {}
+      for slot in slots:
+        entry = listed.get(slot)
+        if entry and entry[0] in counted and entry not in seen:
+          seen[entry] = True
+          entities.append(entry)
+      memcache.set(LIST_DONE_KEY, last)
+      if entities:
+        written += flush_entities(entities)
+  finally:
+    memcache.delete(FLUSH_LOCK_KEY)
+
+  stats.record('flushed', written)
+  stats.flush(True)
+  return written
@@ -17,11 +17,13 @@ export main().
 """
 
 import re
+import time
 import logging
 import hashlib
 from datetime import datetime
 from string import strip
 
+from google.appengine.api import datastore
 from google.appengine.ext import db
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
@@ -50,12 +52,29 @@ FIELD_TYPE_REF = 7
 # at this time will return
 GQL_MAX_ROWS = 1000
 
+# rows fetched from the datastore at a time by an export
+EXPORT_CHUNK_ROWS = 200
+# an export response stops after this many seconds, with a cursor
+# to carry on from, to stay clear of the request deadline
+EXPORT_SECONDS = 20
+# the most key ranges a table can be split into for exporting
+MAX_EXPORT_RANGES = 32
+# keys sampled per range when splitting a table
+SCATTER_SAMPLES = 32
+
+# the last line of an export: the cursor for the next rows, or the end.
+# key names like __*__ are reserved so no row can start with these.
+CURSOR_MARKER = "__cursor__"
+END_MARKER = "__end__"
+
 ROW_MARKER_LEN = 4
 ROW_MARKER = "row="
 
 USAGE = """
 <pre>
 /export/TABLENAME.tsv, eg. UserStats.tsv
+  &limit=ROWS &start=KEY &end=KEY &cursor=CURSOR
+/export/TABLENAME.tsv?ranges=N, to split TABLENAME into N key ranges
 /export/TABLENAME/TABLENAME_BACKUP, eg. UserInfo/UserInfo_20090416
 </pre>
 """
@@ -180,21 +199,56 @@ def get_max_key(table, max_key = ""):
 
   return row.key()
 
-def export_table_as_tsv(table, min_key, limit):
+def get_key_arg(request, name, caller):
+  """ get an encoded datastore key, or None if not given """
+  value = utils.get_last_arg(request, name, "")
+  if value == "":
+    return None
+  try:
+    return db.Key(value)
+  except:
+    pagecount.IncrPageCount("export.%s.badKey" % caller, 1)
+    raise Fail("bad &%s" % name)
+
+def get_key_ranges(table, count):
+  """
+  split the table into at most count ranges of about the same number
+  of rows, as (start, end) pairs of encoded keys where '' is the
+  start or end of the table.  The split points are picked from a
+  sample of the keys in __scatter__ order, which is random.
+  """
+  count = max(1, min(count, MAX_EXPORT_RANGES))
+  splits = []
+  if count > 1:
+    query = datastore.Query(table.kind(), keys_only=True)
+    query.Order("__scatter__")
+    sample = sorted(query.Get(count * SCATTER_SAMPLES))
+    step = float(len(sample)) / count
+    for i in range(1, count):
+      if not sample:
+        # no keys with __scatter__ yet, so export it whole
+        break
+      key = sample[int(i * step)]
+      if key not in splits:
+        splits.append(key)
+
+  bounds = [""] + [str(key) for key in splits] + [""]
+  return zip(bounds[:-1], bounds[1:])
+
+def export_table_as_tsv(table, start_key=None, end_key=None, cursor="",
+                        limit=GQL_MAX_ROWS, seconds=EXPORT_SECONDS):
   """ 
-  get rows from this table as TSV
+  get rows from this table as TSV, from start_key (or the top of the
+  table) up to but not including end_key (or the end of the table),
+  carrying on from cursor if given.  This is a generator of chunks of
+  at most EXPORT_CHUNK_ROWS rows; the header comes first when starting
+  from the top, and the last line is CURSOR_MARKER and the cursor to
+  pass back for the next rows, or END_MARKER if there are no more.
   """
   # neither \t nor \n should appear in the data without
   # being properly escaped in double quotes
   delim, recsep = ("\t", "\n")
 
-  def get_fields(table_object):
-    """ get a list of field names prepended with 'key' """
-    fields = ["key"]
-    for field in table_object.properties():
-      fields.append(field)
-    return fields
-
   def field_to_str(value):
     """ get our field value as a string """
     if not value:
@@ -208,62 +262,69 @@ def export_table_as_tsv(table, min_key, limit):
         field_value = str(value)
     return field_value
 
-  def get_header(fields, delim):
-    """ get a delimited list of the field names """
-    header = delim.join(fields)
-    return header
-
-  def esc_value(value, delim, recsep):
+  def esc_value(value):
     """ make sure our delimiter and record separator are not in the data """
-    return field_to_str(value).replace(delim, "\\t").replace(recsep, "\\n")
-
-  fields = get_fields(table)
+    return value.replace(delim, "\\t").replace(recsep, "\\n")
+
+  def get_getter(prop):
+    """ get a function returning this property of a row as a string """
+    if isinstance(prop, db.ReferenceProperty):
+      # the referenced key is stored in the row, so there is no need
+      # to fetch the referenced entity to get its key name
+      def get_reference(row):
+        """ the key name or id of the referenced entity """
+        key = prop.get_value_for_datastore(row)
+        if key is None:
+          return ""
+        return str(key.id_or_name())
+      return get_reference
+    name = prop.name
+    return lambda row: field_to_str(getattr(row, name, None))
+
+  properties = table.properties()
+  fields = ["key"] + list(properties)
+  getters = [get_getter(properties[field]) for field in fields[1:]]
+
+  query = table.all().order("__key__")
+  if start_key:
+    query.filter("__key__ >=", start_key)
+  if end_key:
+    query.filter("__key__ <", end_key)
+  if cursor:
+    try:
+      query.with_cursor(cursor)
+    except:
+      raise Fail("bad &cursor")
 
-  output = []
-  if min_key == "":
+  lines = []
+  if not cursor and not start_key:
     # this is the first record we output so add the header
-    output.append(get_header(fields, delim))
-    inequality = ">="
-  else:
-    inequality = ">"
+    lines.append(delim.join(fields))
 
-  done = False
-    
-  startKey = get_min_key(table, min_key)
-  
-  lastKey = ""
-  processed = 0
-  while done == False:  
-    try:
-      queryString = "WHERE __key__ %s :1 ORDER BY __key__" % inequality
-      query = table.gql(queryString,startKey)
-    except:
-      query = None
-      return "query error"
-    cnt = 0
-    if query:
-      rsp = query.fetch(limit)
-      cnt = query.count(limit)
-      for row in rsp:
-        line = []
-        for field in fields:
-          if field == "key":
-            value = row.key().id_or_name()
-            lastKey = row.key()
-          else:
-            value = getattr(row, field, None)
-          line.append(esc_value(value, delim, recsep))
-        output.append(delim.join(line))
+  deadline = time.time() + seconds
+  sent = 0
+  while True:
+    chunk_size = min(EXPORT_CHUNK_ROWS, limit - sent)
+    rows = query.fetch(chunk_size)
+    for row in rows:
+      line = [esc_value(str(row.key().id_or_name()))]
+      for getter in getters:
+        line.append(esc_value(getter(row)))
+      lines.append(delim.join(line))
+    sent += len(rows)
+
+    if len(rows) < chunk_size:
+      lines.append(END_MARKER)
+    elif sent >= limit or time.time() > deadline:
+      lines.append(delim.join([CURSOR_MARKER, query.cursor()]))
     else:
-      output = "query was null..."
-    
-    inequality = ">"
-    startKey = lastKey
-    processed += cnt
-    if cnt < GQL_MAX_ROWS:
-      done = True
-    
-  return "%s%s" % (recsep.join(output), recsep)
+      query.with_cursor(query.cursor())
+      yield "%s%s" % (recsep.join(lines), recsep)
+      lines = []
+      continue
+
+    yield "%s%s" % (recsep.join(lines), recsep)
+    break
 
 class ExportTableTSV(webapp.RequestHandler):
   """ export the data in the table """
@@ -280,14 +341,33 @@ class ExportTableTSV(webapp.RequestHandler):
     webapp.RequestHandler.__response__(self)
 
   def get(self, table):
-    """ handle the request to export the table """
+    """
+    handle the request to export the table, or with &ranges=N to split
+    it into N key ranges that can be exported in parallel
+    """
     pagecount.IncrPageCount("export.ExportTableTSV.attempt", 1)
     verify_dig_sig(self.request, "ExportTableTSV")
-    limit = get_limit(self.request, "ExportTableTSV")
-    min_key = utils.get_last_arg(self.request, "min_key", "")
     model = get_model(table, "ExportTableTSV")
     self.response.headers['Content-Type'] = 'text/plain'
-    self.response.out.write(export_table_as_tsv(model, min_key, limit))
+
+    ranges = utils.get_last_arg(self.request, "ranges", "")
+    if ranges != "":
+      try:
+        count = int(ranges)
+      except:
+        pagecount.IncrPageCount("export.ExportTableTSV.nonIntRanges", 1)
+        raise Fail("non integer &ranges")
+      for start, end in get_key_ranges(model, count):
+        self.response.out.write("%s\t%s\n" % (start, end))
+      pagecount.IncrPageCount("export.ExportTableTSV.ranges", 1)
+      return
+
+    limit = get_limit(self.request, "ExportTableTSV")
+    start_key = get_key_arg(self.request, "start", "ExportTableTSV")
+    end_key = get_key_arg(self.request, "end", "ExportTableTSV")
+    cursor = utils.get_last_arg(self.request, "cursor", "")
+    for chunk in export_table_as_tsv(model, start_key, end_key, cursor, limit):
+      self.response.out.write(chunk)
     pagecount.IncrPageCount("export.ExportTableTSV.success", 1)
 
 def transfer_table(source, destination, min_key, limit):
@@ -1,13 +1,15 @@
 # pagecount.py
 #
-# memcache-based counter with occasional db writeback.
+# memcache-based counter, written back to the datastore in batches
+# by counters.flush().
 # This is suitable for realtime pageviews counts, YMMV for other uses.
 #
 
 from versioned_memcache import memcache
 from google.appengine.ext import db
 import logging
-import random
+
+import counters
 
 # this is a key used for testing and calls made with it
 # are seperated from the production stats
@@ -16,11 +18,6 @@ TEST_API_KEY = 'testkey'
 VIEWS_PREFIX = "v:"
 CLICKS_PREFIX = "c:"
 
-# increase as needed
-WRITEBACK_FREQ_PCT = 1.0
-WRITEBACK_VAL = WRITEBACK_FREQ_PCT / 100.0 * 1000000.0
-
-pc_writebacks = 0
 pc_loads = 0
 
 class PageCountShard(db.Model):
@@ -29,16 +26,6 @@ class PageCountShard(db.Model):
 def KeyName(pagename):
   return 'pc:' + pagename
 
-def Writeback(pagename, value):
-  global pc_writebacks
-  pc_writebacks = pc_writebacks + 1
-  logging.debug("pagecount.Writeback(pagename='%s', value=%d" % (pagename, +value))
-  record = PageCountShard(key_name=KeyName(pagename), count=value)
-  try:
-    record.put()
-  except:
-    logging.warning("pagecount.Writeback(pagename='%s', value=%d" % (pagename, +value))
-
 def LoadPageCount(pagename):
   global pc_loads
   pc_loads = pc_loads + 1
@@ -50,44 +37,25 @@ def LoadPageCount(pagename):
 
   if record != None:
     return record.count
-  db.run_in_transaction(Writeback, pagename, 0)
   return 0
 
-# initializes memcache if missing
 def GetPageCount(pagename):
+  """ the count in the datastore plus the increments not yet flushed """
   logging.debug("pagecount.GetPageCount(pagename='"+pagename+"')")
-  memcache_id = KeyName(pagename)
-  val = memcache.get(memcache_id)
-  if (val != None):
-    return val
-  val = LoadPageCount(pagename)
-  memcache_id = KeyName(pagename)
-  memcache.set(memcache_id, val)
-  return val
+  key_name = KeyName(pagename)
+  pending = counters.get_pending(PageCountShard, [key_name])
+  return LoadPageCount(pagename) + pending.get(key_name, {}).get('count', 0)
 
 def IncrPageCount(pagename, delta):
-  """ increment page count """
-  return
-
+  """ increment page count, buffered in memcache until the next flush """
   logging.debug("pagecount.IncrPageCount(pagename='"+pagename+"')")
-  memcache_id = KeyName(pagename)
-  if memcache.get(memcache_id) == None:
-    # initializes memcache if missing
-    return GetPageCount(pagename)
-  newval = memcache.incr(memcache_id, delta)
-  #TODO: rnd seems unused?
-  #rnd = random.random() * 1000000.0
-  
-  if (random.random() * 1000000.0 <= WRITEBACK_FREQ_PCT / 100.0 * 1000000.0):
-    logging.debug("pagecount.IncrPageCount: writeback: writebacks="+
-                  str(pc_writebacks)+" newval="+str(newval))
-    db.run_in_transaction(Writeback, pagename, newval)
-  return newval
+  counters.increment(PageCountShard, KeyName(pagename), {'count': delta})
 
 def GetStats():
-  global pc_writebacks, pc_loads
+  global pc_loads
   stats = memcache.get_stats()
-  stats['pc_writebacks'] = pc_writebacks
   stats['pc_loads'] = pc_loads
+  stats['counter_stats'] = counters.get_stats()
   return stats
 
+counters.register(PageCountShard, ['count'])
@@ -19,7 +19,8 @@ def RenderTemplate(template_filename, template_values):
 class TestPageViewsView(webapp.RequestHandler):
   def get(self):
     pagename = "testpage:%s" % (self.request.get('pagename'))
-    pc = pagecount.IncrPageCount(pagename, 1)
+    pagecount.IncrPageCount(pagename, 1)
+    pc = pagecount.GetPageCount(pagename)
     template_values = pagecount.GetStats()
     template_values['pagename'] = pagename
     template_values['pageviews'] = pc
@@ -0,0 +1,61 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SOLR query fragments built from the boosts tables, for solr_search.
+
+The boosts, filter queries and category rewrites for a search depend
+only on its api key and category, and the tables they come from don't
+change while an instance runs.  So each fragment is built the first time
+it's asked for and kept in an LRUCache of CACHE_SIZE entries.  Hits and
+misses are counted for the admin page.
+"""
+
+import utils
+
+CACHE_SIZE = 1000
+
+STATS_KEY_PREFIX = 'fragment_cache_stats:'
+STAT_NAMES = ['hits', 'misses']
+
+cache = utils.LRUCache(CACHE_SIZE)
+
+# cache lookups, for the admin page
+stats = utils.Stats(STATS_KEY_PREFIX, STAT_NAMES)
+
+
+def get_stats():
+  """totals for every instance, for the admin page."""
+  totals = stats.get()
+  lookups = totals['hits'] + totals['misses']
+  if lookups:
+    totals['hit_percent'] = '%4.1f%%' % ((100.0 * totals['hits']) / lookups)
+  else:
+    totals['hit_percent'] = 'n/a'
+  totals['entries'] = len(cache)
+  return totals
+
+
+def get(name, key, build):
+  """fragment name for key, a tuple: build(*key) the first time."""
+  cache_key = (name,) + key
+  value = cache.get(cache_key)
+  if value is None:
+    stats.record('misses')
+    value = build(*key)
+    cache.put(cache_key, value)
+  else:
+    stats.record('hits')
+  stats.flush()
+  return value
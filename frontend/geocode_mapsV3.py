@@ -43,6 +43,10 @@ ACCURACY = { "ROOFTOP" : 5, # precise geocode accurate down to street address
              "APPROXIMATE" : 2, # indicates that the returned result is approximate.
            }
 
+# get_statewide() when the location can't be reverse geocoded
+DEFAULT_STATE = 'CA'
+DEFAULT_COUNTRY = 'US'
+
 class RevGeo(db.Model):
   """ key = lat.###,lng.### """
   json = db.TextProperty()
@@ -168,39 +172,22 @@ def rev_geocode_json(lat, lng):
   if rec:
     json_str = rec.json
   else:
-    # try the pipeline cache
-    try:
-      lat_str = str(round(float(lat) * 1000.0)/1000.0).replace('.', '_').rstrip('0')
-      lng_str = str(round(float(lng) + 1000.0)/1000.0).replace('.', '_').rstrip('0')
-    except:
-      # most likely given junk lat/lng
-      return jo
-
-    url = private_keys.NODE2 + '/~footprint/revgeo/G' + 'lat' + lat_str + 'lng' + lng_str + '.json'
+    # try Maps API; the pipeline's reverse geocodes reach the frontend
+    # through statewide's revgeo_cells.txt
+    latlng = str(lat) + ',' + str(lng)
+    params = urllib.urlencode({'latlng':latlng, 
+                               'sensor':'false', 
+                               'client':private_keys.MAPS_API_CLIENT_ID})
+    request = "/maps/api/geocode/json?%s" % params
+    signature = sign_maps_api_request(request)
+    fetchurl = "http://maps.googleapis.com" + request + "&signature=" + signature
+    url = 'http://maps.googleapis.com' + request + '&signature=' + signature
     try:
       fh = urllib2.urlopen(url)
       json_str = fh.read()
       fh.close()
-      jo = json.loads(json_str.encode('ascii', 'xmlcharrefreplace'))
     except:
-      json_str = ''
-
-    if not json_str:
-      # try Maps API
-      latlng = str(lat) + ',' + str(lng)
-      params = urllib.urlencode({'latlng':latlng, 
-                                 'sensor':'false', 
-                                 'client':private_keys.MAPS_API_CLIENT_ID})
-      request = "/maps/api/geocode/json?%s" % params
-      signature = sign_maps_api_request(request)
-      fetchurl = "http://maps.googleapis.com" + request + "&signature=" + signature
-      url = 'http://maps.googleapis.com' + request + '&signature=' + signature
-      try:
-        fh = urllib2.urlopen(url)
-        json_str = fh.read()
-        fh.close()
-      except:
-        return jo
+      return jo
 
   if json_str:
     if not jo:
@@ -221,28 +208,39 @@ def rev_geocode_json(lat, lng):
   return jo
 
 
-def get_statewide(lat, lng):
-  """ """
-
-  rtn = 'CA'
-  country = 'US'
+def statewide_from_json(jo):
+  """(state, country) from a rev_geocode_json() answer, or None if there
+  wasn't one."""
+  if not jo:
+    return None
 
-  jo = rev_geocode_json(lat, lng)
-  if jo:
-    try:
-      if jo['status'] != 'OK':
-        logging.warning('geocode.get_statewide: rev_geo says ' + jo['status'])
-      else:
-        for d in jo['results'][0]['address_components']:
-          if 'administrative_area_level_1' in d['types']:
-            rtn = d['short_name']
-          elif 'country' in d['types']:
-            country = d['short_name']
-    except:
-      logging.warning('geocode.get_statewide: rev_geo call failed')
+  rtn = DEFAULT_STATE
+  country = DEFAULT_COUNTRY
+  try:
+    if jo['status'] != 'OK':
+      logging.warning('geocode.get_statewide: rev_geo says ' + jo['status'])
+      if jo['status'] != 'ZERO_RESULTS':
+        return None
+    else:
+      for d in jo['results'][0]['address_components']:
+        if 'administrative_area_level_1' in d['types']:
+          rtn = d['short_name']
+        elif 'country' in d['types']:
+          country = d['short_name']
+  except:
+    logging.warning('geocode.get_statewide: rev_geo call failed')
+    return None
 
   if country and country != 'US':
      rtn += '-' + country
 
   return rtn, country
 
+
+def get_statewide(lat, lng):
+  """ """
+  found = statewide_from_json(rev_geocode_json(lat, lng))
+  if not found:
+    found = (DEFAULT_STATE, DEFAULT_COUNTRY)
+  return found
+
@@ -38,6 +38,7 @@ APPLICATION = webapp.WSGIApplication(
      (urls.URL_DATAHUB_DASHBOARD, views.datahub_dashboard_view),
      (urls.URL_API_SEARCH, views.search_view),
      (urls.URL_UI_SNIPPETS, views.ui_snippets_view),
+     (urls.URL_FLUSH_COUNTERS, views.flush_counters_view),
 
      (urls.URL_REDIRECT, views.redirect_view),
      (urls.URL_HOME4HOLIDAYS, views.home4holidays_redir_view), # this is a redirect
@@ -18,6 +18,7 @@
 from google.appengine.api import memcache
 from google.appengine.ext import db
 
+import counters
 import modelutils
 
 class Error(Exception):
@@ -131,6 +132,11 @@ class UserInfo(db.Model):
   TEST = 'test'
   KNOWN_TYPES = (FRIENDCONNECT, FACEBOOK, TEST)
 
+  @classmethod
+  def make_key_name(cls, account_type, user_id):
+    """Generate key name for a given account_type/user_id pair."""
+    return '%s:%s' % (account_type, user_id)
+
   @classmethod
   def get_or_insert_user(cls, account_type, user_id):
     """Gets existing or creates a new user.
@@ -151,7 +157,7 @@ class UserInfo(db.Model):
     if not account_type in cls.KNOWN_TYPES:
       raise BadAccountType()
 
-    key_name = '%s:%s' % (account_type, user_id)
+    key_name = cls.make_key_name(account_type, user_id)
     user_info = cls.get_by_key_name(key_name)
 
     def txn():
@@ -247,6 +253,10 @@ class VolunteerOpportunityStats(db.Model):
                 absolute_attributes=None):
     """Helper to increment volunteer opportunity stats.
 
+    Relative changes to the interest counts are buffered by counters and
+    reach the datastore on its next flush; use get_pending_interests() to
+    read them before then.  Absolute changes are written at once.
+
     Example:
       VolunteerOpportunityStats.increment(opp_id,
         { USER_INTEREST_LIKED: 1, USER_INTEREST_WILL_ATTEND: 1 })
@@ -260,8 +270,11 @@ class VolunteerOpportunityStats(db.Model):
     Returns:
       Success boolean
     """
-    entity = VolunteerOpportunityStats.get_or_insert(
-        cls.DATASTORE_PREFIX + volunteer_opportunity_id)
+    key_name = cls.DATASTORE_PREFIX + volunteer_opportunity_id
+    if not absolute_attributes:
+      return counters.increment(cls, key_name, relative_attributes or {})
+
+    entity = VolunteerOpportunityStats.get_or_insert(key_name)
     if not entity:
       return False
 
@@ -273,6 +286,22 @@ class VolunteerOpportunityStats(db.Model):
                  time=cls.MEMCACHE_TIME)
     return True
 
+  @classmethod
+  def get_pending_interests(cls, volunteer_opportunity_ids, names=None):
+    """Interest counts not yet flushed to the datastore.
+
+    Args:
+      volunteer_opportunity_ids: list of opportunity IDs.
+      names: interest attributes wanted, default USER_INTEREST_ATTRIBUTES.
+    Returns:
+      Dictionary of id: {attr_name: delta}, for the IDs with any.
+    """
+    prefix = cls.DATASTORE_PREFIX
+    pending = counters.get_pending(
+        cls, [prefix + opp_id for opp_id in volunteer_opportunity_ids], names)
+    return dict([(key_name[len(prefix):], deltas)
+                 for key_name, deltas in pending.iteritems()])
+
   @classmethod
   def set_blacklisted(cls, volunteer_opportunity_id, value):
     """Helper to set volunteer opportunity value and update memcache."""
@@ -322,3 +351,5 @@ USER_INTEREST_ATTRIBUTES = (
   USER_INTEREST_WILL_ATTEND,
   USER_INTEREST_FLAGGED,
 )
+
+counters.register(VolunteerOpportunityStats, USER_INTEREST_ATTRIBUTES)
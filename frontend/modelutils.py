@@ -88,27 +88,49 @@ def set_entity_attributes(entity, absolute_attributes, relative_attributes):
     return (None, None)
 
 
-def get_by_ids(cls, ids):
-  """Gets multiple entities for IDs, trying memcache then datastore.
+def start_get_by_ids(cls, ids):
+  """Starts get_by_ids(): looks in memcache, and starts an async datastore
+  get for the ids that weren't there.
 
   Args:
     cls: Model class
     ids: list of ids.
   Returns:
-    Dictionary of results, id:model.
+    The rpc to pass to get_by_ids().
   """
   results = memcache.get_multi(ids, cls.MEMCACHE_PREFIX + ':')
 
   datastore_prefix = cls.DATASTORE_PREFIX
-  missing_ids = []
+  missing_keys = []
   for id in ids:
     if not id in results:
-      missing_ids.append(datastore_prefix + id)
+      missing_keys.append(db.Key.from_path(cls.kind(), datastore_prefix + id))
+
+  datastore_rpc = None
+  if missing_keys:
+    datastore_rpc = db.get_async(missing_keys)
+  return (results, datastore_rpc)
+
+
+def get_by_ids(cls, ids, rpc=None):
+  """Gets multiple entities for IDs, trying memcache then datastore.
 
-  datastore_results = cls.get_by_key_name(missing_ids)
-  for result in datastore_results:
-    if result:
-      result_id = result.key().name()[len(datastore_prefix):]
-      results[result_id] = result
+  Args:
+    cls: Model class
+    ids: list of ids.
+    rpc: from start_get_by_ids(cls, ids), if it was started already.
+  Returns:
+    Dictionary of results, id:model.
+  """
+  if rpc is None:
+    rpc = start_get_by_ids(cls, ids)
+  (results, datastore_rpc) = rpc
+
+  if datastore_rpc:
+    datastore_prefix = cls.DATASTORE_PREFIX
+    for result in datastore_rpc.get_result():
+      if result:
+        result_id = result.key().name()[len(datastore_prefix):]
+        results[result_id] = result
 
   return results
@@ -0,0 +1,283 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+memcache of search result sets, used by search.search().
+
+Result sets are stored in a compact form rather than as a pickled
+SearchResultSet: the fields of each result are a tuple of values against
+a shared tuple of field names, results refer to each other (merged_list,
+merged_results) by index, and fields that can be recomputed from the
+others are left out when they match.  That is pickled and compressed,
+split across at most MAX_CHUNKS memcache entries, and read back with a
+single get_multi().
+
+The cache key includes the time the search data was last updated, which
+the datahub scripts set through /cache-update (update_cache_key()) after
+loading SOLR.  That is kept in process memory and re-read from the
+datastore every VERSION_REFRESH seconds, not on every lookup.
+"""
+
+import cPickle
+import hashlib
+import logging
+import time
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+import searchresult
+import utils
+
+CACHE_TIME = 24*60*60  # seconds
+# memcache values are limited to 1MB, less a header
+MAX_CHUNK_SZ = (1000000) - 1000
+MAX_CHUNKS = 8
+# change when the stored form changes, so old entries are ignored
+FORMAT_VERSION = 3
+
+VERSION_REFRESH = 60  # seconds
+STATS_KEY_PREFIX = 'result_cache_stats:'
+STAT_NAMES = ['hits', 'misses', 'too_small', 'errors', 'sets', 'too_big',
+              'bytes_read', 'bytes_written']
+
+# SearchResultSet attributes holding lists of results
+RESULT_LISTS = ['results', 'merged_results', 'clipped_results']
+
+# SearchResult fields not stored if they can be rebuilt like this
+DERIVED_FIELDS = {
+  'purged_title': lambda res: searchresult.purge_quotes(res.title),
+  'purged_snippet': lambda res: searchresult.purge_quotes(res.snippet),
+  'categories_str': lambda res: res.categories_to_str(res.categories),
+  'categories_api_str': lambda res: res.categories_to_api_str(res.categories),
+  't_startdate': lambda res: res.startdate.timetuple(),
+}
+
+# the search data version, and when it was last read
+cache_version = None
+cache_version_checked = 0
+
+# cache events, for the admin page
+stats = utils.Stats(STATS_KEY_PREFIX, STAT_NAMES)
+
+
+class CacheUpdate(db.Model):
+  updated = db.DateTimeProperty(auto_now = True)
+
+
+def update_cache_key():
+  """note that the search data changed, so cached result sets are stale.
+  Called from /cache-update; other instances see it within VERSION_REFRESH
+  seconds.  Returns whether it worked."""
+  global cache_version, cache_version_checked
+  try:
+    rec = CacheUpdate.get_or_insert('search')
+    rec.put()
+    cache_version = str(rec.updated)
+    cache_version_checked = time.time()
+  except:
+    logging.warning("update_cache_key failed")
+    return False
+  return True
+
+
+def get_cache_version():
+  """when the search data was last updated, as of VERSION_REFRESH ago."""
+  global cache_version, cache_version_checked
+  now = time.time()
+  if cache_version is None or now - cache_version_checked > VERSION_REFRESH:
+    try:
+      rec = CacheUpdate.get_by_key_name('search')
+      if rec:
+        cache_version = str(rec.updated)
+      else:
+        cache_version = ''
+    except:
+      logging.warning("get_cache_version failed")
+      if cache_version is None:
+        cache_version = ''
+    cache_version_checked = now
+  return cache_version
+
+
+def get_cache_key(normalized_query_string):
+  """key prefix for the chunks of a query's result set."""
+  # note: key cannot exceed 250 bytes
+  rtn = 'search:' + normalized_query_string + get_cache_version()
+  return 'rs%d:%s:' % (FORMAT_VERSION, hashlib.md5(rtn).hexdigest())
+
+
+def get_stats():
+  """totals for every instance, for the admin page."""
+  totals = stats.get()
+  lookups = totals['hits'] + totals['misses']
+  if lookups:
+    totals['hit_percent'] = '%4.1f%%' % ((100.0 * totals['hits']) / lookups)
+  else:
+    totals['hit_percent'] = 'n/a'
+  if totals['sets']:
+    totals['average_size'] = totals['bytes_written'] / totals['sets']
+  else:
+    totals['average_size'] = 0
+  return totals
+
+
+def encode_result_set(result_set):
+  """compact tuple form of a SearchResultSet."""
+  records = []
+  index = {}
+  shapes = []
+  shape_index = {}
+
+  def ref(res):
+    """index of res in records, encoding it on first use."""
+    i = index.get(id(res))
+    if i is None:
+      i = index[id(res)] = len(records)
+      records.append(None)
+      records[i] = encode_result(res)
+    return i
+
+  def encode_result(res):
+    """(shape, values) for one result."""
+    names = []
+    values = []
+    rebuilt = []
+    for name, value in sorted(res.__dict__.iteritems()):
+      if name in DERIVED_FIELDS:
+        try:
+          if value == DERIVED_FIELDS[name](res):
+            rebuilt.append(name)
+            continue
+        except:
+          pass
+      if name == 'merged_list':
+        value = [ref(merged) for merged in value]
+      names.append(name)
+      values.append(value)
+    shape = (tuple(names), tuple(rebuilt))
+    i = shape_index.get(shape)
+    if i is None:
+      i = shape_index[shape] = len(shapes)
+      shapes.append(shape)
+    return (i, tuple(values))
+
+  fields = {}
+  for name, value in result_set.__dict__.iteritems():
+    if name not in RESULT_LISTS:
+      fields[name] = value
+  lists = {}
+  for name in RESULT_LISTS:
+    lists[name] = [ref(res) for res in getattr(result_set, name, [])]
+  return (FORMAT_VERSION, fields, shapes, records, lists)
+
+
+def decode_result_set(data):
+  """SearchResultSet from encode_result_set()."""
+  version, fields, shapes, records, lists = data
+  if version != FORMAT_VERSION:
+    return None
+
+  results = []
+  for i, values in records:
+    res = searchresult.SearchResult.__new__(searchresult.SearchResult)
+    res.__dict__.update(zip(shapes[i][0], values))
+    results.append(res)
+  for res, (i, values) in zip(results, records):
+    if 'merged_list' in res.__dict__:
+      res.merged_list = [results[ref] for ref in res.merged_list]
+    for name in shapes[i][1]:
+      setattr(res, name, DERIVED_FIELDS[name](res))
+
+  result_set = searchresult.SearchResultSet.__new__(
+    searchresult.SearchResultSet)
+  result_set.__dict__.update(fields)
+  for name, refs in lists.iteritems():
+    setattr(result_set, name, [results[ref] for ref in refs])
+  return result_set
+
+
+def get(normalized_query_string):
+  """the cached result set for a query, or None."""
+  prefix = get_cache_key(normalized_query_string)
+  try:
+    chunks = memcache.get_multi([str(i) for i in range(MAX_CHUNKS)],
+                                key_prefix=prefix)
+  except:
+    logging.warning("result_cache.get failed")
+    chunks = {}
+
+  # each chunk is: 8 byte token, number of chunks, data
+  first = chunks.get('0')
+  if not first:
+    stats.record('misses')
+    stats.flush()
+    return None
+
+  token = first[:8]
+  count = int(first[8])
+  pieces = []
+  for i in range(count):
+    chunk = chunks.get(str(i))
+    if not chunk or chunk[:8] != token:
+      # evicted, or overwritten part way through
+      logging.warning('result_set not completely in cache')
+      stats.record('misses')
+      stats.flush()
+      return None
+    pieces.append(chunk[9:])
+  data = ''.join(pieces)
+
+  try:
+    result_set = decode_result_set(cPickle.loads(zlib.decompress(data)))
+  except:
+    logging.warning('result_cache.get could not decode result set')
+    result_set = None
+  if result_set is None:
+    stats.record('errors')
+    stats.record('misses')
+  else:
+    stats.record('hits')
+    stats.record('bytes_read', len(data))
+  stats.flush()
+  return result_set
+
+
+def put(normalized_query_string, result_set):
+  """cache a result set, returns whether it fit."""
+  data = zlib.compress(cPickle.dumps(encode_result_set(result_set),
+                                     cPickle.HIGHEST_PROTOCOL))
+  count = (len(data) + MAX_CHUNK_SZ - 1) / MAX_CHUNK_SZ
+  if count > MAX_CHUNKS:
+    logging.warning('result set too big to cache: %d bytes' % len(data))
+    stats.record('too_big')
+    stats.flush()
+    return False
+
+  token = hashlib.md5(data).hexdigest()[:8]
+  mapping = {}
+  for i in range(count):
+    mapping[str(i)] = (token + str(count) +
+                       data[i * MAX_CHUNK_SZ:(i + 1) * MAX_CHUNK_SZ])
+  try:
+    memcache.set_multi(mapping, time=CACHE_TIME,
+                       key_prefix=get_cache_key(normalized_query_string))
+  except:
+    logging.warning("result_cache.put failed")
+    return False
+  stats.record('sets')
+  stats.record('bytes_written', len(data))
+  stats.flush()
+  return True
@@ -18,10 +18,8 @@ high-level routines for querying backend datastores and processing the results.
 
 import calendar
 import datetime
-import hashlib
 import logging
 import copy
-import pickle
 
 #from versioned_memcache import memcache
 from google.appengine.api import memcache
@@ -29,39 +27,12 @@ from utils import safe_str, safe_int
 
 import api
 import geocode_mapsV3 as geocode
+import result_cache
 import solr_search
 import re
 
-from google.appengine.ext import db
-
 from query_rewriter import get_rewriters
 
-CACHE_TIME = 24*60*60  # seconds
-MAX_CACHE_SZ = (1000000) - 1
-
-class CacheUpdate(db.Model):
-  updated = db.DateTimeProperty(auto_now = True)
-
-
-def update_cache_key():
-  """ """
-  try:
-    rec = CacheUpdate.get_or_insert('search')
-    rec.put()
-  except:
-    logging.warning("update_cache_key failed")
-
-
-def get_cache_key(normalized_query_string, chunk = 0):
-  """ """
-
-  rtn = 'search:' + normalized_query_string
-  rec = CacheUpdate.get_by_key_name('search')
-  if rec:
-    rtn += str(rec.updated)
-
-  return 'chu' + str(chunk) + ':' + hashlib.md5(rtn).hexdigest()
-
 
 def run_query_rewriters(query):
   rewriters = get_rewriters()
@@ -99,7 +70,7 @@ def search(args, dumping = False):
   normalized_query_string = str('&'.join(args_array))
   logging.info('normalized_query_string: ' + normalized_query_string)
 
-  use_cache = False
+  use_cache = True
   if api.PARAM_CACHE in args and args[api.PARAM_CACHE] == '0':
     use_cache = False
     logging.debug('Not using search cache')
@@ -108,31 +79,13 @@ def search(args, dumping = False):
   num = safe_int(args[api.PARAM_NUM], api.CONST_DFLT_NUM)
 
   result_set = None
-  # note: key cannot exceed 250 bytes
-  #memcache_key = get_cache_key(normalized_query_string)
-
   if use_cache:
-    result_set_str = ''
-    chunk = 0
-    while True:
-      logging.info(get_cache_key(normalized_query_string, chunk))
-      buff = memcache.get(get_cache_key(normalized_query_string, chunk))
-      if not buff:
-        break
-      result_set_str += buff
-      chunk += 1
-
-    if result_set_str:
-      try:
-        result_set = pickle.loads(result_set_str)
-      except:
-        logging.warning('result_set not completely in cache')
-        pass
-
+    result_set = result_cache.get(normalized_query_string)
     if result_set:
       logging.debug('in cache: "' + normalized_query_string + '"')
       if len(result_set.merged_results) < start + num:
         logging.debug('but too small-- rerunning query...')
+        result_cache.stats.record('too_small')
         result_set = None
     else:
       logging.debug('not in cache: "' + normalized_query_string + '"')
@@ -140,15 +93,7 @@ def search(args, dumping = False):
   if not result_set:
     result_set = fetch_result_set(args, dumping)
     if result_set:
-      result_set_str = pickle.dumps(result_set)
-      sz = len(result_set_str)
-      chunk = idx = 0
-      while sz > 0:
-        buff = result_set_str[idx:idx + MAX_CACHE_SZ]
-        memcache.set(get_cache_key(normalized_query_string, chunk), buff, time=CACHE_TIME)
-        sz -= MAX_CACHE_SZ
-        idx += MAX_CACHE_SZ
-        chunk += 1
+      result_cache.put(normalized_query_string, result_set)
 
   logging.info('result_set size after dedup: ' + str(result_set.num_merged_results))
 
@@ -48,6 +48,19 @@ def get_rfc2822_datetime(when = None):
     when = time.gmtime()
   return time.strftime("%a, %d %b %Y %H:%M:%S", when) + " +0000"
   
+# month number -> its name, as strftime("%B") gives it
+month_names = {}
+
+def start_date_fields(startdate):
+  """(t_startdate, month_day) for a result starting at startdate: the
+  time tuple dedup() sorts and merges by, and the "Month Day" django
+  shows."""
+  t_startdate = startdate.timetuple()
+  month = month_names.get(t_startdate.tm_mon)
+  if month is None:
+    month = month_names[t_startdate.tm_mon] = time.strftime("%B", t_startdate)
+  return t_startdate, month + " " + str(t_startdate.tm_mday)
+
 def js_escape(string):
   """quote characters appropriately for javascript.
   TODO: This escape method is overly agressive and is messing some snippets
@@ -210,6 +223,10 @@ class SearchResultSet(object):
     self.clip_start_index = 0  # Index at which clipped_results begins.
     self.has_more_results = False  # After clipping, are there more results?
     self.estimated_merged_results = 0
+    # (name, seconds) waited on each backend call
+    self.backend_times = []
+    # solr_search.QueryPlan the results came from
+    self.query_plan = None
     self.pubdate = get_rfc2822_datetime()
     self.last_build_date = self.pubdate
 
@@ -263,95 +280,103 @@ class SearchResultSet(object):
     return self.clip_set(start, num, self.results)
 
 
-  def dedup(self, merge_by_date_and_location):
-    """modify in place, merged by title and snippet."""
+  def assign_merge_keys(self):
+    """private helper function for dedup()"""
+    for res in self.results:
+      # Merge keys are M + md5hash(some stuff). This distinguishes them from
+      # the stable IDs, which are just md5hash(someotherstuff).
+      #res.merge_key = 'M' + hashlib.md5(safe_str(res.title) +
+      #                                  safe_str(res.snippet) +
+      #                                  safe_str(res.location)).hexdigest()
+      res.merge_key = 'M' + hashlib.md5(safe_str(res.title) +
+                                        safe_str(res.snippet)).hexdigest()
+      res.url_sig = utils.signature(res.url + res.merge_key)
+      # we will be sorting & de-duping the merged results
+      # by start date so we need an epoch time, and month_day is used
+      # by django.  solr_search sets both when it decodes the dates.
+      if not hasattr(res, 'month_day'):
+        res.t_startdate, res.month_day = start_date_fields(res.startdate)
+      # this is for the list of any results merged with this one
+      res.merged_list = []
+      res.merged_debug = []
+
+
+  def merge_results(self, merge_by_date_and_location):
+    """build merged_results from results, which must have had
+    assign_merge_keys() run on them.
+
+    Results are looked up by merge_key in a dict, so this is linear in
+    the number of results."""
+    # merge_key -> first merged result with that key
+    primaries = {}
+    # merge_keys whose merged_list already holds a copy of the primary
+    # (same date + url + location); nothing more is merged into those.
+    listed = set()
 
-    def assign_merge_keys():
-      """private helper function for dedup()"""
-      for res in self.results:
-        # Merge keys are M + md5hash(some stuff). This distinguishes them from
-        # the stable IDs, which are just md5hash(someotherstuff).
-        #res.merge_key = 'M' + hashlib.md5(safe_str(res.title) +
-        #                                  safe_str(res.snippet) +
-        #                                  safe_str(res.location)).hexdigest()
-        res.merge_key = 'M' + hashlib.md5(safe_str(res.title) +
-                                          safe_str(res.snippet)).hexdigest()
-        res.url_sig = utils.signature(res.url + res.merge_key)
-        # we will be sorting & de-duping the merged results
-        # by start date so we need an epoch time
-        res.t_startdate = res.startdate.timetuple()
-        # month_day used by django
-        res.month_day = (time.strftime("%B", res.t_startdate) + " " +
-                         str(int(time.strftime("%d", res.t_startdate))))
-        # this is for the list of any results merged with this one
-        res.merged_list = []
-        res.merged_debug = []
-
-    def merge_result(res, merge_by_date_and_location):
-      """private helper function for dedup()"""
-      merged = False
-      for i, primary_result in enumerate(self.merged_results):
-        if primary_result.merge_key == res.merge_key:
-          # merge it
-          listed = False
-          for merged_result in self.merged_results[i].merged_list:
-            # do we already have this date + url + location?
-            if (merged_result.t_startdate == self.merged_results[i].t_startdate and 
-                merged_result.location == self.merged_results[i].location and
-                merged_result.url == self.merged_results[i].url):
-              listed = True
-              break
-          if not listed: # and res.startdate >= datetime.datetime.today():
-            self.merged_results[i].merged_list.append(res)
-            self.merged_results[i].merged_debug.append(res.location + ":" + res.startdate.strftime("%Y-%m-%d"))
-          if not merge_by_date_and_location:
-            merged = False
-          else:
-            merged = True
-          break
-      if not merged:
+    self.merged_results = []
+    for res in self.results:
+      primary_result = primaries.get(res.merge_key)
+      if primary_result is None:
+        primaries[res.merge_key] = res
         self.merged_results.append(res)
-        return True
-      return False
-
-    def compute_more_less():
-      """Now we are making something for the django template to display
-      for the merged list we only show the unique locations and dates
-      but we also use the url if it is unique too
-      for more than 2 extras we will offer "more" and "less"
-      we will be showing the unique dates as "Month Date"."""
-      for i, res in enumerate(self.merged_results):
-        res.idx = i + 1
-        if len(res.merged_list) > 0:
-          res.merged_list.sort(cmp=compare_result_dates)
-          location_was = res.location
-          date_was = res.month_day
-          res.less_list = []
-          if len(res.merged_list) > 2:
-            more_id = "more_" + str(res.idx)
-            res.more_id = more_id
-            res.more_list = []
-
-          more = 0
-          res.have_more = True
-          for merged_result in res.merged_list:
-            entry = ""
-            if merged_result.month_day != date_was:
-              entry += " " + merged_result.month_day
-              date_was = merged_result.month_day
-
-            if merged_result.location != location_was:
-              entry += " " + merged_result.location
-              location_was = merged_result.location
-
-            if len(entry) > 0:
-              if more < 3:
-                res.less_list.append(entry)
-              else:
-                res.more_list.append(entry)
-
-            more += 1
+        continue
+
+      # merge it
+      if res.merge_key not in listed: # and res.startdate >= datetime.datetime.today():
+        primary_result.merged_list.append(res)
+        primary_result.merged_debug.append(res.location + ":" + res.startdate.strftime("%Y-%m-%d"))
+        # do we now have this date + url + location?
+        if (res.t_startdate == primary_result.t_startdate and 
+            res.location == primary_result.location and
+            res.url == primary_result.url):
+          listed.add(res.merge_key)
+      if not merge_by_date_and_location:
+        self.merged_results.append(res)
+
+    self.compute_more_less()
+
+
+  def compute_more_less(self):
+    """Now we are making something for the django template to display
+    for the merged list we only show the unique locations and dates
+    but we also use the url if it is unique too
+    for more than 2 extras we will offer "more" and "less"
+    we will be showing the unique dates as "Month Date"."""
+    for i, res in enumerate(self.merged_results):
+      res.idx = i + 1
+      if len(res.merged_list) > 0:
+        res.merged_list.sort(cmp=compare_result_dates)
+        location_was = res.location
+        date_was = res.month_day
+        res.less_list = []
+        if len(res.merged_list) > 2:
+          more_id = "more_" + str(res.idx)
+          res.more_id = more_id
+          res.more_list = []
+
+        more = 0
+        res.have_more = True
+        for merged_result in res.merged_list:
+          entry = ""
+          if merged_result.month_day != date_was:
+            entry += " " + merged_result.month_day
+            date_was = merged_result.month_day
+
+          if merged_result.location != location_was:
+            entry += " " + merged_result.location
+            location_was = merged_result.location
+
+          if len(entry) > 0:
+            if more < 3:
+              res.less_list.append(entry)
+            else:
+              res.more_list.append(entry)
+
+          more += 1
+
 
+  def dedup(self, merge_by_date_and_location):
+    """modify in place, merged by title and snippet."""
 
     def remove_blacklisted_results():
       """Private helper function for dedup().
@@ -384,11 +409,9 @@ class SearchResultSet(object):
             unknown_keys)
 
     # dedup() main code
-    assign_merge_keys()
+    self.assign_merge_keys()
     remove_blacklisted_results()
-    for res in self.results:
-      merge_result(res, merge_by_date_and_location)
-    compute_more_less()
+    self.merge_results(merge_by_date_and_location)
     if len(self.results) != len(self.merged_results):
       logging.info("dedup: merged %d to %d results" % (len(self.results), len(self.merged_results)))
 
@@ -0,0 +1,130 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+micro-benchmark for SearchResultSet.merge_results() on synthetic result
+sets, compared against the old linear-scan merge.
+
+usage: python searchresult_benchmark.py
+(needs the App Engine SDK on PYTHONPATH, for models)
+"""
+
+import copy
+import datetime
+import os
+import random
+import time
+
+import searchresult
+
+# utils.signature() keys off the app version, which is only set when
+# running under App Engine.
+os.environ.setdefault("CURRENT_VERSION_ID", "benchmark")
+
+SIZES = [1000, 10000]
+# fraction of results that duplicate an earlier result's title+snippet
+DUP_RATIOS = [0.0, 0.5, 0.9]
+LOCATIONS = ["New York, NY", "Chicago, IL", "Austin, TX", "Seattle, WA"]
+
+def make_results(num, dup_ratio, seed=0):
+  """synthetic results, with startdate set as solr_search would."""
+  rnd = random.Random(seed)
+  results = []
+  num_unique = 0
+  for i in range(num):
+    if num_unique == 0 or rnd.random() >= dup_ratio:
+      num_unique += 1
+      title_id = num_unique
+    else:
+      title_id = rnd.randint(1, num_unique)
+    res = searchresult.SearchResult(
+      "http://example.org/opp/%d?l=%d" % (title_id, rnd.randint(0, 3)),
+      "opportunity %d" % title_id, "snippet for opportunity %d" % title_id,
+      rnd.choice(LOCATIONS), str(i), "http://example.org/")
+    res.startdate = (datetime.datetime(2010, 1, 1) +
+                     datetime.timedelta(days=rnd.randint(0, 60)))
+    results.append(res)
+  return results
+
+
+def linear_scan_merge(result_set, merge_by_date_and_location):
+  """the merge from dedup() before it was indexed by merge_key."""
+  result_set.merged_results = []
+  for res in result_set.results:
+    merged = False
+    for i, primary_result in enumerate(result_set.merged_results):
+      if primary_result.merge_key == res.merge_key:
+        listed = False
+        for merged_result in result_set.merged_results[i].merged_list:
+          if (merged_result.t_startdate ==
+              result_set.merged_results[i].t_startdate and 
+              merged_result.location ==
+              result_set.merged_results[i].location and
+              merged_result.url == result_set.merged_results[i].url):
+            listed = True
+            break
+        if not listed:
+          result_set.merged_results[i].merged_list.append(res)
+          result_set.merged_results[i].merged_debug.append(
+            res.location + ":" + res.startdate.strftime("%Y-%m-%d"))
+        merged = merge_by_date_and_location
+        break
+    if not merged:
+      result_set.merged_results.append(res)
+  result_set.compute_more_less()
+
+
+def snapshot(result_set):
+  """what dedup() hands to the templates and writers."""
+  out = []
+  for res in result_set.merged_results:
+    out.append((res.item_id, res.idx,
+                [merged.item_id for merged in res.merged_list],
+                getattr(res, "less_list", None),
+                getattr(res, "more_list", None)))
+  return out
+
+
+def time_merge(merge_func, results, merge_by_date_and_location):
+  """returns (seconds, snapshot) for one merge of a fresh result set.
+  The merges set attributes on the results, so each gets its own copy."""
+  result_set = searchresult.SearchResultSet("", "", copy.deepcopy(results))
+  result_set.assign_merge_keys()
+  start = time.time()
+  merge_func(result_set, merge_by_date_and_location)
+  elapsed = time.time() - start
+  return elapsed, snapshot(result_set)
+
+
+def main():
+  """run each size/duplicate ratio with both merges."""
+  print "%6s %5s %6s %8s %10s %10s %8s" % (
+    "n", "dups", "merge", "merged", "old secs", "new secs", "speedup")
+  for num in SIZES:
+    for dup_ratio in DUP_RATIOS:
+      results = make_results(num, dup_ratio)
+      for merge_by_date_and_location in (True, False):
+        old_secs, old = time_merge(linear_scan_merge, results,
+                                   merge_by_date_and_location)
+        new_secs, new = time_merge(searchresult.SearchResultSet.merge_results,
+                                   results, merge_by_date_and_location)
+        if old != new:
+          raise Exception("merge_results() differs from the linear scan, "
+                          "n=%d dups=%.1f" % (num, dup_ratio))
+        print "%6d %5.1f %6s %8d %10.4f %10.4f %7.1fx" % (
+          num, dup_ratio, merge_by_date_and_location, len(new),
+          old_secs, new_secs, old_secs / max(new_secs, 0.000001))
+
+if __name__ == "__main__":
+  main()
@@ -34,7 +34,6 @@ from operator import itemgetter
 
 import api
 import apiwriter
-import geocode_mapsV3 as geocode
 import ical_filter
 import models
 import modelutils
@@ -42,62 +41,87 @@ import posting
 import private_keys
 import categories
 import searchresult
+import statewide
+import fragment_cache
 import utils
 import ga
 import gzip
 from iso8601 import parse_date
 
 from StringIO import StringIO
-from boosts import *
+import boosts
+
+# optional: distances are computed over arrays with it if it's there
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 RESULT_CACHE_TIME = 900 # seconds
 RESULT_CACHE_KEY = 'searchresult:'
-KEYWORD_GLOBAL = ""
-GEO_GLOBAL = ""
-STATEWIDE_GLOBAL = ""
-NATIONWIDE_GLOBAL = "US"
-PROVIDER_GLOBAL = ""
-FULL_QUERY_GLOBAL = ""
-DATE_QUERY_GLOBAL = ""
-BACKEND_GLOBAL = ""
 
 # Date format pattern used in date ranges.
 DATE_FORMAT_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
 
+# protect against absurd dates
+MIN_START_DATE = datetime.datetime(2000, 1, 1)
+MAX_END_DATE = datetime.datetime(2038, 1, 1)
+
+ACORN_RX = re.compile(r'[^a-z]acorn[^a-z]', re.IGNORECASE)
+
+EARTH_RADIUS_MILES = 3959
+# fewest distinct locations worth handing to numpy
+NUMPY_MIN_POINTS = 32
+
+# SearchResult attributes filled in from the SOLR doc, if the constructor
+# left them unset or empty: lowercased and without repeats.  Names that
+# are also SearchResult class attributes (methods) never count as unset.
+RESULT_FIELD_NAMES = [name for name in utils.unique_list(
+                        [name.lower() for name in apiwriter.STANDARD_FIELDS +
+                         apiwriter.EXELIS_FIELDS + apiwriter.HOC_FIELDS +
+                         apiwriter.CALENDAR_FIELDS])
+                      if not hasattr(searchresult.SearchResult, name)]
+
+# posting.py currently has an authoritative list of fields in "argnames"
+# that are available to submitted events which may later appear in GBase
+# so with a few exceptions we want those same fields to become
+# attributes of our result object: (attribute, SOLR field name) pairs.
+# TODO: fix list in posting.py so it matches solr's fieldnames.
+POSTING_FIELD_NAMES = [(name, name.lower()) for name in posting.argnames
+                       if name not in ["title", "description"]]
+
 # max number of results to ask from SOLR (for latency-- and correctness?)
 MAX_RESULTS = 1000
 
 MILES_PER_DEG = 69
 DEFAULT_VOL_DIST = 75
 
-def apply_boosts(args, original_query = None):
+def bqesc(s):
+  """ wrap a boost query in parentheses and url encode it """
+  # replace "+ signs" with %2B and spaces with "+ signs", leave else alone
+  # maybe like urllib.quote_plus(s.replace('+', '%2B'), '^()[]:*-')
+  s = s.strip()
+  if s[0] != '(':
+    s = '(' + s + ')'
+  return s.replace('+', '%2B').replace(' ', '+')
 
-  def bqesc(s):
-    # replace "+ signs" with %2B and spaces with "+ signs", leave else alone
-    # maybe like urllib.quote_plus(s.replace('+', '%2B'), '^()[]:*-')
-    s = s.strip()
-    if s[0] != '(':
-      s = '(' + s + ')'
-    return s.replace('+', '%2B').replace(' ', '+')
 
+def build_boosts(api_key, category_tags):
+  """ the &bq= param for an api key and the CATEGORY_BOOSTS tags in the
+  query """
   boost = ''
-  for idx, bq in enumerate(DEFAULT_BOOSTS):
+  for idx, bq in enumerate(boosts.DEFAULT_BOOSTS):
     if idx > 0:
       boost += '%20OR%20'
     boost += bqesc(bq)
 
-  if api.PARAM_KEY in args:
-    if args[api.PARAM_KEY] in API_KEY_BOOSTS:
-      if boost != '&bq=':
-        boost += '%20OR%20'
-      boost += bqesc(API_KEY_BOOSTS[args[api.PARAM_KEY]])
+  if api_key in boosts.API_KEY_BOOSTS:
+    boost += '%20OR%20'
+    boost += bqesc(boosts.API_KEY_BOOSTS[api_key])
 
-  if original_query:
-    for k, b in CATEGORY_BOOSTS.items():
-      if original_query.find(k) >= 0:
-        if boost != '&bq=':
-          boost += '%20OR%20'
-        boost += bqesc(b)
+  for tag in category_tags:
+    boost += '%20OR%20'
+    boost += bqesc(boosts.CATEGORY_BOOSTS[tag])
   
   if boost:
     boost = '&bq=(' + boost + ')'
@@ -105,12 +129,22 @@ def apply_boosts(args, original_query = None):
   return boost
 
 
+def apply_boosts(args, original_query = None):
+  """ the &bq= param for a search """
+  category_tags = ()
+  if original_query:
+    category_tags = tuple([tag for tag in boosts.CATEGORY_BOOSTS
+                           if original_query.find(tag) >= 0])
+  return fragment_cache.get('boosts', (args.get(api.PARAM_KEY),
+                                       category_tags), build_boosts)
+
+
 def apply_api_key_query(q, api_key):
   """ api key based query """ 
   rtn = q
 
-  if api_key in API_KEY_QUERIES:
-    rtn = '(%s) AND (%s)' % (q, API_KEY_QUERIES[api_key])
+  if api_key in boosts.API_KEY_QUERIES:
+    rtn = '(%s) AND (%s)' % (q, boosts.API_KEY_QUERIES[api_key])
     
   if rtn != q:
     logging.info(q + '|' + str(api_key) + '|' + rtn)
@@ -118,37 +152,58 @@ def apply_api_key_query(q, api_key):
   return rtn
 
 
+def build_category_rx():
+  """ a regexp matching any of the CATEGORY_QUERIES tags, longest first,
+  and the queries to replace them with """
+  queries = dict(boosts.CATEGORY_QUERIES)
+  if not queries:
+    return (None, queries)
+  tags = sorted(queries.keys(), key=len, reverse=True)
+  return (re.compile('|'.join([re.escape(tag) for tag in tags])), queries)
+
+
 def apply_category_query(q):
   """ in &q= category: may be short hand for a real query """ 
 
   rtn = q
-  for tag, cq in CATEGORY_QUERIES.items():
-    rtn = rtn.replace(tag, cq)
+  category_rx, queries = fragment_cache.get('category_rx', (),
+                                            build_category_rx)
+  if category_rx:
+    rtn = category_rx.sub(lambda match: queries[match.group(0)], rtn)
     
   return rtn.replace('category:', '')
 
 
-def apply_filter_query(api_key, args):
-  """ """
-
+def build_filter_query(api_key):
+  """ the &fq= params from the boosts tables for an api key """
   rtn = ''
-  for fq in FILTER_QUERIES:
+  for fq in boosts.FILTER_QUERIES:
     rtn += '&fq=' + urllib.quote_plus(fq)
 
-  for k,fq in API_KEY_FILTER_QUERIES.items():
+  for k,fq in boosts.API_KEY_FILTER_QUERIES.items():
     if k == api_key:
       rtn += '&fq=' + urllib.quote_plus(fq)
 
-  for k,fq in API_KEY_NEGATED_FILTER_QUERIES.items():
+  for k,fq in boosts.API_KEY_NEGATED_FILTER_QUERIES.items():
     if k != api_key:
       rtn += '&fq=' + urllib.quote_plus(fq)
 
-  given_query = args.get(api.PARAM_Q, '')
-  
+  return rtn
+
+
+EXELIS_INVITATION_FQ = '&fq=' + urllib.quote_plus(
+  '(invitationcode:Exelis OR (*:* AND -invitationcode:[* TO *]))')
+NO_INVITATION_FQ = '&fq=' + urllib.quote_plus('-invitationcode:[* TO *]')
+
+def apply_filter_query(api_key, args):
+  """ """
+
+  rtn = fragment_cache.get('filter_query', (api_key,), build_filter_query)
+
   if not args.get(api.PARAM_INVITATIONCODE, '') and args.get(api.PARAM_KEY, '') == "exelis":
-    rtn += '&fq=' + urllib.quote_plus('(invitationcode:Exelis OR (*:* AND -invitationcode:[* TO *]))')
+    rtn += EXELIS_INVITATION_FQ
   elif not args.get(api.PARAM_INVITATIONCODE, ''):
-    rtn += '&fq=' + urllib.quote_plus('-invitationcode:[* TO *]')
+    rtn += NO_INVITATION_FQ
   else:
     rtn += '&fq=' + urllib.quote_plus('invitationcode_str:' + args.get(api.PARAM_INVITATIONCODE, ''))
 
@@ -210,13 +265,54 @@ def get_solr_backend(args):
     if private_keys.DEFAULT_TO_DEVELOPMENT_NODE:
       args[api.PARAM_BACKEND_URL] = private_keys.NODE3_DEFAULT_BACKEND_URL
 
-  global BACKEND_GLOBAL
-  BACKEND_GLOBAL = args[api.PARAM_BACKEND_URL]
-
   return args[api.PARAM_BACKEND_URL], args
 
 
+class QueryPlan(object):
+  """the SOLR query fragments for one search, url-encoded, shared by the
+  results query and the count and facet queries sent alongside it.
+
+  Built by form_solr_query() and search(), and kept on the result set
+  for apply_HOC_facet_counts().  Read-only: replace() makes a changed
+  copy, so nothing about one search is left in module state for another
+  request, or another thread, to see."""
+
+  # name -> value when not given
+  DEFAULTS = {
+    'backend': '',       # SOLR instance url
+    'query': '',         # the &q= value for the results query
+    'group_query': '',   # &group= params, if results are grouped
+    'fields_query': '',  # &fl= param
+    'keyword': '',       # just the keyword part of query
+    'geo': '',           # {!geofilt} &fq= value for the count queries
+    'statewide': '',     # state of the search location
+    'nationwide': 'US',  # country of the search location
+    'full_query': '',    # query up to the provider and boosts
+    'provider': '',      # provider_proper_name clause for the &q= value
+    'date_query': '',    # event date &fq= param
+  }
+
+  def __init__(self, **fields):
+    for name, default in self.DEFAULTS.iteritems():
+      self.__dict__[name] = fields.pop(name, default)
+    if fields:
+      raise TypeError('unknown QueryPlan fields: ' + ', '.join(fields))
+
+  def __setattr__(self, name, value):
+    raise AttributeError('QueryPlan is read-only')
+
+  def __delattr__(self, name):
+    raise AttributeError('QueryPlan is read-only')
+
+  def replace(self, **changes):
+    """a copy with some fields changed."""
+    fields = self.__dict__.copy()
+    fields.update(changes)
+    return QueryPlan(**fields)
+
+
 def form_solr_query(args):
+  """the QueryPlan for a search, up to its date range."""
   solr_query = ''
 
   api_key = None
@@ -250,19 +346,18 @@ def form_solr_query(args):
   if args.get(api.PARAM_INVITATIONCODE, ''):
       max_dist = 20030
       
-  global GEO_GLOBAL
   geo_params = ('{!geofilt}&pt=%s,%s&sfield=latlong&d=%s&d1=0' 
                    % (str(lat), str(lng), str(max_dist * 1.609))
                )
   geo_params += "&bf=recip(geodist(),1,150,10)"
-  GEO_GLOBAL = geo_params
+  count_geo_params = geo_params
 
   if (args['is_report'] 
       or (args.get(api.PARAM_TYPE) and args.get(api.PARAM_TYPE, None) != "all")
   ):
     geo_params = ""       
     if args['is_report']:
-      GEO_GLOBAL = ''
+      count_geo_params = ''
 
   # Running our keyword through our categories dictionary to see if we need to adjust our keyword param   
   if api.PARAM_CATEGORY in args:
@@ -296,18 +391,21 @@ def form_solr_query(args):
     solr_query += rewrite_query('*:* AND ' + args[api.PARAM_Q], api_key)
     ga.track("API", args.get(api.PARAM_KEY, 'UI'), args[api.PARAM_Q])
   elif api.PARAM_CATEGORY in args:
-    solr_query += rewrite_query('*:* AND ' + args[api.PARAM_CATEGORY], api_key)
+    # these only depend on the category and api key, so are cached
+    solr_query += fragment_cache.get(
+      'rewrite', ('*:* AND ' + args[api.PARAM_CATEGORY], api_key),
+      rewrite_query)
     ga.track("API", args.get(api.PARAM_KEY, 'UI'), args[api.PARAM_CATEGORY])
   else:
     # Query is empty, search for anything at all.
     query_is_empty = True
-    solr_query += rewrite_query('*:*', api_key)
+    solr_query += fragment_cache.get('rewrite', ('*:*', api_key),
+                                     rewrite_query)
     ga.track("API", args.get(api.PARAM_KEY, 'UI'), '*:*')
 
   # geo params go in first
-  global KEYWORD_GLOBAL, STATEWIDE_GLOBAL, NATIONWIDE_GLOBAL
-  KEYWORD_GLOBAL = urllib.quote_plus(solr_query)
-  STATEWIDE_GLOBAL, NATIONWIDE_GLOBAL = geocode.get_statewide(lat, lng)
+  keyword_query = urllib.quote_plus(solr_query)
+  state, country = statewide.get_statewide(lat, lng)
 
   solr_query = urllib.quote_plus(solr_query)
   
@@ -327,7 +425,7 @@ def form_solr_query(args):
       if statewide_param:
         solr_query += urllib.quote_plus(" AND state:" + statewide_param)
       else:
-        solr_query += urllib.quote_plus(" AND (statewide:" + STATEWIDE_GLOBAL + " OR nationwide:" + NATIONWIDE_GLOBAL + ")")
+        solr_query += urllib.quote_plus(" AND (statewide:" + state + " OR nationwide:" + country + ")")
       solr_query += urllib.quote_plus(" AND micro:false AND self_directed:false")
 
     elif args[api.PARAM_TYPE] == "virtual":
@@ -340,16 +438,14 @@ def form_solr_query(args):
     fq += urllib.quote('self_directed:false AND virtual:false AND micro:false')
     solr_query += fq
     
-  global FULL_QUERY_GLOBAL
-  FULL_QUERY_GLOBAL = solr_query
+  full_query = solr_query
     
   # Source
-  global PROVIDER_GLOBAL
   if api.PARAM_SOURCE in args and args[api.PARAM_SOURCE] != "all":    
-    PROVIDER_GLOBAL = urllib.quote_plus(" AND provider_proper_name:(" + args[api.PARAM_SOURCE] + ")")
-    solr_query += PROVIDER_GLOBAL
+    provider_query = urllib.quote_plus(" AND provider_proper_name:(" + args[api.PARAM_SOURCE] + ")")
+    solr_query += provider_query
   else:
-    PROVIDER_GLOBAL = ""  
+    provider_query = ""  
       
   # for ad campaigns
   if api.PARAM_CAMPAIGN_ID in args:
@@ -368,8 +464,7 @@ def form_solr_query(args):
 
   # set the solr instance we need to use if not given as an arg
 
-  global BACKEND_GLOBAL
-  BACKEND_GLOBAL, args = get_solr_backend(args)
+  backend, args = get_solr_backend(args)
   
   solr_query += apply_boosts(args, original_query);
   solr_query += apply_filter_query(api_key, args)
@@ -402,7 +497,10 @@ def form_solr_query(args):
   fields_query = '&fl=*' 
   solr_query += fields_query
 
-  return solr_query, group_query, fields_query
+  return QueryPlan(backend=backend, query=solr_query, group_query=group_query,
+                   fields_query=fields_query, keyword=keyword_query,
+                   geo=count_geo_params, statewide=state, nationwide=country,
+                   full_query=full_query, provider=provider_query)
 
 
 def parseLatLng(val):
@@ -457,7 +555,7 @@ def search(args, dumping = False):
   if not 'is_report' in args:
     args['is_report'] = False
 
-  solr_query, group_query, fields_query = form_solr_query(args)
+  plan = form_solr_query(args)
 
   query_url = args[api.PARAM_BACKEND_URL]
   if query_url.find("?") < 0:
@@ -538,14 +636,13 @@ def search(args, dumping = False):
         except:
           end_datetime_str = None
       
-  global DATE_QUERY_GLOBAL
   if start_datetime_str:
-    DATE_QUERY_GLOBAL = ("&fq=(eventrangeend:[" + start_datetime_str + 
-                         "+TO+*]+AND+eventrangestart:[*+TO+" + end_datetime_str + "])")
-    query_url += DATE_QUERY_GLOBAL
+    date_query = ("&fq=(eventrangeend:[" + start_datetime_str + 
+                  "+TO+*]+AND+eventrangestart:[*+TO+" + end_datetime_str + "])")
   else:
-    DATE_QUERY_GLOBAL = "&fq=(eventrangeend:[NOW-1DAYS%20TO%20*]+OR+expires:[NOW-1DAYS%20TO%20*])"
-    query_url += DATE_QUERY_GLOBAL
+    date_query = "&fq=(eventrangeend:[NOW-1DAYS%20TO%20*]+OR+expires:[NOW-1DAYS%20TO%20*])"
+  plan = plan.replace(date_query=date_query)
+  query_url += date_query
 
   if api.PARAM_NUM in args:
     num_to_fetch = int(args[api.PARAM_NUM]) + 1
@@ -555,7 +652,7 @@ def search(args, dumping = False):
   query_url += "&rows=" + str(num_to_fetch)
   query_url += "&start=" + str(int(args[api.PARAM_START]) - 1)
 
-  query_url += "&q=" + solr_query
+  query_url += "&q=" + plan.query
   if not have_valid_query(args):
     # no query + no location = no results
     result_set = searchresult.SearchResultSet(urllib.unquote(query_url),
@@ -568,12 +665,16 @@ def search(args, dumping = False):
     result_set.estimated_results = 0
     result_set.fetch_time = 0
     result_set.parse_time = 0
+    result_set.query_plan = plan
     return result_set
 
-  results = query(query_url, group_query, fields_query, args, False, dumping)
+  results = query(query_url, plan, args, False, dumping)
   logging.info("SOLR call done: "+str(len(results.results))+
                 " results, fetched in "+str(results.fetch_time)+" secs,"+
                 " parsed in "+str(results.parse_time)+" secs.")
+  logging.info("SOLR backend waits: " +
+               ", ".join(["%s=%.3f" % (name, secs)
+                          for name, secs in results.backend_times]))
 
   # Base doesn't implement day-of-week filtering
   if (api.PARAM_VOL_STARTDAYOFWEEK in args and
@@ -607,6 +708,7 @@ HOC_FACET_FIELD_MAP = {
 def apply_HOC_facet_counts(result_set, args):
 
   node, args = get_solr_backend(args)
+  plan = result_set.query_plan or QueryPlan()
 
   url = node + '?wt=json&q=*:*&rows=0'
   url += '&fq=' + urllib.quote_plus(args.get(api.PARAM_TOCQT, 'feed_providername:handsonnetworkconnect'))
@@ -620,10 +722,10 @@ def apply_HOC_facet_counts(result_set, args):
       logging.warning('solr_search.apply_HOC_facet_counts could not get numFound from ' + url)
 
   url = node + '?wt=json&facet=on&facet.mincount=1&rows=0&indent=on'
-  url += DATE_QUERY_GLOBAL 
+  url += plan.date_query 
   url += '&q=' 
-  url += FULL_QUERY_GLOBAL 
-  url += PROVIDER_GLOBAL 
+  url += plan.full_query 
+  url += plan.provider 
   url += apply_filter_query(args.get(api.PARAM_KEY, ''), args)
   url += '&facet.field=' + '&facet.field='.join(HOC_FACET_FIELDS)
 
@@ -640,11 +742,21 @@ def apply_HOC_facet_counts(result_set, args):
   return result_set
 
 
-def get_solr_count(given_query, args):
+def start_fetch(url, deadline=api.CONST_MAX_FETCH_DEADLINE):
+  """start an asynchronous urlfetch; rpc.get_result() waits for it, so
+  several backend queries can be in flight at once."""
+  rpc = urlfetch.create_rpc(deadline=deadline)
+  urlfetch.make_fetch_call(rpc, url)
+  return rpc
 
-  rtn = 0
 
-  json_object = None
+def add_backend_time(result_set, name, start):
+  """note how long the request waited on one backend call."""
+  result_set.backend_times.append((name, time.time() - start))
+
+
+def start_solr_count(given_query, args):
+  """send the count query for get_solr_count()."""
   node, args = get_solr_backend(args)
 
   query = given_query.replace(node, '').replace('?&wt=json', '')
@@ -660,8 +772,22 @@ def get_solr_count(given_query, args):
   #print url
   #sys.exit(0)
 
-  fetch_result = urlfetch.fetch(url)
   logging.info('solr_search.get_solr_count: ' + url)
+  rpc = start_fetch(url, None)
+  rpc.solr_url = url
+  return rpc
+
+
+def get_solr_count(given_query, args, rpc=None):
+
+  rtn = 0
+
+  json_object = None
+  if not rpc:
+    rpc = start_solr_count(given_query, args)
+  url = rpc.solr_url
+
+  fetch_result = rpc.get_result()
   if fetch_result.status_code == 200:
     try:
       json_object = simplejson.loads(fetch_result.content)
@@ -710,13 +836,263 @@ def calc_distance(lat1, lon1, lat2, lon2 ):
  #                + "," + str(lon2) )
     return d
 
-def query(query_url, group_query, fields_query, args, cache, dumping = False):
+def parse_solr_datetime(value):
+  """datetime for a DATE_FORMAT_PATTERN match, like
+  strptime(value, '%Y-%m-%dT%H:%M:%S') but without the format parsing:
+  the digits are sliced out at their fixed offsets and read as one
+  number.  Raises ValueError if they aren't all digits."""
+  digits = (value[0:4] + value[5:7] + value[8:10] + value[11:13] +
+            value[14:16] + value[17:19])
+  if not digits.isdigit():
+    raise ValueError('not a SOLR date: %r' % value)
+  number = int(digits)
+  return datetime.datetime(number // 10000000000, number // 100000000 % 100,
+                           number // 1000000 % 100, number // 10000 % 100,
+                           number // 100 % 100, number % 100)
+
+
+def calc_distances(lat, lng, points):
+  """calc_distance() from (lat, lng) to each of points, a list of
+  (lat, lng) pairs.  Over numpy arrays if numpy is there and there are
+  enough points, otherwise with the cosine of lat worked out once."""
+  if numpy is not None and len(points) >= NUMPY_MIN_POINTS:
+    lats = numpy.array([point[0] for point in points])
+    lngs = numpy.array([point[1] for point in points])
+    a = (numpy.sin(numpy.radians(lats - lat) / 2) ** 2 +
+         math.cos(math.radians(lat)) * numpy.cos(numpy.radians(lats)) *
+         numpy.sin(numpy.radians(lngs - lng) / 2) ** 2)
+    return (EARTH_RADIUS_MILES * (2 * numpy.arcsin(numpy.sqrt(a)))).tolist()
+
+  cos_lat = math.cos(math.radians(lat))
+  distances = []
+  for lat2, lng2 in points:
+    a = (math.sin(math.radians(lat2 - lat) / 2) ** 2 +
+         cos_lat * math.cos(math.radians(lat2)) *
+         math.sin(math.radians(lng2 - lng) / 2) ** 2)
+    distances.append(EARTH_RADIUS_MILES * (2 * math.asin(math.sqrt(a))))
+  return distances
+
+
+def decode_date_range(value):
+  """(startdate, enddate, duration) for an event_date_range, clamped to
+  MIN_START_DATE..MAX_END_DATE, or None if it has no dates.  SOLR writes
+  one date, or two with a space between, at fixed offsets: those are
+  sliced out.  Anything else is searched with DATE_FORMAT_PATTERN."""
+  first = last = None
+  if len(value) == 19 and value[4:17:3] == '--T::':
+    first = last = value
+  elif (len(value) == 39 and value[4:17:3] == '--T::' and
+        value[19] == ' ' and value[24:37:3] == '--T::'):
+    first, last = value[:19], value[20:]
+
+  startdate = None
+  if first:
+    try:
+      startdate = parse_solr_datetime(first)
+      enddate = parse_solr_datetime(last)
+    except ValueError:
+      startdate = None
+  if startdate is None:
+    match = DATE_FORMAT_PATTERN.findall(value)
+    if not match:
+      return None
+    # first match is start date/time, last is end date/time or start
+    # date/time
+    startdate = parse_solr_datetime(match[0])
+    enddate = parse_solr_datetime(match[-1])
+
+  # protect against absurd dates
+  if startdate < MIN_START_DATE:
+    startdate = MIN_START_DATE
+  if enddate > MAX_END_DATE:
+    enddate = MAX_END_DATE
+  return startdate, enddate, str((enddate - startdate).days)
+
+
+def decode_docs(doc_list, args, dumping = False):
+  """the coordinates and dates of all of a SOLR response's docs, decoded
+  in one pass for add_results().  Returns (distances, date_ranges):
+  distances[i] is doc i's distance from the search location as a str,
+  or ''; date_ranges maps each event_date_range to decode_date_range()
+  plus searchresult.start_date_fields() of the start date, or None.
+  Locations, ranges and start dates repeat a lot in a response, so each
+  is only decoded once."""
+  points = []
+  point_index = {}
+  doc_points = []
+  for entry in doc_list:
+    latstr = entry.get("latitude")
+    longstr = entry.get("longitude")
+    point = None
+    if latstr and longstr:
+      try:
+        point = (float(latstr), float(longstr))
+      except:
+        pass
+    if point is not None and point not in point_index:
+      point_index[point] = len(points)
+      points.append(point)
+    doc_points.append(point)
+
+  distances = [''] * len(doc_list)
+  if points:
+    try:
+      lat = float(args[api.PARAM_LAT])
+      lng = float(args[api.PARAM_LNG])
+    except:
+      lat = lng = None
+    if lat is not None:
+      point_distances = [str(distance) for distance in
+                         calc_distances(lat, lng, points)]
+      for i, point in enumerate(doc_points):
+        if point is not None:
+          distances[i] = point_distances[point_index[point]]
+
+  date_ranges = {}
+  start_fields = {}
+  if not dumping:
+    for entry in doc_list:
+      value = entry.get("event_date_range")
+      if not value or value in date_ranges:
+        continue
+      dates = decode_date_range(value)
+      if dates:
+        fields = start_fields.get(dates[0])
+        if fields is None:
+          fields = start_fields[dates[0]] = searchresult.start_date_fields(
+            dates[0])
+        dates = dates + fields
+      date_ranges[value] = dates
+  return distances, date_ranges
+
+
+# start_date_fields() of MIN_START_DATE, for results without dates
+MIN_START_DATE_FIELDS = searchresult.start_date_fields(MIN_START_DATE)
+
+
+def add_results(result_set, doc_list, result_content, args, cache,
+                dumping = False):
+  """make SearchResults from a SOLR response's docs."""
+  # does the response mention ACORN?  only looked for if need be.
+  content_mentions_acorn = None
+
+  distances, date_ranges = decode_docs(doc_list, args, dumping)
+  for i, entry in enumerate(doc_list):
+    if not "detailurl" in entry:
+      # URL is required 
+      latstr = entry["latitude"]
+      longstr = entry["longitude"]
+      if latstr and longstr and latstr != "" and longstr != "":
+        entry["detailurl"] = "http://maps.google.com/maps?q=" + str(latstr) + "," + str(longstr)
+      else:
+        logging.info('solr_search.query skipping SOLR record' +
+                      ' %d: detailurl is missing...' % i)
+        continue
+
+    url = entry["detailurl"]
+    # ID is the 'stable id' of the item generated by base.
+    # Note that this is not the base url expressed as the Atom id element.
+    item_id = entry["id"]
+    # Base URL is the url of the item in base. For Solr we just use the ID hash
+    base_url = item_id
+    snippet = entry.get('description', '')
+    title = entry.get('title', '')
+    location = entry.get('location_string', '')
+
+    categories = entry.get('categories', '')
+    if type(categories).__name__ != 'list':
+      try:
+        categories = categories.split(',')
+      except:
+        categories = []
+
+    vetted = False
+    if 'Vetted' in categories:
+      vetted = True
+
+    is_501c3 = False
+    if entry.get('is_501c3', ''):
+      is_501c3 = True
+
+    org_name = entry.get('org_name', '')
+    if ACORN_RX.search(" "+org_name+" "):
+      logging.debug('solr_search.query skipping: ACORN in org_name')
+      continue
+
+    latstr = entry["latitude"]
+    longstr = entry["longitude"]
+    virtual = entry.get('virtual')
+    self_directed = entry.get("self_directed")
+    micro = entry.get("micro")
+    volunteers_needed = entry.get("volunteersneeded")
+
+    res = searchresult.SearchResult(url, title, snippet, location, item_id,
+                                    base_url, volunteers_needed, virtual,
+                                    self_directed, micro, categories, org_name, 
+                                    vetted, is_501c3)
+
+    # TODO: escape?
+    res.provider = entry["feed_providername"]
+    if res.provider == "myproj_servegov" and content_mentions_acorn is None:
+      content_mentions_acorn = bool(ACORN_RX.search(" "+result_content+" "))
+    if res.provider == "myproj_servegov" and content_mentions_acorn:
+      # per-provider rule because case-insensitivity
+      logging.info('solr_search.query skipping: ACORN in for myproj_servegov')
+      continue
+
+    res.orig_idx = i+1
+
+    res.latlong = ""
+    res.distance = distances[i]
+    res.duration = ''
+    if latstr and longstr:
+      res.latlong = str(latstr) + "," + str(longstr)
+
+    # res.event_date_range follows one of these two formats:
+    #     <start_date>T<start_time> <end_date>T<end_time>
+    #     <date>T<time>
+    res.event_date_range = entry["event_date_range"]
+    res.startdate = MIN_START_DATE
+    res.enddate = MAX_END_DATE
+    res.t_startdate, res.month_day = MIN_START_DATE_FIELDS
+    if not dumping and res.event_date_range:
+      dates = date_ranges.get(res.event_date_range)
+      if not dates:
+        logging.debug('solr_search.query skipping record' +
+                        ' %d: bad date range: %s for %s' % 
+                        (i, res.event_date_range, url))
+        continue
+      (res.startdate, res.enddate, res.duration,
+       res.t_startdate, res.month_day) = dates
+
+    # set straight into the instance dict: these are plain attributes
+    fields = res.__dict__
+    for name in RESULT_FIELD_NAMES:
+      if not fields.get(name):
+        value = entry.get(name, '')
+        if not isinstance(value, list):
+          fields[name] = str(value)
+        else:
+          fields[name] = '\t'.join(value)
+    
+    for name, solr_name in POSTING_FIELD_NAMES:
+      if solr_name in entry:
+        fields[name] = entry[solr_name]
+
+    result_set.results.append(res)
+    if cache and res.item_id:
+      key = RESULT_CACHE_KEY + res.item_id
+      memcache.set(key, res, time=RESULT_CACHE_TIME)
+
+
+def query(query_url, plan, args, cache, dumping = False):
   """run the actual SOLR query (no filtering or sorting)."""
   logging.debug("Query URL: " + query_url + '&debugQuery=on')
   result_set = searchresult.SearchResultSet(urllib.unquote(query_url),
                                             query_url, [])
 
   result_set.query_url = query_url
+  result_set.query_plan = plan
   result_set.args = args
   result_set.fetch_time = 0
   result_set.parse_time = 0
@@ -731,6 +1107,20 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
   else:
     need_facet_counts = False
 
+  # the count and facet queries don't depend on the results, so send them
+  # all now and collect them after the results query, rather than making
+  # one round trip after another
+  count_rpcs = {}
+  if need_facet_counts:
+    count_rpcs['geo_counts'] = start_geo_counts(plan, args, api_key)
+    count_rpcs['type_counts'] = start_type_counts(plan, args, api_key)
+    count_rpcs['facet_counts'] = start_facet_counts(plan, api_key, args)
+  if plan.group_query:
+    count_query = query_url.replace(plan.fields_query, '')
+    count_rpcs['backend_count'] = start_solr_count(
+      count_query.replace(plan.group_query, ''), args)
+    count_rpcs['merged_count'] = start_solr_count(count_query, args)
+
   if api_key == 'UI': #For UI searches make two queries one gruoupped by opportunityid to retrieve the VOs IDs and the second to retrieve the dates.
       # The reason is that because of occurrences pagination can not be kept managed solely by rows.
     facetOppsQuery = re.sub('fl=([*,a-z])','fl=opportunityid,feed_providername,event_date_range,title,description,detailurl,latitude,longitude,categorytags&group=true&group.field=opportunityid&group.main=true&group.format=simple',ui_query_url)
@@ -738,7 +1128,9 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
         logging.info("calling SOLR for facetOppsQuery: " + facetOppsQuery)
         facetOppsQuery += '&r=' + str(random.random())
         #fetch_result = urlfetch.fetch(facetOppsQuery, deadline = api.CONST_MAX_FETCH_DEADLINE, headers={"accept-encoding":"gzip"},)
+        query_start = time.time()
         fetch_result = urlfetch.fetch(facetOppsQuery, deadline = api.CONST_MAX_FETCH_DEADLINE,)
+        add_backend_time(result_set, 'opportunities', query_start)
         logging.info("calling SOLR for facetOppsQuery headers: %s " % str(fetch_result.header_msg.getheaders('content-encoding')))
         status_code = fetch_result.status_code
         
@@ -777,7 +1169,9 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
   try:
     logging.info("calling SOLR: " + ui_query_url)
     ui_query_url += '&r=' + str(random.random())
+    query_start = time.time()
     fetch_result = urlfetch.fetch(ui_query_url, deadline = api.CONST_MAX_FETCH_DEADLINE, headers={"accept-encoding":"gzip"},)
+    add_backend_time(result_set, 'results', query_start)
     #fetch_result = urlfetch.fetch(ui_query_url, deadline = api.CONST_MAX_FETCH_DEADLINE,)
     logging.info("calling SOLR headers: %s " % str(fetch_result.header_msg.getheaders('content-encoding')))
     status_code = fetch_result.status_code
@@ -813,7 +1207,10 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
   
   all_facets = None
   if need_facet_counts:
-    all_facets = get_geo_counts(args, api_key)
+    wait_start = time.time()
+    all_facets = get_geo_counts(plan, args, api_key,
+                                count_rpcs['geo_counts'])
+    add_backend_time(result_set, 'geo_counts', wait_start)
 
   if not all_facets or not "facet_counts" in all_facets:    
       result_set.facet_counts = None
@@ -824,7 +1221,10 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
       ks += " AND -statewide:[* TO *] AND -nationwide:[* TO *]"
     facet_counts["all"] = int(all_facets["facet_counts"]["facet_queries"][ks])
 
-    facet_counts.update(get_type_counts(args, api_key))    
+    wait_start = time.time()
+    facet_counts.update(get_type_counts(plan, args, api_key,
+                                        count_rpcs['type_counts']))
+    add_backend_time(result_set, 'type_counts', wait_start)
     count = 0;
     if api.PARAM_TYPE in args:
       if args[api.PARAM_TYPE] == "statewide":
@@ -840,152 +1240,27 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
 
     facet_counts["count"] = count
     result_set.facet_counts = facet_counts
-    facets = get_facet_counts(api_key, args)
+    wait_start = time.time()
+    facets = get_facet_counts(plan, api_key, args,
+                              count_rpcs['facet_counts'])
+    add_backend_time(result_set, 'facet_counts', wait_start)
     result_set.categories = facets['category_fields']
     result_set.providers = facets['provider_fields']
     
-  doc_list = result["response"]["docs"]
-  
-  #process json doc list
-  for i, entry in enumerate(doc_list):
-    if not "detailurl" in entry:
-      # URL is required 
-      latstr = entry["latitude"]
-      longstr = entry["longitude"]
-      if latstr and longstr and latstr != "" and longstr != "":
-        entry["detailurl"] = "http://maps.google.com/maps?q=" + str(latstr) + "," + str(longstr)
-      else:
-        logging.info('solr_search.query skipping SOLR record' +
-                      ' %d: detailurl is missing...' % i)
-        continue
-
-    url = entry["detailurl"]
-    # ID is the 'stable id' of the item generated by base.
-    # Note that this is not the base url expressed as the Atom id element.
-    item_id = entry["id"]
-    # Base URL is the url of the item in base. For Solr we just use the ID hash
-    base_url = item_id
-    snippet = entry.get('description', '')
-    title = entry.get('title', '')
-    location = entry.get('location_string', '')
-
-    categories = entry.get('categories', '')
-    if type(categories).__name__ != 'list':
-      try:
-        categories = categories.split(',')
-      except:
-        categories = []
-
-    vetted = False
-    if 'Vetted' in categories:
-      vetted = True
-
-    is_501c3 = False
-    if entry.get('is_501c3', ''):
-      is_501c3 = True
-
-    org_name = entry.get('org_name', '')
-    if re.search(r'[^a-z]acorn[^a-z]', " "+org_name+" ", re.IGNORECASE):
-      logging.debug('solr_search.query skipping: ACORN in org_name')
-      continue
-
-    latstr = entry["latitude"]
-    longstr = entry["longitude"]
-    virtual = entry.get('virtual')
-    self_directed = entry.get("self_directed")
-    micro = entry.get("micro")
-    volunteers_needed = entry.get("volunteersneeded")
-
-    res = searchresult.SearchResult(url, title, snippet, location, item_id,
-                                    base_url, volunteers_needed, virtual,
-                                    self_directed, micro, categories, org_name, 
-                                    vetted, is_501c3)
-
-    # TODO: escape?
-    res.provider = entry["feed_providername"]
-    if (res.provider == "myproj_servegov" and
-        re.search(r'[^a-z]acorn[^a-z]', " "+result_content+" ", re.IGNORECASE)):
-      # per-provider rule because case-insensitivity
-      logging.info('solr_search.query skipping: ACORN in for myproj_servegov')
-      continue
-
-    res.orig_idx = i+1
-
-    res.latlong = ""
-    res.distance = ''
-    res.duration = ''
-    if latstr and longstr:
-      res.latlong = str(latstr) + "," + str(longstr)
-      try:
-        res.distance = str(calc_distance(float(args[api.PARAM_LAT])
-                                              , float(args[api.PARAM_LNG])
-                                              , float(latstr)
-                                              , float(longstr)))
-      except:
-        pass
-
-    # res.event_date_range follows one of these two formats:
-    #     <start_date>T<start_time> <end_date>T<end_time>
-    #     <date>T<time>
-    res.event_date_range = entry["event_date_range"]
-    res.startdate = datetime.datetime.strptime("2000-01-01", "%Y-%m-%d")
-    res.enddate = datetime.datetime.strptime("2038-01-01", "%Y-%m-%d")
-    if not dumping and res.event_date_range:
-      match = DATE_FORMAT_PATTERN.findall(res.event_date_range)
-      if not match:
-        logging.debug('solr_search.query skipping record' +
-                        ' %d: bad date range: %s for %s' % 
-                        (i, res.event_date_range, url))
-        continue
-      else:
-        # first match is start date/time
-        startdate = datetime.datetime.strptime(match[0], '%Y-%m-%dT%H:%M:%S')
-        # last match is either end date/time or start/date time
-        enddate = datetime.datetime.strptime(match[-1], '%Y-%m-%dT%H:%M:%S')
-        # protect against absurd dates
-        if startdate > res.startdate:
-          res.startdate = startdate
-        if enddate < res.enddate:
-          res.enddate = enddate
-
-        if res.startdate and res.enddate:
-          delta = res.enddate - res.startdate
-          res.duration = str(delta.days)
-
-    for name in utils.unique_list(apiwriter.STANDARD_FIELDS + apiwriter.EXELIS_FIELDS + apiwriter.HOC_FIELDS + apiwriter.CALENDAR_FIELDS):
-      name = name.lower()
-      if len(name) >= 2 and not hasattr(res, name) or not getattr(res, name, None):
-        value = entry.get(name, '')
-        if not isinstance(value, list):
-          setattr(res, name, str(value))
-        else:
-          setattr(res, name, '\t'.join(value))
-    
-    # posting.py currently has an authoritative list of fields in "argnames"
-    # that are available to submitted events which may later appear in GBase
-    # so with a few exceptions we want those same fields to become
-    # attributes of our result object
-    except_names = ["title", "description"]
-    for name in posting.argnames:
-      if name not in except_names and name.lower() in entry:
-        # Solr field names are all lowercase.
-        # TODO: fix list in posting.py so it matches solr's fieldnames.
-        setattr(res, name, entry[name.lower()])
-
-    result_set.results.append(res)
-    if cache and res.item_id:
-      key = RESULT_CACHE_KEY + res.item_id
-      memcache.set(key, res, time=RESULT_CACHE_TIME)
+  add_results(result_set, result["response"]["docs"], result_content, args,
+              cache, dumping)
 
   result_set.num_results = len(result_set.results)
   result_set.total_match = int(result["response"]["numFound"])
   result_set.merged_count = result_set.backend_count = result_set.estimated_results = result_set.total_match
 
-  if group_query:
-    cq = query_url.replace(fields_query, '').replace(group_query, '')
-    result_set.backend_count = get_solr_count(cq, args)
-    cq = query_url.replace(fields_query, '')
-    result_set.merged_count = get_solr_count(cq, args)
+  if plan.group_query:
+    wait_start = time.time()
+    result_set.backend_count = get_solr_count(None, args,
+                                              count_rpcs['backend_count'])
+    result_set.merged_count = get_solr_count(None, args,
+                                             count_rpcs['merged_count'])
+    add_backend_time(result_set, 'counts', wait_start)
 
   parse_end = time.time()
   result_set.parse_time = parse_end - parse_start
@@ -993,18 +1268,16 @@ def query(query_url, group_query, fields_query, args, cache, dumping = False):
   return result_set
 
 
-def get_facet_counts(api_key, args):
-  """ get the category/provider counts to be displayed in refine by section """
+def start_facet_counts(plan, api_key, args):
+  """ send the query for get_facet_counts() """
 
-  category_fields = dict()
-  provider_fields = []
   query = []
 
   for key, val in categories.CATEGORIES.iteritems():
     query.append("facet.query=" + urllib.quote_plus(key))  
 
-  query_url = (BACKEND_GLOBAL + '?wt=json' + DATE_QUERY_GLOBAL 
-            + '&q=' + FULL_QUERY_GLOBAL + PROVIDER_GLOBAL + '&fq=' + GEO_GLOBAL
+  query_url = (plan.backend + '?wt=json' + plan.date_query 
+            + '&q=' + plan.full_query + plan.provider + '&fq=' + plan.geo
             + '&facet.mincount=1&facet.field=provider_proper_name_str&facet=on&rows=0&' + "&".join(query))
 
   query_url += apply_filter_query(api_key, args)
@@ -1012,7 +1285,22 @@ def get_facet_counts(api_key, args):
   logging.info("get_facet_counts: " + query_url)
 
   try:
-    fetch_result = urlfetch.fetch(query_url, deadline = api.CONST_MAX_FETCH_DEADLINE)
+    return start_fetch(query_url)
+  except:
+    logging.error('get_facet_counts: error receiving solr facet counts')
+    sys.exit(0)
+
+
+def get_facet_counts(plan, api_key, args, rpc=None):
+  """ get the category/provider counts to be displayed in refine by section """
+
+  category_fields = dict()
+  provider_fields = []
+
+  if not rpc:
+    rpc = start_facet_counts(plan, api_key, args)
+  try:
+    fetch_result = rpc.get_result()
   except:
     logging.error('get_facet_counts: error receiving solr facet counts')
     sys.exit(0)
@@ -1038,11 +1326,11 @@ def get_facet_counts(api_key, args):
           key=itemgetter(1), reverse=True), 'provider_fields': provider_fields}    
 
 
-def get_geo_counts(args, api_key):
-  """ get counts to be displayed in the tabs across top """
+def start_geo_counts(plan, args, api_key):
+  """ send the query for get_geo_counts() """
 
-  query_url = (BACKEND_GLOBAL + '?wt=json' + DATE_QUERY_GLOBAL 
-               + '&fq=' + GEO_GLOBAL + '&q=' + KEYWORD_GLOBAL + PROVIDER_GLOBAL 
+  query_url = (plan.backend + '?wt=json' + plan.date_query 
+               + '&fq=' + plan.geo + '&q=' + plan.keyword + plan.provider 
                + '&facet=on&facet.mincount=1&rows=0'
                + '&facet.query=self_directed:false+AND+virtual:false+AND+micro:false'
               )
@@ -1054,7 +1342,19 @@ def get_geo_counts(args, api_key):
   logging.info("get_geo_counts: " + query_url)
 
   try:
-    fetch_result = urlfetch.fetch(query_url, deadline = api.CONST_MAX_FETCH_DEADLINE)
+    return start_fetch(query_url)
+  except:
+    logging.error('get_geo_counts: error receiving solr facet counts')
+    sys.exit(0)
+
+
+def get_geo_counts(plan, args, api_key, rpc=None):
+  """ get counts to be displayed in the tabs across top """
+
+  if not rpc:
+    rpc = start_geo_counts(plan, args, api_key)
+  try:
+    fetch_result = rpc.get_result()
   except:
     logging.error('get_geo_counts: error receiving solr facet counts')
     sys.exit(0)
@@ -1069,11 +1369,11 @@ def get_geo_counts(args, api_key):
   return simplejson.loads(result_content)
 
 
-def get_type_counts(args, api_key):
-  """ tabs: my area, statewide, virtual, micro """
+def start_type_counts(plan, args, api_key):
+  """ send the query for get_type_counts() """
 
-  query_url = (BACKEND_GLOBAL + '?wt=json' 
-               + DATE_QUERY_GLOBAL + '&q=' + KEYWORD_GLOBAL + PROVIDER_GLOBAL 
+  query_url = (plan.backend + '?wt=json' 
+               + plan.date_query + '&q=' + plan.keyword + plan.provider 
                + '&facet=on&facet.limit=100' 
                + '&facet.field=virtual&facet.field=self_directed&facet.field=micro&rows=0'
                + '&facet.field=statewide&facet.field=nationwide'
@@ -1083,7 +1383,19 @@ def get_type_counts(args, api_key):
   logging.info("get_type_counts: " + query_url)
 
   try:
-    fetch_result = urlfetch.fetch(query_url, deadline = api.CONST_MAX_FETCH_DEADLINE)
+    return start_fetch(query_url)
+  except:
+    logging.error('get_type_counts: error receiving solr facet counts')
+    sys.exit(0)
+
+
+def get_type_counts(plan, args, api_key, rpc=None):
+  """ tabs: my area, statewide, virtual, micro """
+
+  if not rpc:
+    rpc = start_type_counts(plan, args, api_key)
+  try:
+    fetch_result = rpc.get_result()
   except:
     logging.error('get_type_counts: error receiving solr facet counts')
     sys.exit(0)
@@ -1096,19 +1408,19 @@ def get_type_counts(args, api_key):
     facet_fields = result["facet_counts"]["facet_fields"]
     facet_counts = dict()
     for k, v in facet_fields.iteritems():
-      if k == "nationwide" and NATIONWIDE_GLOBAL:
+      if k == "nationwide" and plan.nationwide:
         facet_counts[k] = 0
         for idx, st in enumerate(facet_fields["nationwide"]):
-          if st == NATIONWIDE_GLOBAL:
+          if st == plan.nationwide:
             try:
               facet_counts[k] = facet_fields["nationwide"][idx + 1]
             except:
               pass
             break
-      elif k == "statewide" and STATEWIDE_GLOBAL:
+      elif k == "statewide" and plan.statewide:
         facet_counts[k] = 0
         for idx, st in enumerate(facet_fields["statewide"]):
-          if st == STATEWIDE_GLOBAL:
+          if st == plan.statewide:
             try:
               facet_counts[k] = facet_fields["statewide"][idx + 1]
             except:
@@ -0,0 +1,276 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+micro-benchmark for turning a SOLR response into SearchResults
+(solr_search.add_results) on a canned 1000-doc response and giving them
+merge keys (SearchResultSet.assign_merge_keys, the start of dedup),
+compared against the old per-doc field, distance and date loops.
+
+usage: python solr_search_benchmark.py
+(needs the App Engine SDK and private_keys.py on PYTHONPATH)
+"""
+
+import datetime
+import logging
+import os
+import random
+import re
+import time
+
+from django.utils import simplejson
+
+import api
+import apiwriter
+import posting
+import searchresult
+import solr_search
+import utils
+
+# utils.signature() keys off the app version, which is only set when
+# running under App Engine.
+os.environ.setdefault("CURRENT_VERSION_ID", "benchmark")
+
+NUM_DOCS = 1000
+ROUNDS = 5
+PROVIDERS = ["handsonnetwork", "idealist", "volunteermatch", "myproj_servegov"]
+CATEGORIES = ["Education", "Animals", "Health", "Vetted"]
+CITIES = [("New York", "NY", 40.71, -74.01), ("Chicago", "IL", 41.88, -87.63),
+          ("Austin", "TX", 30.27, -97.74), ("Seattle", "WA", 47.61, -122.33)]
+
+def make_response(num=NUM_DOCS, seed=0):
+  """a SOLR json response with num docs, as solr_search.query gets it."""
+  rnd = random.Random(seed)
+  docs = []
+  for i in range(num):
+    city, state, lat, lng = rnd.choice(CITIES)
+    start = (datetime.datetime(2011, 1, 1) +
+             datetime.timedelta(days=rnd.randint(0, 365),
+                                hours=rnd.randint(0, 12)))
+    end = start + datetime.timedelta(hours=rnd.randint(1, 72))
+    doc = {
+      "id": "%032x" % rnd.getrandbits(128),
+      "detailurl": "http://example.org/opp/%d" % i,
+      "title": "opportunity %d" % i,
+      "description": "description of opportunity %d; " % i * 5,
+      "location_string": "%s, %s" % (city, state),
+      "categories": [",".join(rnd.sample(CATEGORIES, 2))],
+      "org_name": "organization %d" % rnd.randint(0, 200),
+      "latitude": lat + rnd.random() / 10,
+      "longitude": lng + rnd.random() / 10,
+      "feed_providername": rnd.choice(PROVIDERS),
+      "event_date_range": "%s %s" % (start.strftime("%Y-%m-%dT%H:%M:%S"),
+                                     end.strftime("%Y-%m-%dT%H:%M:%S")),
+      "city": city,
+      "state": state,
+      "zip": "%05d" % rnd.randint(10000, 99999),
+      "country": "US",
+      "skills": "skill %d" % rnd.randint(0, 20),
+      "contactemail": "contact%d@example.org" % i,
+      "contactphone": "",
+      "opportunityid": "opp%d" % i,
+      "volunteersslots": rnd.randint(0, 40),
+      "audiencetags": ["Teens", "Seniors"][:rnd.randint(0, 2)],
+      "eventrangestart": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+      "eventrangeend": end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+      "startdate": start.strftime("%Y-%m-%d"),
+      "virtual": rnd.random() < 0.1,
+    }
+    docs.append(doc)
+  return simplejson.dumps({"response": {"numFound": num, "start": 0,
+                                        "docs": docs}})
+
+
+def old_add_results(result_set, doc_list, result_content, args, cache,
+                    dumping = False):
+  """the doc loop from solr_search.query before add_results()."""
+  for i, entry in enumerate(doc_list):
+    if not "detailurl" in entry:
+      # URL is required 
+      latstr = entry["latitude"]
+      longstr = entry["longitude"]
+      if latstr and longstr and latstr != "" and longstr != "":
+        entry["detailurl"] = "http://maps.google.com/maps?q=" + str(latstr) + "," + str(longstr)
+      else:
+        logging.info('solr_search.query skipping SOLR record' +
+                      ' %d: detailurl is missing...' % i)
+        continue
+
+    url = entry["detailurl"]
+    # ID is the 'stable id' of the item generated by base.
+    # Note that this is not the base url expressed as the Atom id element.
+    item_id = entry["id"]
+    # Base URL is the url of the item in base. For Solr we just use the ID hash
+    base_url = item_id
+    snippet = entry.get('description', '')
+    title = entry.get('title', '')
+    location = entry.get('location_string', '')
+
+    categories = entry.get('categories', '')
+    if type(categories).__name__ != 'list':
+      try:
+        categories = categories.split(',')
+      except:
+        categories = []
+
+    vetted = False
+    if 'Vetted' in categories:
+      vetted = True
+
+    is_501c3 = False
+    if entry.get('is_501c3', ''):
+      is_501c3 = True
+
+    org_name = entry.get('org_name', '')
+    if re.search(r'[^a-z]acorn[^a-z]', " "+org_name+" ", re.IGNORECASE):
+      logging.debug('solr_search.query skipping: ACORN in org_name')
+      continue
+
+    latstr = entry["latitude"]
+    longstr = entry["longitude"]
+    virtual = entry.get('virtual')
+    self_directed = entry.get("self_directed")
+    micro = entry.get("micro")
+    volunteers_needed = entry.get("volunteersneeded")
+
+    res = searchresult.SearchResult(url, title, snippet, location, item_id,
+                                    base_url, volunteers_needed, virtual,
+                                    self_directed, micro, categories, org_name, 
+                                    vetted, is_501c3)
+
+    # TODO: escape?
+    res.provider = entry["feed_providername"]
+    if (res.provider == "myproj_servegov" and
+        re.search(r'[^a-z]acorn[^a-z]', " "+result_content+" ", re.IGNORECASE)):
+      # per-provider rule because case-insensitivity
+      logging.info('solr_search.query skipping: ACORN in for myproj_servegov')
+      continue
+
+    res.orig_idx = i+1
+
+    res.latlong = ""
+    res.distance = ''
+    res.duration = ''
+    if latstr and longstr:
+      res.latlong = str(latstr) + "," + str(longstr)
+      try:
+        res.distance = str(solr_search.calc_distance(float(args[api.PARAM_LAT])
+                                              , float(args[api.PARAM_LNG])
+                                              , float(latstr)
+                                              , float(longstr)))
+      except:
+        pass
+
+    # res.event_date_range follows one of these two formats:
+    #     <start_date>T<start_time> <end_date>T<end_time>
+    #     <date>T<time>
+    res.event_date_range = entry["event_date_range"]
+    res.startdate = datetime.datetime.strptime("2000-01-01", "%Y-%m-%d")
+    res.enddate = datetime.datetime.strptime("2038-01-01", "%Y-%m-%d")
+    if not dumping and res.event_date_range:
+      match = solr_search.DATE_FORMAT_PATTERN.findall(res.event_date_range)
+      if not match:
+        logging.debug('solr_search.query skipping record' +
+                        ' %d: bad date range: %s for %s' % 
+                        (i, res.event_date_range, url))
+        continue
+      else:
+        # first match is start date/time
+        startdate = datetime.datetime.strptime(match[0], '%Y-%m-%dT%H:%M:%S')
+        # last match is either end date/time or start/date time
+        enddate = datetime.datetime.strptime(match[-1], '%Y-%m-%dT%H:%M:%S')
+        # protect against absurd dates
+        if startdate > res.startdate:
+          res.startdate = startdate
+        if enddate < res.enddate:
+          res.enddate = enddate
+
+        if res.startdate and res.enddate:
+          delta = res.enddate - res.startdate
+          res.duration = str(delta.days)
+
+    for name in utils.unique_list(apiwriter.STANDARD_FIELDS + apiwriter.EXELIS_FIELDS + apiwriter.HOC_FIELDS + apiwriter.CALENDAR_FIELDS):
+      name = name.lower()
+      if len(name) >= 2 and not hasattr(res, name) or not getattr(res, name, None):
+        value = entry.get(name, '')
+        if not isinstance(value, list):
+          setattr(res, name, str(value))
+        else:
+          setattr(res, name, '\t'.join(value))
+    
+    # posting.py currently has an authoritative list of fields in "argnames"
+    # that are available to submitted events which may later appear in GBase
+    # so with a few exceptions we want those same fields to become
+    # attributes of our result object
+    except_names = ["title", "description"]
+    for name in posting.argnames:
+      if name not in except_names and name.lower() in entry:
+        # Solr field names are all lowercase.
+        # TODO: fix list in posting.py so it matches solr's fieldnames.
+        setattr(res, name, entry[name.lower()])
+
+    result_set.results.append(res)
+
+
+def decode(add_func, content, args):
+  """parse a response and make its results with add_func, as
+  solr_search.query does, then give them merge keys as dedup() does;
+  returns (parse secs, add secs, result set)."""
+  start = time.time()
+  content = re.sub(r';;', ',', content)
+  result = simplejson.loads(content)
+  parsed = time.time()
+  result_set = searchresult.SearchResultSet("", "", [])
+  add_func(result_set, result["response"]["docs"], content, args, False)
+  result_set.assign_merge_keys()
+  return parsed - start, time.time() - parsed, result_set
+
+
+def snapshot(result_set):
+  """every attribute of every result, bar the construction time."""
+  out = []
+  for res in result_set.results:
+    fields = dict(res.__dict__)
+    del fields["pubdate"]
+    out.append(fields)
+  return out
+
+
+def main():
+  """decode the canned response with the old and new loops."""
+  logging.getLogger().setLevel(logging.WARNING)
+  content = make_response()
+  args = {api.PARAM_LAT: "40.0", api.PARAM_LNG: "-75.0"}
+  print "%d docs, %d bytes of json" % (NUM_DOCS, len(content))
+  timings = {}
+  snapshots = {}
+  for name, add_func in (("old", old_add_results),
+                         ("new", solr_search.add_results)):
+    best = None
+    for i in range(ROUNDS):
+      parse_secs, add_secs, result_set = decode(add_func, content, args)
+      if best is None or add_secs < best[1]:
+        best = (parse_secs, add_secs)
+    timings[name] = best
+    snapshots[name] = snapshot(result_set)
+  if snapshots["old"] != snapshots["new"]:
+    raise Exception("add_results() differs from the old loop")
+  print "%4s %10s %10s" % ("", "parse secs", "add+keys secs")
+  for name in ("old", "new"):
+    print "%4s %10.4f %10.4f" % (name, timings[name][0], timings[name][1])
+  print "add_results+assign_merge_keys speedup: %.1fx" % (timings["old"][1] /
+                                        max(timings["new"][1], 0.000001))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,333 @@
+# Copyright 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+which state a search location is in, for the statewide and nationwide
+filters in solr_search.form_solr_query().
+
+geocode.get_statewide() reverse geocodes every location, which is a
+datastore get and on a miss a urlfetch.  get_statewide() here tries,
+cheapest first:
+  STATE_BOXES -- rectangles well inside one state, no lookup at all
+  REVGEO_CELLS_FILENAME -- grid cells the pipeline has reverse geocoded
+    (datahub/revgeo_store.py --export_cells), loaded once per instance
+  an LRU of grid cells, in this instance
+  memcache, then the datastore (StatewideCell), by grid cell
+  geocode.rev_geocode_json(), stored in all of the above
+Locations are snapped to cells of 1/CELLS_PER_DEGREE degrees, so nearby
+searches share one lookup.  The layer each lookup is answered by is
+counted, for the admin page.
+"""
+
+import logging
+import math
+import os
+import threading
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+import geocode_mapsV3 as geocode
+import utils
+
+# about 11km north-south
+CELLS_PER_DEGREE = 10
+LRU_SIZE = 10000
+CACHE_TIME = 7*24*60*60  # seconds
+MEMCACHE_PREFIX = 'statewide:'
+
+STATS_KEY_PREFIX = 'statewide_stats:'
+LAYERS = ['boxes', 'cells', 'lru', 'memcache', 'datastore', 'geocode',
+          'failed']
+
+# (state, min lat, max lat, min lng, max lng), inside the state's land
+# borders with some room to spare (they may take in its coastal waters),
+# checked against the addresses in datahub/geocode_cache.txt.  Anything
+# outside these goes to the cell cache.
+STATE_BOXES = [
+  ('AK', 55.0, 71.5, -167.0, -141.3),
+  ('AL', 31.2, 33.0, -88.0, -85.5),
+  ('AL', 33.0, 34.7, -87.9, -86.0),
+  ('AR', 33.7, 36.2, -94.1, -91.3),
+  ('AR', 33.3, 33.7, -93.8, -91.3),
+  ('AZ', 32.6, 36.7, -113.5, -109.4),
+  ('AZ', 31.7, 32.6, -111.0, -109.4),
+  ('CA', 39.0, 41.7, -123.3, -120.3),
+  ('CA', 36.5, 38.5, -122.6, -119.8),
+  ('CA', 34.0, 36.0, -120.5, -116.3),
+  ('CA', 32.7, 34.0, -118.5, -114.9),
+  ('CO', 37.3, 40.7, -108.7, -102.4),
+  ('CT', 41.25, 41.85, -73.3, -72.1),
+  ('CT', 41.1, 41.25, -73.45, -72.8),
+  ('DC', 38.88, 38.93, -77.03, -76.98),
+  ('FL', 26.0, 29.7, -82.7, -80.4),
+  ('FL', 25.2, 26.0, -81.3, -80.1),
+  ('FL', 30.0, 30.5, -86.8, -83.3),
+  ('FL', 29.7, 30.2, -82.9, -81.3),
+  ('GA', 31.0, 33.3, -84.8, -82.5),
+  ('GA', 33.3, 34.6, -84.8, -83.3),
+  ('HI', 18.8, 22.3, -160.3, -154.7),
+  ('IA', 40.9, 43.2, -95.6, -91.4),
+  ('ID', 42.3, 44.2, -116.7, -111.4),
+  ('IL', 38.3, 42.2, -90.0, -88.2),
+  ('IL', 41.8, 42.3, -88.2, -87.55),
+  ('IN', 39.2, 41.5, -87.2, -85.1),
+  ('IN', 38.5, 39.2, -87.2, -85.8),
+  ('KS', 37.3, 39.7, -101.7, -95.6),
+  ('KY', 36.9, 37.5, -88.0, -83.5),
+  ('KY', 37.5, 38.0, -85.7, -83.0),
+  ('KY', 38.0, 38.4, -85.2, -83.8),
+  ('LA', 30.5, 32.7, -93.2, -91.9),
+  ('LA', 29.8, 30.8, -91.9, -90.0),
+  ('LA', 29.8, 30.5, -93.2, -91.9),
+  ('MA', 42.1, 42.6, -73.2, -70.9),
+  ('MA', 41.5, 42.1, -71.0, -69.9),
+  ('MD', 39.05, 39.6, -77.2, -75.95),
+  ('MD', 38.4, 39.0, -76.85, -75.95),
+  ('ME', 44.0, 45.2, -70.6, -68.0),
+  ('ME', 45.2, 46.5, -69.7, -68.0),
+  ('MI', 42.0, 44.0, -86.0, -83.6),
+  ('MI', 42.6, 43.8, -83.6, -82.8),
+  ('MN', 43.8, 48.2, -96.2, -93.0),
+  ('MO', 36.8, 40.2, -94.3, -91.8),
+  ('MO', 36.8, 38.4, -91.8, -90.6),
+  ('MS', 31.2, 33.5, -90.6, -88.8),
+  ('MS', 33.5, 34.7, -90.3, -88.6),
+  ('MT', 45.3, 48.7, -112.5, -104.4),
+  ('NC', 35.3, 36.3, -81.5, -77.0),
+  ('NC', 35.0, 35.3, -80.6, -77.0),
+  ('NC', 35.3, 35.8, -82.7, -81.5),
+  ('ND', 46.2, 48.7, -103.7, -97.4),
+  ('NE', 40.3, 42.4, -102.0, -96.9),
+  ('NH', 43.0, 44.5, -71.9, -71.2),
+  ('NJ', 39.6, 40.45, -74.6, -74.0),
+  ('NJ', 40.45, 40.75, -74.6, -74.3),
+  ('NJ', 40.75, 40.95, -74.6, -74.1),
+  ('NM', 32.3, 36.7, -108.7, -103.4),
+  ('NV', 39.0, 41.7, -119.7, -114.4),
+  ('NV', 38.0, 39.0, -118.4, -114.4),
+  ('NV', 37.0, 38.0, -117.0, -114.4),
+  ('NV', 36.2, 37.0, -115.6, -114.4),
+  ('NY', 42.3, 43.2, -78.7, -73.7),
+  ('NY', 43.2, 44.0, -76.0, -74.0),
+  ('NY', 40.55, 40.8, -73.96, -73.75),
+  ('NY', 40.55, 40.95, -73.75, -72.0),
+  ('OH', 39.4, 40.0, -84.5, -81.6),
+  ('OH', 40.0, 41.4, -84.5, -80.9),
+  ('OK', 34.6, 36.7, -99.7, -94.9),
+  ('OK', 34.2, 34.6, -97.5, -95.0),
+  ('OR', 42.3, 45.4, -123.8, -117.4),
+  ('PA', 40.0, 41.7, -80.2, -75.5),
+  ('SC', 33.2, 34.5, -81.7, -79.8),
+  ('SC', 32.5, 33.2, -81.2, -80.0),
+  ('SD', 43.3, 45.6, -103.7, -96.9),
+  ('TN', 35.3, 36.3, -89.3, -84.5),
+  ('TN', 35.6, 36.3, -84.5, -83.8),
+  ('TX', 31.0, 32.0, -103.6, -94.4),
+  ('TX', 32.0, 33.3, -102.7, -94.4),
+  ('TX', 33.3, 34.0, -102.7, -99.0),
+  ('TX', 34.0, 36.2, -102.7, -100.3),
+  ('TX', 29.6, 31.0, -100.5, -94.2),
+  ('TX', 27.8, 29.6, -99.0, -96.8),
+  ('UT', 37.3, 40.7, -113.7, -109.4),
+  ('VA', 36.9, 37.7, -80.0, -76.5),
+  ('VA', 37.7, 38.1, -79.5, -77.1),
+  ('VT', 42.9, 44.8, -73.0, -72.6),
+  ('WA', 46.4, 48.2, -123.5, -117.4),
+  ('WA', 48.2, 48.7, -122.8, -117.4),
+  ('WI', 42.7, 45.3, -90.8, -88.2),
+  ('WI', 42.7, 44.0, -88.2, -87.95),
+  ('WV', 37.9, 38.7, -81.9, -80.4),
+  ('WV', 38.7, 39.1, -81.3, -80.4),
+  ('WY', 41.3, 44.7, -110.7, -104.4),
+]
+
+# cell<tab>state<tab>country lines, for cells whose reverse geocodes in
+# the pipeline all agree
+REVGEO_CELLS_FILENAME = 'revgeo_cells.txt'
+
+# STATE_BOXES by whole degree of latitude
+box_index = {}
+for box in STATE_BOXES:
+  for band in range(int(math.floor(box[1])), int(math.ceil(box[2]))):
+    box_index.setdefault(band, []).append(box)
+
+
+class StatewideCell(db.Model):
+  """ key = cell, see get_cell() """
+  state = db.StringProperty()
+  country = db.StringProperty()
+
+
+lru = utils.LRUCache(LRU_SIZE)
+
+# cell -> (state, country) from REVGEO_CELLS_FILENAME, loaded on first use
+revgeo_cells = None
+# held while revgeo_cells is loaded
+cells_lock = threading.Lock()
+
+# lookups answered by each layer
+stats = utils.Stats(STATS_KEY_PREFIX, LAYERS)
+
+
+def get_stats():
+  """totals for every instance, for the admin page."""
+  counts = stats.get()
+  lookups = sum(counts.values())
+  layers = []
+  for name in LAYERS:
+    if lookups:
+      percent = '%4.1f%%' % ((100.0 * counts[name]) / lookups)
+    else:
+      percent = 'n/a'
+    layers.append({'name': name, 'count': counts[name], 'percent': percent})
+  return {'lookups': lookups, 'layers': layers, 'lru_entries': len(lru)}
+
+
+def get_box_state(lat, lng):
+  """the state from STATE_BOXES, or None."""
+  for state, min_lat, max_lat, min_lng, max_lng in box_index.get(
+      int(math.floor(lat)), ()):
+    if min_lat <= lat < max_lat and min_lng <= lng < max_lng:
+      return state
+  return None
+
+
+def load_revgeo_cells(path):
+  """cell -> (state, country), as geocode.statewide_from_json() gives,
+  from a revgeo_cells.txt file; empty if there isn't one."""
+  cells = {}
+  try:
+    fh = open(path, 'r')
+  except IOError:
+    logging.warning("statewide: no " + path)
+    return cells
+  try:
+    for line in fh:
+      cell, state, country = line.rstrip('\n\r').split('\t')
+      if country != 'US':
+        state += '-' + country
+      cells[cell] = (state, country)
+  finally:
+    fh.close()
+  logging.info("statewide: loaded %d cells" % len(cells))
+  return cells
+
+
+def get_revgeo_cells():
+  """revgeo_cells, loading it on first use."""
+  global revgeo_cells
+  if revgeo_cells is None:
+    cells_lock.acquire()
+    try:
+      if revgeo_cells is None:
+        revgeo_cells = load_revgeo_cells(os.path.join(
+          os.path.dirname(__file__), REVGEO_CELLS_FILENAME))
+    finally:
+      cells_lock.release()
+  return revgeo_cells
+
+
+def get_cell(lat, lng):
+  """the grid cell a location is in."""
+  return '%d,%d' % (int(math.floor(lat * CELLS_PER_DEGREE)),
+                     int(math.floor(lng * CELLS_PER_DEGREE)))
+
+
+def get_stored(cell):
+  """(state, country) for cell from memcache or the datastore, and the
+  layer it came from, or (None, None)."""
+  try:
+    value = memcache.get(MEMCACHE_PREFIX + cell)
+  except:
+    logging.warning("statewide: memcache get failed")
+    value = None
+  if value:
+    return tuple(value.split('|')), 'memcache'
+
+  try:
+    rec = StatewideCell.get_by_key_name(cell)
+  except:
+    logging.warning("statewide: datastore get failed")
+    rec = None
+  if rec:
+    found = (rec.state, rec.country)
+    set_memcache(cell, found)
+    return found, 'datastore'
+  return None, None
+
+
+def set_memcache(cell, found):
+  """cache a cell's (state, country)."""
+  try:
+    memcache.set(MEMCACHE_PREFIX + cell, '|'.join(found), time=CACHE_TIME)
+  except:
+    logging.warning("statewide: memcache set failed")
+
+
+def store(cell, found):
+  """save a newly reverse geocoded cell."""
+  try:
+    StatewideCell(key_name=cell, state=found[0], country=found[1]).put()
+  except:
+    logging.warning("statewide: datastore put failed")
+  set_memcache(cell, found)
+
+
+def get_statewide(lat, lng):
+  """(state, country) for a location, as geocode.get_statewide() gives."""
+  found, layer = lookup(lat, lng)
+  stats.record(layer)
+  stats.flush()
+  if not found:
+    return geocode.DEFAULT_STATE, geocode.DEFAULT_COUNTRY
+  return found
+
+
+def lookup(lat, lng):
+  """(state, country) or None, and the layer that answered."""
+  try:
+    lat = float(lat)
+    lng = float(lng)
+  except (TypeError, ValueError):
+    logging.warning('statewide: given ' + str(lat) + ',' + str(lng))
+    return None, 'failed'
+  # also false for nan
+  if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+    logging.warning('statewide: given ' + str(lat) + ',' + str(lng))
+    return None, 'failed'
+
+  state = get_box_state(lat, lng)
+  if state:
+    return (state, 'US'), 'boxes'
+
+  cell = get_cell(lat, lng)
+  found = get_revgeo_cells().get(cell)
+  if found:
+    return found, 'cells'
+
+  found = lru.get(cell)
+  if found:
+    return found, 'lru'
+
+  found, layer = get_stored(cell)
+  if not found:
+    found = geocode.statewide_from_json(geocode.rev_geocode_json(lat, lng))
+    if not found:
+      # nothing cached, so it's tried again next time
+      return None, 'failed'
+    store(cell, found)
+    layer = 'geocode'
+  lru.put(cell, found)
+  return found, layer
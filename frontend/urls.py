@@ -27,6 +27,7 @@ URL_MY_EVENTS = '/myevents'
 URL_FRIENDS = '/friends'
 URL_POST = '/post'
 URL_ADMIN = '/admin'
+URL_FLUSH_COUNTERS = '/admin/flush_counters'
 URL_MODERATE = '/moderate'
 URL_MODERATE_BLACKLIST = '/moderateblacklist'
 URL_UI_SNIPPETS = '/ui_snippets'
@@ -26,6 +26,7 @@ import os
 from django.utils import simplejson
 from versioned_memcache import memcache
 from google.appengine.api import urlfetch
+from google.appengine.ext import db
 from StringIO import StringIO
 from facebook import Facebook
 
@@ -97,6 +98,14 @@ class User(object):
                                                           self.user_id)
     return self.user_info
 
+  def get_user_info_key(self):
+    """The key of this user's UserInfo, without loading or creating it."""
+    if self.user_info:
+      return self.user_info.key()
+    return db.Key.from_path(
+        models.UserInfo.kind(),
+        models.UserInfo.make_key_name(self.account_type, self.user_id))
+
   def load_friends(self):
     key_suffix = self.account_type + ":" + self.user_id
     key = 'friends:' + key_suffix
@@ -19,9 +19,16 @@ Miscellaneous utility functions.
 import hmac
 import logging
 import os
+import threading
+import time
 
 from xml.dom import minidom
 
+from google.appengine.api import memcache
+
+# how often a Stats adds its counters to the memcache totals
+STATS_FLUSH_INTERVAL = 60  # seconds
+
 
 class Error(Exception):
   pass
@@ -149,3 +156,103 @@ def unique_list(seq):
   seen = set()
   seen_add = seen.add
   return [ x for x in seq if x not in seen and not seen_add(x)]
+
+
+class LRUCache(object):
+  """the size most recently used entries."""
+  def __init__(self, size):
+    self.size = size
+    self.entries = {}
+    self.lock = threading.Lock()
+    # circular list of [prev, next, key, value], most recent next to head
+    self.head = [None, None, None, None]
+    self.head[0] = self.head[1] = self.head
+
+  def unlink(self, link):
+    """take link out of the list."""
+    link[0][1] = link[1]
+    link[1][0] = link[0]
+
+  def push(self, link):
+    """make link the most recent."""
+    link[0] = self.head
+    link[1] = self.head[1]
+    self.head[1][0] = link
+    self.head[1] = link
+
+  def get(self, key):
+    """value for key, or None."""
+    self.lock.acquire()
+    try:
+      link = self.entries.get(key)
+      if link is None:
+        return None
+      self.unlink(link)
+      self.push(link)
+      return link[3]
+    finally:
+      self.lock.release()
+
+  def put(self, key, value):
+    """add or replace key, dropping the least recently used entry if full."""
+    self.lock.acquire()
+    try:
+      link = self.entries.get(key)
+      if link is None:
+        if len(self.entries) >= self.size:
+          oldest = self.head[0]
+          self.unlink(oldest)
+          del self.entries[oldest[2]]
+        link = [None, None, key, None]
+        self.entries[key] = link
+      else:
+        self.unlink(link)
+      link[3] = value
+      self.push(link)
+    finally:
+      self.lock.release()
+
+  def __len__(self):
+    return len(self.entries)
+
+
+class Stats(object):
+  """counters for the admin page, totalled across instances in memcache.
+  Each instance adds up its own and adds them to the totals every
+  STATS_FLUSH_INTERVAL seconds."""
+  def __init__(self, key_prefix, names):
+    self.key_prefix = key_prefix
+    self.names = names
+    # counters not yet added to the memcache totals
+    self.pending = {}
+    self.flushed = time.time()
+
+  def record(self, name, delta=1):
+    """count an event."""
+    self.pending[name] = self.pending.get(name, 0) + delta
+
+  def flush(self, force=False):
+    """add the counters to the totals in memcache, if it's been
+    STATS_FLUSH_INTERVAL seconds or force."""
+    now = time.time()
+    if not self.pending or (not force and
+                            now - self.flushed < STATS_FLUSH_INTERVAL):
+      return
+    pending, self.pending = self.pending, {}
+    self.flushed = now
+    try:
+      memcache.offset_multi(pending, key_prefix=self.key_prefix,
+                            initial_value=0)
+    except:
+      logging.warning("Stats.flush failed for " + self.key_prefix)
+
+  def get(self):
+    """name -> total for every instance."""
+    self.flush(True)
+    totals = dict([(name, 0) for name in self.names])
+    try:
+      totals.update(memcache.get_multi(self.names,
+                                       key_prefix=self.key_prefix))
+    except:
+      logging.warning("Stats.get failed for " + self.key_prefix)
+    return totals
@@ -21,6 +21,137 @@ import models
 import modelutils
 
 from django.utils import simplejson
+from google.appengine.api import memcache
+
+# a user's interests are cached this long, and updated when they change
+USER_INTERESTS_CACHE_TIME = 60*60  # seconds
+USER_INTERESTS_PREFIX = 'UserInterests:'
+# UserInterest rows fetched per round trip
+USER_INTERESTS_BATCH = 500
+# the most friends whose interests are looked up for the snippets
+MAX_FRIENDS = 50
+
+
+def user_interests_query(key):
+  """A user's UserInterest rows, most-recent-first.
+
+  Args:
+    key: key of the user's models.UserInfo
+  """
+  return models.UserInterest.all().filter('user = ', key)\
+         .order('-liked_last_modified')
+
+
+def start_user_interests(users):
+  """Starts looking up the interests of some users: memcache first, then
+  a UserInterest query for each user not there, all running at once.
+
+  Args:
+    users: list of userinfo.User
+  Returns:
+    The rpc to pass to get_users_interests().
+  """
+  key_names = [user.get_user_info_key().name() for user in users]
+  try:
+    cached = memcache.get_multi(key_names, key_prefix=USER_INTERESTS_PREFIX)
+  except:
+    logging.warning("view_helper.start_user_interests memcache failed")
+    cached = {}
+
+  queries = {}
+  for user in users:
+    key = user.get_user_info_key()
+    if key.name() not in cached and key.name() not in queries:
+      # run() starts the query without waiting for it
+      queries[key.name()] = user_interests_query(key).run(
+        batch_size=USER_INTERESTS_BATCH)
+
+  return (key_names, cached, queries)
+
+
+def get_users_interests(rpc):
+  """Gets the interests started by start_user_interests().
+
+  Args:
+    rpc: from start_user_interests()
+  Returns:
+    For each user, a list of (opportunity id, expressed interest (liked)),
+    most-recent-first.
+  """
+  (key_names, interests, queries) = rpc
+  fetched = {}
+  for (key_name, query) in queries.iteritems():
+    fetched[key_name] = [(interest.opp_id,
+                          getattr(interest, models.USER_INTEREST_LIKED))
+                         for interest in query]
+  if fetched:
+    try:
+      memcache.set_multi(fetched, time=USER_INTERESTS_CACHE_TIME,
+                         key_prefix=USER_INTERESTS_PREFIX)
+    except:
+      logging.warning("view_helper.get_users_interests memcache failed")
+    interests.update(fetched)
+
+  return [interests[key_name] for key_name in key_names]
+
+
+def clear_user_interests(user_info):
+  """Drop a user's cached interests, after they change.
+
+  Args:
+    user_info: models.UserInfo of the user
+  """
+  try:
+    memcache.delete(USER_INTERESTS_PREFIX + user_info.key().name())
+  except:
+    logging.warning("view_helper.clear_user_interests memcache failed")
+
+
+def update_user_interest(user_info, opp_id, liked):
+  """Put a user's new interest in an opportunity into their cached
+  interests, after writing it.  The UserInterest query is eventually
+  consistent, so querying again now could cache the list from before
+  the write for USER_INTERESTS_CACHE_TIME.
+
+  Args:
+    user_info: models.UserInfo of the user
+    opp_id: the opportunity's id
+    liked: the expressed interest
+  """
+  cache_key = USER_INTERESTS_PREFIX + user_info.key().name()
+  try:
+    interests = memcache.get(cache_key)
+  except:
+    logging.warning("view_helper.update_user_interest memcache failed")
+    interests = None
+  if interests is None:
+    interests = [(interest.opp_id,
+                  getattr(interest, models.USER_INTEREST_LIKED))
+                 for interest in user_interests_query(user_info.key()).run(
+                   batch_size=USER_INTERESTS_BATCH)]
+
+  interests = [(opp_id, liked)] + [(interest_opp_id, interest_value)
+                                   for (interest_opp_id, interest_value)
+                                   in interests if interest_opp_id != opp_id]
+  try:
+    if memcache.set(cache_key, interests, time=USER_INTERESTS_CACHE_TIME):
+      return
+  except:
+    pass
+  logging.warning("view_helper.update_user_interest memcache failed")
+  clear_user_interests(user_info)
+
+
+def interests_to_dict(interests, remove_no_interest):
+  """Dictionary and order of a list from get_users_interests()."""
+  user_interests = {}
+  ordered_event_ids = []
+  for (opp_id, interest_value) in interests:
+    if not remove_no_interest or interest_value != 0:
+      user_interests[opp_id] = interest_value
+      ordered_event_ids.append(opp_id)
+  return (user_interests, ordered_event_ids)
+
 
 def get_user_interests(user, remove_no_interest):
   """Get the opportunities a user has expressed interest in.
@@ -29,33 +160,42 @@ def get_user_interests(user, remove_no_interest):
     user: userinfo.User of a user
     remove_no_interest: Filter out items with no expressed interest.
   Returns:
-    Dictionary of volunteer opportunity id: expressed interest (liked).
+    Dictionary of volunteer opportunity id: expressed interest (liked),
+    and the ids most-recent-first.
   """
-  user_interests = {}
-  if user:
-    user_info = user.get_user_info()
-    # Note: If we want a limit, tack "fetch(nnn)" on the end of the query.
-    # Also note the descending order, most-recent-first.
-
-    interests = models.UserInterest.all().filter('user = ', user_info)\
-                .order('-liked_last_modified')
-    #interests = models.UserInterest.all().filter('user = ', user_info)
-
-    ordered_event_ids = []
-    for interest in interests:
-      interest_value = getattr(interest, models.USER_INTEREST_LIKED)
-      if not remove_no_interest or interest_value != 0:
-        user_interests[interest.opp_id] = interest_value
-        ordered_event_ids.append(interest.opp_id)
+  if not user:
+    return ({}, [])
 
-  return (user_interests, ordered_event_ids)
+  interests = get_users_interests(start_user_interests([user]))[0]
+  return interests_to_dict(interests, remove_no_interest)
+
+
+def start_interest_for_opportunities(opp_ids):
+  """Starts get_interest_for_opportunities().
+
+  Args:
+    opp_ids: list of volunteer opportunity ids.
+
+  Returns:
+    The rpc to pass to get_interest_for_opportunities(), or None.
+  """
+  try:
+    return modelutils.start_get_by_ids(models.VolunteerOpportunityStats,
+                                       opp_ids)
+  except:
+    e, v = sys.exc_info()[:2]
+    logging.error("view_helper.start_interest_for_opportunities %s %s" %
+                  (e, v))
+    return None
 
 
-def get_interest_for_opportunities(opp_ids):
+def get_interest_for_opportunities(opp_ids, rpc=None):
   """Get the interest statistics for a set of volunteer opportunities.
 
   Args:
     opp_ids: list of volunteer opportunity ids.
+    rpc: from start_interest_for_opportunities(opp_ids), if it was
+        started already.
 
   Returns:
     Dictionary of volunteer opportunity id: aggregated interest values.
@@ -63,11 +203,18 @@ def get_interest_for_opportunities(opp_ids):
   others_interests = {}
   try:
     # this can time out
-    interests = modelutils.get_by_ids(models.VolunteerOpportunityStats, opp_ids)
+    interests = modelutils.get_by_ids(models.VolunteerOpportunityStats,
+                                      opp_ids, rpc)
     for (item_id, interest) in interests.iteritems():
       if interest:
         others_interests[item_id] = getattr(interest, 
                                      models.USER_INTEREST_LIKED)
+    # plus the likes not yet flushed to the datastore
+    pending = models.VolunteerOpportunityStats.get_pending_interests(
+        opp_ids, [models.USER_INTEREST_LIKED])
+    for (item_id, deltas) in pending.iteritems():
+      others_interests[item_id] = (others_interests.get(item_id) or 0) + \
+          deltas[models.USER_INTEREST_LIKED]
   except:
     e, v = sys.exc_info()[:2]
     logging.error("view_helper.get_interest_for_opportunities %s %s" % (e, v))
@@ -88,11 +235,13 @@ def get_annotated_results(user, result_set):
   # Get all the ids of items we've found
   opp_ids = [result.item_id for result in result_set.results]
 
-  # mark the items the user is interested in
+  # start the lookup of the interest of others, and mark the items the
+  # user is interested in while it runs
+  others_rpc = start_interest_for_opportunities(opp_ids)
   (user_interests, ordered_event_ids) = get_user_interests(user, True)
 
   # note the interest of others
-  others_interests = get_interest_for_opportunities(opp_ids)
+  others_interests = get_interest_for_opportunities(opp_ids, others_rpc)
 
   return annotate_results(user_interests, others_interests, result_set)
 
@@ -135,13 +284,15 @@ def get_friends_data_for_snippets(user_info):
   friends = user_info.load_friends()
   
   # For each of my friends, get the list of all events that that friend likes
-  # or is doing.
+  # or is doing, looking them all up at once, for the first MAX_FRIENDS.
   # For each of the events found, cross-reference the list of its interested
   # users.
   friend_opp_count = {}
   friends_by_event_id = {}
-  for friend in friends:
-    (user_interests, ordered_event_ids) = get_user_interests(friend, True)
+  looked_up = friends[:MAX_FRIENDS]
+  all_interests = get_users_interests(start_user_interests(looked_up))
+  for (friend, interests) in zip(looked_up, all_interests):
+    (user_interests, ordered_event_ids) = interests_to_dict(interests, True)
     for event_id in user_interests:
       count = friend_opp_count.get(event_id, 0)
       friend_opp_count[event_id] = count + 1
@@ -58,14 +58,20 @@ from google.appengine.ext.webapp import template
 from google.appengine.runtime import DeadlineExceededError
 
 from third_party.recaptcha.client import captcha
+# registers PageCountShard with counters, so flush_counters_view writes it
+from fastpageviews import pagecount
 
 import api
+import counters
+import fragment_cache
 import solr_search
 import geocode_mapsV3 as geocode
 import models
 import modelutils
 import posting
+import result_cache
 import search
+import statewide
 import urls
 import userinfo
 import utils
@@ -442,7 +448,8 @@ class search_view(webapp.RequestHandler):
         result_set = solr_search.apply_HOC_facet_counts(result_set, unique_args)
 
       writer = apiwriter.get_writer(output)
-      writer.setup(self.request, result_set)
+      self.response.headers["Content-Type"] = writer.content_type
+      writer.setup(self.request, result_set, self.response.out)
       logging.info('views.search_view clipped %d, beginning apiwriter' % 
                   len(result_set.clipped_results))
 
@@ -451,7 +458,6 @@ class search_view(webapp.RequestHandler):
 
       logging.info('views.search_view completed apiwriter')
 
-      self.response.headers["Content-Type"] = writer.content_type
       self.response.out.write(writer.finalize())
       logging.info('views.search_view completed %d' % 
                   len(result_set.clipped_results))
@@ -636,6 +642,10 @@ class admin_view(webapp.RequestHandler):
       memcache_stats['size'] = memcache_stats['bytes'] / 1024
       memcache_stats['size_unit'] = 'KB'
     template_values['memcache_stats'] = memcache_stats
+    template_values['result_cache_stats'] = result_cache.get_stats()
+    template_values['statewide_stats'] = statewide.get_stats()
+    template_values['counter_stats'] = counters.get_stats()
+    template_values['fragment_cache_stats'] = fragment_cache.get_stats()
 
     action = self.request.get('action')
     if not action:
@@ -783,6 +793,20 @@ class redirect_view(webapp.RequestHandler):
                 '<a href="javascript:history.go(-1)">go back</a>.')
     self.response.out.write(response)
 
+class flush_counters_view(webapp.RequestHandler):
+  """writes the counts buffered by counters to the datastore, from cron.
+  app.yaml limits /admin/ to admins, which cron requests are."""
+  @expires(0)
+  def get(self):
+    """HTTP get method."""
+    written = counters.flush()
+    self.response.headers['Content-Type'] = 'text/plain'
+    if written is None:
+      self.response.out.write('another flush is running\n')
+    else:
+      self.response.out.write('flushed %d\n' % written)
+
+
 class moderate_view(webapp.RequestHandler):
   """fast UI for voting/moderating on listings."""
 
@@ -1004,6 +1028,7 @@ class action_view(webapp.RequestHandler):
       modelutils.set_entity_attributes(user_interest,
                                  { models.USER_INTEREST_LIKED: new_value },
                                  None)
+    view_helper.update_user_interest(user_entity, opp_id, new_value)
 
     if deltas is not None:  # Explicit check against None.
       success = models.VolunteerOpportunityStats.increment(opp_id, deltas)
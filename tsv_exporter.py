@@ -20,20 +20,40 @@ Usage:
   %s [flags]
 
     --url=<string>      URL endpoint to get exported data. (Required)
-    --batch_size=<int>  Number of Entity objects to include in each post to
-                        smaller the batch size should be. (Default 1000)
+    --batch_size=<int>  Number of Entity objects to include in each
+                        response. (Default 1000)
     --filename=<path>   Path to the TSV file to export. (Required)
     --digsig=<string>   value passed to endpoint permitting export
+    --prefix=<string>   prepended to each line written
+    --ranges=<int>      Number of key ranges to pull in parallel. (Default 1)
+    --resume            carry on from where an interrupted export stopped
+
+Each key range is pulled to its own <filename>.<n> part file, with its
+progress (the length of the part file and the cursor to carry on from)
+in <filename>.<n>.state after every response, so --resume can pick up
+from there.  When every range is done the parts are appended to
+<filename> in key order and removed.
 
 The exit status will be 0 on success, non-zero on failure.
 """
 
+import os
 import sys
-import re
+import time
 import logging
 import getopt
+import urllib
 import urllib2
 import datetime
+import threading
+
+# the last line of each response: the cursor for the next rows, or the end
+CURSOR_MARKER = "__cursor__"
+END_MARKER = "__end__"
+
+# attempts at each response before giving up, and the wait after the first
+RETRIES = 5
+RETRY_SECS = 2
 
 def PrintUsageExit(code):
   print sys.modules['__main__'].__doc__ % sys.argv[0]
@@ -41,51 +61,113 @@ def PrintUsageExit(code):
   sys.stderr.flush()
   sys.exit(code)
 
-def Pull(filename, url, min_key, delim, prefix):
-  # get content from url and write to filename
+def GetRanges(url, digsig, ranges):
+  """ split the table into key ranges, as (start, end) pairs """
+  url_step = "%s?%s" % (url, urllib.urlencode({'digsig': digsig,
+                                                'ranges': ranges}))
+  connection = urllib2.urlopen(url_step)
   try:
-    connection = urllib2.urlopen(url);
-    # TODO: read 100 lines incrementally and show progress
-    content = connection.read()
+    lines = connection.read().splitlines()
+  finally:
     connection.close()
-  except urllib2.URLError, e:
-    logging.error('%s returned error %i, %s' % (url, e.code, e.msg))
-    sys.exit(2)
+  return [tuple(line.split("\t")) for line in lines]
 
+def ReadState(state_filename):
+  """ the (offset, cursor) saved for a part, cursor None once it's done """
+  state_file = open(state_filename)
   try:
-    tsv_file = file(filename, 'a')
-  except IOError:
-    logging.error("I/O error({0}): {1}".format(errno, os.strerror(errno)))
-    sys.exit(3)
-
-  if prefix:
-    lines = content.split("\n")
-    lines.pop()
-    content = ("%s" % prefix) + ("\n%s" % prefix).join(lines) + "\n"
-
-  tsv_file.write(content)
-  tsv_file.close()
+    fields = state_file.read().strip().split("\t")
+  finally:
+    state_file.close()
+  if fields[0] == END_MARKER:
+    return int(fields[1]), None
+  return int(fields[0]), fields[1]
 
-  # count the number of lines
-  list = content.splitlines()
-  line_count = len(list)
-  last_line = list[line_count - 1]
-  if min_key == "":
-    # that's our header, don't count it
-    line_count -= 1
+def WriteState(state_filename, offset, cursor):
+  """ save where a part got to; rename so it's never half written """
+  state_file = open(state_filename + ".tmp", "w")
+  try:
+    if cursor is None:
+      state_file.write("%s\t%d\n" % (END_MARKER, offset))
+    else:
+      state_file.write("%d\t%s\n" % (offset, cursor))
+  finally:
+    state_file.close()
+  if os.path.exists(state_filename):
+    os.remove(state_filename)
+  os.rename(state_filename + ".tmp", state_filename)
 
-  # get the key value of the last line
-  fields = last_line.split(delim)
-  min_key = fields[0][4:]
+def Pull(tsv_file, url, prefix):
+  """
+  get one response from url, writing its rows to tsv_file as they
+  arrive.  Returns the cursor for the next rows, or None at the end of
+  the range, and the number of rows.
+  """
+  connection = urllib2.urlopen(url)
+  try:
+    line_count = 0
+    for line in connection:
+      line = line.rstrip("\n")
+      if line == END_MARKER:
+        return None, line_count
+      if line.startswith(CURSOR_MARKER + "\t"):
+        return line[len(CURSOR_MARKER) + 1:], line_count
+      tsv_file.write("%s%s\n" % (prefix, line))
+      line_count += 1
+  finally:
+    connection.close()
+  raise IOError("response from %s was cut short" % url)
 
-  return min_key, line_count
+def PullRange(part_filename, url, digsig, batch_size, prefix, start, end,
+              offset=0, cursor=""):
+  """
+  pull one key range into part_filename, starting offset bytes in and
+  from cursor, saving the state after each response
+  """
+  state_filename = part_filename + ".state"
+  if offset:
+    tsv_file = open(part_filename, "r+b")
+  else:
+    tsv_file = open(part_filename, "wb")
+  try:
+    total = 0
+    while cursor is not None:
+      params = {'digsig': digsig, 'limit': batch_size,
+                'start': start, 'end': end, 'cursor': cursor}
+      url_step = "%s?%s" % (url, urllib.urlencode(params))
+      t0 = datetime.datetime.now()
+      attempt = 0
+      while True:
+        # drop anything written by a response that failed part way
+        tsv_file.seek(offset)
+        tsv_file.truncate()
+        try:
+          next_cursor, lines = Pull(tsv_file, url_step, prefix)
+          break
+        except (IOError, urllib2.URLError), e:
+          attempt += 1
+          if attempt >= RETRIES:
+            raise
+          logging.warning('%s, retrying: %s', part_filename, e)
+          time.sleep(RETRY_SECS * (2 ** (attempt - 1)))
+      tsv_file.flush()
+      offset = tsv_file.tell()
+      cursor = next_cursor
+      WriteState(state_filename, offset, cursor)
+      total += lines
+      diff = datetime.datetime.now() - t0
+      secs = "%d.%03d" % (diff.seconds, diff.microseconds/1000)
+      logging.info('%s: fetched %d in %s secs, %d so far',
+                   part_filename, lines, secs, total)
+  finally:
+    tsv_file.close()
 
 def ParseArguments(argv):
   opts, args = getopt.getopt(
     argv[1:],
     'dh',
-    ['debug', 'help', 
-     'url=', 'filename=', 'prefix=', 'digsig=', 'batch_size='
+    ['debug', 'help', 'resume',
+     'url=', 'filename=', 'prefix=', 'digsig=', 'batch_size=', 'ranges='
     ])
 
   url = None
@@ -93,6 +175,8 @@ def ParseArguments(argv):
   digsig = ''
   prefix = ''
   batch_size = 1000
+  ranges = 1
+  resume = False
 
   for option, value in opts:
     if option == '--debug':
@@ -107,45 +191,111 @@ def ParseArguments(argv):
       prefix = value
     if option == '--digsig':
       digsig = value
+    if option == '--resume':
+      resume = True
     if option == '--batch_size':
       batch_size = int(value)
       if batch_size <= 0:
         print >>sys.stderr, 'batch_size must be 1 or larger'
         PrintUsageExit(1)
+    if option == '--ranges':
+      ranges = int(value)
+      if ranges <= 0:
+        print >>sys.stderr, 'ranges must be 1 or larger'
+        PrintUsageExit(1)
 
-  return (url, filename, batch_size, prefix, digsig)
+  return (url, filename, batch_size, prefix, digsig, ranges, resume)
 
 def main(argv):
   logging.basicConfig(
 	level=logging.INFO,
-	format='%(levelname)-8s %(asctime)s %(message)s')
+	format='%(levelname)-8s %(asctime)s %(threadName)s %(message)s')
 
   args = ParseArguments(argv)
   if [arg for arg in args if arg is None]:
     print >>sys.stderr, 'Invalid arguments'
     PrintUsageExit(1)
 
-  url, filename, batch_size, prefix, digsig = args
+  url, filename, batch_size, prefix, digsig, ranges, resume = args
 
-  delim = "\t"
-  min_key = ""
-  lines = batch_size + 2
-  while lines >= batch_size:
-    url_step = ("%s?digsig=%s&min_key=%s&limit=%s" %
-                 (url, str(digsig), str(min_key), str(batch_size)))
-    if min_key != "":
-      log_key = min_key
-    else:
-      log_key = "[start]"
-    t0 = datetime.datetime.now()
-    min_key, lines = Pull(filename, url_step, min_key, delim, prefix)
-    #print min_key
-    diff = datetime.datetime.now() - t0
-    secs = "%d.%d" % (diff.seconds, diff.microseconds/1000)
-    logging.info('fetched header + %d in %s secs from %s', lines, secs, log_key)
+  # the ranges are kept with the parts: a cursor is only good
+  # for the range it came from
+  ranges_filename = filename + ".ranges"
+  if resume and os.path.exists(ranges_filename):
+    ranges_file = open(ranges_filename)
+    try:
+      key_ranges = [tuple(line.rstrip("\n").split("\t"))
+                    for line in ranges_file]
+    finally:
+      ranges_file.close()
+  else:
+    try:
+      key_ranges = GetRanges(url, digsig, ranges)
+    except urllib2.URLError, e:
+      logging.error('%s returned error %s', url, e)
+      return 2
+    ranges_file = open(ranges_filename, "w")
+    try:
+      for start, end in key_ranges:
+        ranges_file.write("%s\t%s\n" % (start, end))
+    finally:
+      ranges_file.close()
+  logging.info('pulling %d key ranges', len(key_ranges))
+
+  failed = []
+  def Run(part_filename, start, end):
+    """ pull a range, noting failures for the exit status """
+    try:
+      offset, cursor = 0, ""
+      if resume and os.path.exists(part_filename + ".state"):
+        offset, cursor = ReadState(part_filename + ".state")
+      PullRange(part_filename, url, digsig, batch_size, prefix, start, end,
+                offset, cursor)
+    except Exception, e:
+      logging.error('%s failed: %s', part_filename, e)
+      failed.append(part_filename)
+
+  threads = []
+  part_filenames = []
+  for i, (start, end) in enumerate(key_ranges):
+    part_filename = "%s.%d" % (filename, i)
+    part_filenames.append(part_filename)
+    thread = threading.Thread(target=Run, name="range%d" % i,
+                              args=(part_filename, start, end))
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+
+  if failed:
+    logging.error('%d ranges failed, rerun with --resume to carry on',
+                  len(failed))
+    return 2
 
+  try:
+    tsv_file = open(filename, 'ab')
+  except IOError, e:
+    logging.error("I/O error({0}): {1}".format(e.errno, e.strerror))
+    return 3
+  try:
+    for part_filename in part_filenames:
+      part_file = open(part_filename, 'rb')
+      try:
+        while True:
+          block = part_file.read(1 << 20)
+          if not block:
+            break
+          tsv_file.write(block)
+      finally:
+        part_file.close()
+  finally:
+    tsv_file.close()
+
+  for part_filename in part_filenames:
+    os.remove(part_filename)
+    os.remove(part_filename + ".state")
+  os.remove(ranges_filename)
   return 0
 
 if __name__ == '__main__':
   sys.exit(main(sys.argv))
-